@@ -1,14 +1,37 @@
 #!/usr/bin/env python3
-"""Create all the split route files for Ethical_AI_Reg API refactor."""
+"""Create all the split route files for Ethical_AI_Reg API refactor.
+
+Writes every entry of ``files_to_create`` under a target root: the
+``backend/app`` directory of a checkout. Pass the root as --target or in
+ETHICAL_AI_TARGET; it defaults to ./backend/app.
+
+A file is written only when its content differs from what is on disk. The
+write goes to a temporary file next to the target and is renamed over it, so
+an interrupted run never leaves a half-written module, and unchanged files keep
+their mtimes. A manifest of SHA-256 hashes (MANIFEST_NAME) is kept in the
+target root.
+
+    python create_ethical_files.py --target path/to/backend/app
+    python create_ethical_files.py --check    # show the diff, write nothing; exit 1 if stale
+"""
 import os
 import sys
+import json
+import difflib
+import hashlib
+import argparse
+import tempfile
 
-BASE = os.path.join('E:', os.sep, 'Agents', 'Ethical_AI_Reg', 'backend', 'app')
-ROUTES = os.path.join(BASE, 'routes')
+TARGET_ENV = "ETHICAL_AI_TARGET"
+DEFAULT_TARGET = os.path.join('backend', 'app')
+MANIFEST_NAME = '.generated_manifest.json'
 
-# Create routes directory
-os.makedirs(ROUTES, exist_ok=True)
-print(f"Created: {ROUTES}")
+# Keys of files_to_create are paths relative to the target root
+BASE = ''
+ROUTES = os.path.join(BASE, 'routes')
+MODULES = os.path.join(BASE, 'modules')
+BENCHMARKS = os.path.join(BASE, 'benchmarks')
+TESTS = os.path.join(BASE, 'tests')
 
 files_to_create = {}
 
@@ -19,8 +42,15 @@ files_to_create[os.path.join(BASE, 'api_config.py')] = '''\
 """Shared constants, configuration helpers, and utilities for API routes."""
 
 import os
+import time
+import signal
+import hashlib
 import logging
-from typing import Dict, Any, Optional
+import threading
+from types import MappingProxyType
+from typing import Dict, Any, Mapping, NamedTuple, Optional, Tuple
+
+from backend.app.modules.log_sink import DROP, get_rotating_file_sink
 
 # --- Setup Logger ---
 logger = logging.getLogger(__name__)
@@ -29,6 +59,18 @@ logger = logging.getLogger(__name__)
 ONTOLOGY_FILEPATH = os.path.join(os.path.dirname(__file__), "ontology.md")
 PROMPT_LOG_FILEPATH = "context/prompts.txt"
 
+# Prompt log sink tuning (see backend/app/modules/log_sink.py)
+PROMPT_LOG_ENABLED_ENV = "PROMPT_LOG_ENABLED"
+PROMPT_LOG_MAX_BYTES_ENV = "PROMPT_LOG_MAX_BYTES"
+PROMPT_LOG_ROTATE_SECONDS_ENV = "PROMPT_LOG_ROTATE_SECONDS"
+PROMPT_LOG_BACKUP_COUNT_ENV = "PROMPT_LOG_BACKUP_COUNT"
+PROMPT_LOG_QUEUE_SIZE_ENV = "PROMPT_LOG_QUEUE_SIZE"
+PROMPT_LOG_FULL_POLICY_ENV = "PROMPT_LOG_FULL_POLICY"
+
+# Minimum seconds between stat() checks of the ontology file (0 = check on every access)
+ONTOLOGY_RECHECK_SECONDS_ENV = "ONTOLOGY_RECHECK_SECONDS"
+DEFAULT_ONTOLOGY_RECHECK_SECONDS = 1.0
+
 # Environment variable names (Added OpenAI)
 OPENAI_API_KEY_ENV = "OPENAI_API_KEY"
 GEMINI_API_KEY_ENV = "GEMINI_API_KEY"
@@ -66,110 +108,351 @@ ANTHROPIC_MODELS = [
     "claude-3-haiku-20240307",
 ]
 
-ALL_MODELS = OPENAI_MODELS + GEMINI_MODELS + ANTHROPIC_MODELS
+
+# --- Provider Registry ---
+
+class ProviderSpec(NamedTuple):
+    """Static description of an LLM provider and the env vars that configure it."""
+    name: str
+    label: str
+    models: Tuple[str, ...]
+    key_env: str
+    endpoint_env: str
+    analysis_key_env: str
+    analysis_endpoint_env: str
+
+# Adding a provider is one entry here (plus its model list above)
+PROVIDER_SPECS: Tuple[ProviderSpec, ...] = (
+    ProviderSpec("openai", "OpenAI", tuple(OPENAI_MODELS), OPENAI_API_KEY_ENV, OPENAI_API_ENDPOINT_ENV, ANALYSIS_OPENAI_API_KEY_ENV, ANALYSIS_OPENAI_API_ENDPOINT_ENV),
+    ProviderSpec("gemini", "Gemini", tuple(GEMINI_MODELS), GEMINI_API_KEY_ENV, GEMINI_API_ENDPOINT_ENV, ANALYSIS_GEMINI_API_KEY_ENV, ANALYSIS_GEMINI_API_ENDPOINT_ENV),
+    ProviderSpec("anthropic", "Anthropic", tuple(ANTHROPIC_MODELS), ANTHROPIC_API_KEY_ENV, ANTHROPIC_API_ENDPOINT_ENV, ANALYSIS_ANTHROPIC_API_KEY_ENV, ANALYSIS_ANTHROPIC_API_ENDPOINT_ENV),
+)
+
+ALL_MODELS = [model for spec in PROVIDER_SPECS for model in spec.models]
+
+
+# --- Ontology Cache ---
+
+class OntologyCache:
+    """Process-wide cache of the ethical ontology text.
+
+    The file is read once and the same (immutable) string is handed out until the
+    file's mtime or size changes. A changed stat triggers a re-read, and the cached
+    text is only replaced when its SHA-256 differs. The hash is exposed as
+    ``version`` so downstream caches can key on the ontology revision.
+    """
+
+    def __init__(self, filepath: str, recheck_seconds: float = DEFAULT_ONTOLOGY_RECHECK_SECONDS):
+        self.filepath = filepath
+        self.recheck_seconds = recheck_seconds
+        self._lock = threading.Lock()
+        self._text: Optional[str] = None
+        self._version: Optional[str] = None
+        self._stat_key: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+
+    @property
+    def version(self) -> Optional[str]:
+        """SHA-256 hex digest of the current ontology text, or None if it never loaded."""
+        self.get()
+        return self._version
+
+    def get(self) -> Optional[str]:
+        """Returns the cached ontology text, reloading it if the file changed."""
+        now = time.monotonic()
+        if self._text is not None and now - self._checked_at < self.recheck_seconds:
+            return self._text
+        with self._lock:
+            if self._text is not None and now - self._checked_at < self.recheck_seconds:
+                return self._text
+            return self._refresh(now)
+
+    def invalidate(self):
+        """Forces the next access to re-stat (and, if changed, re-read) the file."""
+        with self._lock:
+            self._stat_key = None
+            self._checked_at = 0.0
+
+    def _refresh(self, now: float) -> Optional[str]:
+        self._checked_at = now
+        try:
+            stat = os.stat(self.filepath)
+        except OSError as e:
+            # Keep serving the last good text if the file disappears mid-deploy
+            logger.error(f"Error loading ontology: {e}")
+            return self._text
+
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        if self._text is not None and stat_key == self._stat_key:
+            return self._text
+
+        try:
+            with open(self.filepath, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except Exception as e:
+            logger.error(f"Error loading ontology: {e}")
+            return self._text
+
+        version = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        if version != self._version:
+            self._text = text
+            self._version = version
+            logger.info(f"Loaded ontology from {self.filepath} (version {version[:12]}).")
+        self._stat_key = stat_key
+        return self._text
+
+
+_ontology_caches: Dict[str, OntologyCache] = {}
+_ontology_caches_lock = threading.Lock()
+
+
+def _ontology_recheck_seconds() -> float:
+    raw_value = os.getenv(ONTOLOGY_RECHECK_SECONDS_ENV)
+    if raw_value is None:
+        return DEFAULT_ONTOLOGY_RECHECK_SECONDS
+    try:
+        return max(0.0, float(raw_value))
+    except ValueError:
+        logger.warning(f"Invalid {ONTOLOGY_RECHECK_SECONDS_ENV} value '{raw_value}'. Using default of {DEFAULT_ONTOLOGY_RECHECK_SECONDS}s.")
+        return DEFAULT_ONTOLOGY_RECHECK_SECONDS
+
+
+def get_ontology_cache(filepath: str = ONTOLOGY_FILEPATH) -> OntologyCache:
+    """Returns the process-wide OntologyCache for the given file."""
+    cache = _ontology_caches.get(filepath)
+    if cache is None:
+        with _ontology_caches_lock:
+            cache = _ontology_caches.get(filepath)
+            if cache is None:
+                cache = OntologyCache(filepath, _ontology_recheck_seconds())
+                _ontology_caches[filepath] = cache
+    return cache
+
+
+def preload_ontology(filepath: str = ONTOLOGY_FILEPATH) -> Optional[str]:
+    """Loads the ontology into the cache (e.g. before forking workers) and returns its version."""
+    cache = get_ontology_cache(filepath)
+    cache.get()
+    return cache.version
+
+
+def get_ontology_version(filepath: str = ONTOLOGY_FILEPATH) -> Optional[str]:
+    """Returns the SHA-256 version of the cached ontology text."""
+    return get_ontology_cache(filepath).version
+
+
+# --- Config Snapshot ---
+
+class ProviderDescriptor(NamedTuple):
+    """A provider spec plus the environment defaults resolved when the snapshot was built.
+
+    ``*_source`` fields name the env var a value came from (None if unset).
+    """
+    spec: ProviderSpec
+    origin_api_key: Optional[str]
+    origin_key_source: Optional[str]
+    origin_api_endpoint: Optional[str]
+    origin_endpoint_source: Optional[str]
+    analysis_api_key: Optional[str]
+    analysis_key_source: Optional[str]
+    analysis_api_endpoint: Optional[str]
+    analysis_endpoint_source: Optional[str]
+
+
+class ConfigSnapshot(NamedTuple):
+    """Immutable view of provider/model configuration, built once and swapped on reload."""
+    providers: Mapping[str, ProviderDescriptor]
+    models: Mapping[str, ProviderDescriptor]
+    default_model: Optional[str]
+    default_analysis_model: Optional[str]
+    raw_default_analysis_model: Optional[str]
+
+
+def _first_env(*env_names: str) -> Tuple[Optional[str], Optional[str]]:
+    """Returns (value, env var name) for the first of env_names that is set and non-empty."""
+    for env_name in env_names:
+        value = os.getenv(env_name)
+        if value:
+            return value, env_name
+    return None, None
+
+
+def build_config_snapshot() -> ConfigSnapshot:
+    """Resolves every provider's env-supplied keys, endpoints and default models."""
+    providers: Dict[str, ProviderDescriptor] = {}
+    models: Dict[str, ProviderDescriptor] = {}
+    for spec in PROVIDER_SPECS:
+        origin_key, origin_key_env = _first_env(spec.key_env)
+        origin_endpoint, origin_endpoint_env = _first_env(spec.endpoint_env)
+        analysis_key, analysis_key_env = _first_env(spec.analysis_key_env, spec.key_env)
+        analysis_endpoint, analysis_endpoint_env = _first_env(spec.analysis_endpoint_env, spec.endpoint_env)
+        descriptor = ProviderDescriptor(
+            spec,
+            origin_key, origin_key_env,
+            origin_endpoint, origin_endpoint_env,
+            analysis_key, analysis_key_env,
+            analysis_endpoint, analysis_endpoint_env,
+        )
+        providers[spec.name] = descriptor
+        for model in spec.models:
+            models[model] = descriptor
+
+    default_model = os.getenv(DEFAULT_LLM_MODEL_ENV)
+    if not default_model or default_model not in models:
+        fallback_model = ALL_MODELS[0] if ALL_MODELS else None
+        logger.warning(f"DEFAULT_LLM_MODEL env var '{default_model}' invalid or not set. Falling back to first available model: '{fallback_model}'.")
+        default_model = fallback_model
+
+    raw_default_analysis_model = os.getenv(ANALYSIS_LLM_MODEL_ENV)
+    default_analysis_model = raw_default_analysis_model if raw_default_analysis_model in models else None
+
+    return ConfigSnapshot(
+        MappingProxyType(providers),
+        MappingProxyType(models),
+        default_model,
+        default_analysis_model,
+        raw_default_analysis_model,
+    )
+
+
+_config_snapshot: Optional[ConfigSnapshot] = None
+_config_snapshot_lock = threading.Lock()
+
+
+def get_config_snapshot() -> ConfigSnapshot:
+    """Returns the current config snapshot, building it on first use."""
+    snapshot = _config_snapshot
+    if snapshot is None:
+        with _config_snapshot_lock:
+            if _config_snapshot is None:
+                return reload_config_snapshot()
+            snapshot = _config_snapshot
+    return snapshot
+
+
+def reload_config_snapshot() -> ConfigSnapshot:
+    """Re-reads the environment and atomically swaps in a new snapshot."""
+    global _config_snapshot
+    snapshot = build_config_snapshot()
+    _config_snapshot = snapshot
+    logger.info(f"Provider registry loaded: {len(snapshot.models)} models across {len(snapshot.providers)} providers.")
+    return snapshot
+
+
+def get_provider_for_model(model: Optional[str]) -> Optional[ProviderDescriptor]:
+    """Returns the provider descriptor serving the given model, or None if unknown."""
+    return get_config_snapshot().models.get(model)
+
+
+def install_config_reload_signal(signum: Optional[int] = None) -> bool:
+    """Reloads the config snapshot when the process receives signum (SIGHUP by default).
+
+    Must be called from the main thread; returns False where the signal is unavailable.
+    """
+    if signum is None:
+        signum = getattr(signal, "SIGHUP", None)
+    if signum is None or threading.current_thread() is not threading.main_thread():
+        return False
+    signal.signal(signum, lambda _signum, _frame: reload_config_snapshot())
+    return True
 
 
 # --- Helper Functions ---
 
 def load_ontology(filepath: str = ONTOLOGY_FILEPATH) -> Optional[str]:
-    """Loads the ethical ontology text from the specified file."""
+    """Loads the ethical ontology text, served from the process-wide ontology cache."""
+    return get_ontology_cache(filepath).get()
+
+def _env_number(name: str, default, cast=float):
+    """Reads a numeric environment variable, falling back to default when unset or invalid."""
+    raw_value = os.getenv(name)
+    if raw_value is None or not raw_value.strip():
+        return default
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return f.read()
-    except Exception as e:
-        logger.error(f"Error loading ontology: {e}")
-        return None
+        return cast(raw_value)
+    except ValueError:
+        logger.warning(f"Invalid value '{raw_value}' for {name}. Using default: {default}")
+        return default
+
+_prompt_log_sinks: Dict[str, Any] = {}
+
+def get_prompt_log_sink(filepath: str = PROMPT_LOG_FILEPATH):
+    """Returns the background sink that batches prompt log writes for the given file."""
+    sink = _prompt_log_sinks.get(filepath)
+    if sink is None:
+        # The env vars are read once per file; get_rotating_file_sink returns the same sink on a race
+        sink = _prompt_log_sinks[filepath] = get_rotating_file_sink(
+            filepath,
+            max_bytes=_env_number(PROMPT_LOG_MAX_BYTES_ENV, 10 * 1024 * 1024, int),
+            rotate_interval=_env_number(PROMPT_LOG_ROTATE_SECONDS_ENV, 0.0),
+            backup_count=_env_number(PROMPT_LOG_BACKUP_COUNT_ENV, 5, int),
+            max_queue=_env_number(PROMPT_LOG_QUEUE_SIZE_ENV, 10000, int),
+            full_policy=os.getenv(PROMPT_LOG_FULL_POLICY_ENV, DROP).strip().lower(),
+        )
+    return sink
 
 def log_prompt(prompt: str, model_name: str, filepath: str = PROMPT_LOG_FILEPATH):
-    """Appends the given prompt and selected model to the log file."""
+    """Queues the given prompt and selected model for the background log writer."""
     try:
-        # Ensure the directory exists
-        log_dir = os.path.dirname(filepath)
-        if log_dir and not os.path.exists(log_dir):
-             os.makedirs(log_dir, exist_ok=True)
-             logger.info(f"Created log directory: {log_dir}")
-
-        with open(filepath, 'a', encoding='utf-8') as f:
-            f.write(f"--- User Prompt (Model: {model_name}) ---\\n{prompt}\\n\\n")
+        record = f"--- User Prompt (Model: {model_name}) ---\\n{prompt}\\n\\n"
+        if not get_prompt_log_sink(filepath).submit(record):
+            logger.warning("Prompt log queue is full; dropped prompt log record.")
     except Exception as e:
         logger.error(f"Error logging prompt: {e}")
 
+def _form_api_key(form_value: Optional[str]) -> Optional[str]:
+    """Returns the stripped form-supplied API key, or None if absent/blank."""
+    if form_value and isinstance(form_value, str) and form_value.strip():
+        return form_value.strip()
+    return None
+
+def _form_api_endpoint(form_value: Optional[str], caller: str) -> Optional[str]:
+    """Returns the stripped form-supplied endpoint if it looks like an http(s) URL."""
+    if form_value and isinstance(form_value, str) and form_value.strip():
+        if form_value.startswith("http://") or form_value.startswith("https://"):
+            return form_value.strip()
+        logger.warning(f"{caller}: Ignoring invalid form endpoint (doesn't start with http/https): {form_value}")
+    return None
+
 def _get_api_config(selected_model: str,
                     form_api_key: Optional[str],
                     form_api_endpoint: Optional[str]) -> Dict[str, Any]:
     """
     Determines the API key and endpoint for the R1 model.
-    Prioritizes form inputs (key, endpoint), otherwise falls back to environment variables.
+    Prioritizes form inputs (key, endpoint), otherwise falls back to the environment
+    defaults captured in the config snapshot.
     """
-    api_key = None
-    api_endpoint = None
-    error = None
-    key_source = "Environment Variable"
-    endpoint_source = "Environment Variable"
-
-    logger.info(f"_get_api_config: Fetching config for selected_model: {selected_model}")
-    logger.info(f"_get_api_config: Received form_api_key: {'Provided' if form_api_key else 'Not Provided'}")
-    logger.info(f"_get_api_config: Received form_api_endpoint: {'Provided' if form_api_endpoint else 'Not Provided'}")
-
-    # Determine API provider and corresponding ENV VAR names
-    env_var_key = None
-    env_var_endpoint = None
-    api_key_name = f"Origin ({selected_model})" # Default name
-
-    if selected_model in OPENAI_MODELS:
-        api_key_name = "Origin OpenAI"
-        env_var_key = OPENAI_API_KEY_ENV
-        env_var_endpoint = OPENAI_API_ENDPOINT_ENV
-    elif selected_model in GEMINI_MODELS:
-        api_key_name = "Origin Gemini"
-        env_var_key = GEMINI_API_KEY_ENV
-        env_var_endpoint = GEMINI_API_ENDPOINT_ENV
-    elif selected_model in ANTHROPIC_MODELS:
-        api_key_name = "Origin Anthropic"
-        env_var_key = ANTHROPIC_API_KEY_ENV
-        env_var_endpoint = ANTHROPIC_API_ENDPOINT_ENV
-    else:
+    descriptor = get_config_snapshot().models.get(selected_model)
+    if descriptor is None:
         logger.warning(f"_get_api_config: Unknown model type '{selected_model}' encountered. Relying on form inputs only for key/endpoint.")
-
-    # 1. Prioritize API key provided in the form
-    if form_api_key and isinstance(form_api_key, str) and form_api_key.strip():
-        api_key = form_api_key.strip()
-        key_source = "User Input"
-        logger.info(f"_get_api_config: Using API key provided via form for {api_key_name}.")
-    # 2. Fallback to environment variable if form key wasn't provided AND we know the variable name
-    elif env_var_key:
-        api_key = os.getenv(env_var_key)
-        if api_key:
-             key_source = f"Environment Variable ({env_var_key})"
-             logger.info(f"_get_api_config: Using API key from env var {env_var_key} for {api_key_name}.")
-
-    # 3. Prioritize API endpoint provided in the form
-    if form_api_endpoint and isinstance(form_api_endpoint, str) and form_api_endpoint.strip():
-        if form_api_endpoint.startswith("http://") or form_api_endpoint.startswith("https://"):
-            api_endpoint = form_api_endpoint.strip()
-            endpoint_source = "User Input"
-            logger.info(f"_get_api_config: Using API endpoint provided via form: {api_endpoint}")
-        else:
-            logger.warning(f"_get_api_config: Ignoring invalid form_api_endpoint (doesn't start with http/https): {form_api_endpoint}")
-
-    # 4. Fallback to environment variable endpoint
-    if not api_endpoint and env_var_endpoint:
-        env_endpoint_val = os.getenv(env_var_endpoint)
-        if env_endpoint_val:
-            api_endpoint = env_endpoint_val
-            endpoint_source = f"Environment Variable ({env_var_endpoint})"
-            logger.info(f"_get_api_config: Using API endpoint from env var {env_var_endpoint}: {api_endpoint}")
-
-    # 5. Validate that *some* API Key was found
+        api_key_name = f"Origin ({selected_model})"
+    else:
+        api_key_name = f"Origin {descriptor.spec.label}"
+
+    # 1. Prioritize API key provided in the form, then the environment default
+    api_key = _form_api_key(form_api_key)
+    key_source = "User Input"
+    if not api_key and descriptor is not None:
+        api_key = descriptor.origin_api_key
+        key_source = f"Environment Variable ({descriptor.origin_key_source})"
+
+    # 2. Prioritize API endpoint provided in the form, then the environment default
+    api_endpoint = _form_api_endpoint(form_api_endpoint, "_get_api_config")
+    endpoint_source = "User Input"
+    if not api_endpoint and descriptor is not None:
+        api_endpoint = descriptor.origin_api_endpoint
+        endpoint_source = f"Environment Variable ({descriptor.origin_endpoint_source})"
+
+    # 3. Validate that *some* API Key was found
+    error = None
     if not api_key:
-        if env_var_key:
-            error = f"API Key for {api_key_name} not found. Provide one in the form or set the {env_var_key} environment variable."
+        if descriptor is not None:
+            error = f"API Key for {api_key_name} not found. Provide one in the form or set the {descriptor.spec.key_env} environment variable."
         else:
-             error = f"API Key for model '{selected_model}' was not provided in the form or found in environment."
+            error = f"API Key for model '{selected_model}' was not provided in the form or found in environment."
         logger.error(error)
-
-    if not error:
-        logger.info(f"_get_api_config: Final Key Source: {key_source}, Endpoint Source: {endpoint_source} for {selected_model}")
+    else:
+        logger.debug("_get_api_config: Key Source: %s, Endpoint Source: %s for %s", key_source, endpoint_source, selected_model)
 
     return {
         "api_key": api_key,
@@ -183,108 +466,46 @@ def _get_analysis_api_config(selected_analysis_model: Optional[str] = None,
     """
     Determines the API key, model, and endpoint for the Analysis LLM.
     Uses selected_analysis_model or falls back to ANALYSIS_LLM_MODEL_ENV.
-    Prioritizes form inputs (key, endpoint), then specific env vars, then general env vars.
+    Prioritizes form inputs (key, endpoint), then specific env vars, then general env vars
+    (as captured in the config snapshot).
     """
-    analysis_model = selected_analysis_model
-    key_source = "Environment Variable"
-    endpoint_source = "Environment Variable"
+    snapshot = get_config_snapshot()
 
     # --- Determine Analysis Model ---
-    if not analysis_model or analysis_model not in ALL_MODELS:
-        if selected_analysis_model and selected_analysis_model not in ALL_MODELS:
-             logger.warning(f"_get_analysis_api_config: Invalid analysis model selected ('{selected_analysis_model}'). Falling back to environment default.")
-        default_analysis_model_env = os.getenv(ANALYSIS_LLM_MODEL_ENV)
-        if not default_analysis_model_env or default_analysis_model_env not in ALL_MODELS:
-            error_msg = f"Analysis LLM model is not configured correctly. Neither selected ('{selected_analysis_model}') nor default env var {ANALYSIS_LLM_MODEL_ENV} ('{default_analysis_model_env}') are valid."
+    analysis_model = selected_analysis_model
+    if not analysis_model or analysis_model not in snapshot.models:
+        if selected_analysis_model and selected_analysis_model not in snapshot.models:
+            logger.warning(f"_get_analysis_api_config: Invalid analysis model selected ('{selected_analysis_model}'). Falling back to environment default.")
+        if not snapshot.default_analysis_model:
+            error_msg = f"Analysis LLM model is not configured correctly. Neither selected ('{selected_analysis_model}') nor default env var {ANALYSIS_LLM_MODEL_ENV} ('{snapshot.raw_default_analysis_model}') are valid."
             logger.error(error_msg)
             return {"error": error_msg, "model": None, "api_key": None, "api_endpoint": None}
-        analysis_model = default_analysis_model_env
-        logger.info(f"_get_analysis_api_config: Using default analysis model from env var {ANALYSIS_LLM_MODEL_ENV}: {analysis_model}")
-    else:
-         logger.info(f"_get_analysis_api_config: Using user-selected analysis model: {analysis_model}")
+        analysis_model = snapshot.default_analysis_model
 
-    # --- Determine API Key & Endpoint ---
-    api_key = None
-    api_endpoint = None
-    error = None
+    descriptor = snapshot.models[analysis_model]
+    api_key_name = f"Analysis {descriptor.spec.label}"
 
-    specific_key_env = None
-    fallback_key_env = None
-    specific_endpoint_env = None
-    fallback_endpoint_env = None
-    api_key_name = f"Analysis ({analysis_model})"
-
-    if analysis_model in OPENAI_MODELS:
-        api_key_name = "Analysis OpenAI"
-        specific_key_env = ANALYSIS_OPENAI_API_KEY_ENV
-        fallback_key_env = OPENAI_API_KEY_ENV
-        specific_endpoint_env = ANALYSIS_OPENAI_API_ENDPOINT_ENV
-        fallback_endpoint_env = OPENAI_API_ENDPOINT_ENV
-    elif analysis_model in GEMINI_MODELS:
-        api_key_name = "Analysis Gemini"
-        specific_key_env = ANALYSIS_GEMINI_API_KEY_ENV
-        fallback_key_env = GEMINI_API_KEY_ENV
-        specific_endpoint_env = ANALYSIS_GEMINI_API_ENDPOINT_ENV
-        fallback_endpoint_env = GEMINI_API_ENDPOINT_ENV
-    elif analysis_model in ANTHROPIC_MODELS:
-        api_key_name = "Analysis Anthropic"
-        specific_key_env = ANALYSIS_ANTHROPIC_API_KEY_ENV
-        fallback_key_env = ANTHROPIC_API_KEY_ENV
-        specific_endpoint_env = ANALYSIS_ANTHROPIC_API_ENDPOINT_ENV
-        fallback_endpoint_env = ANTHROPIC_API_ENDPOINT_ENV
-
-    # 1. Prioritize API key provided in the form
-    if form_analysis_api_key and isinstance(form_analysis_api_key, str) and form_analysis_api_key.strip():
-        api_key = form_analysis_api_key.strip()
-        key_source = "User Input"
-        logger.info(f"_get_analysis_api_config: Using API key provided via form for {api_key_name}.")
-    # 2. Fallback to environment variables if form key wasn't provided
-    else:
-        if specific_key_env:
-            api_key = os.getenv(specific_key_env)
-            if api_key:
-                key_source = f"Environment Variable ({specific_key_env})"
-        if not api_key and fallback_key_env:
-            api_key = os.getenv(fallback_key_env)
-            if api_key:
-                 key_source = f"Environment Variable ({fallback_key_env})"
-
-        if api_key:
-            logger.info(f"_get_analysis_api_config: Using API key from {key_source} for {api_key_name}.")
-
-    # 3. Prioritize API endpoint provided in the form
-    if form_analysis_api_endpoint and isinstance(form_analysis_api_endpoint, str) and form_analysis_api_endpoint.strip():
-        if form_analysis_api_endpoint.startswith("http://") or form_analysis_api_endpoint.startswith("https://"):
-            api_endpoint = form_analysis_api_endpoint.strip()
-            endpoint_source = "User Input"
-            logger.info(f"_get_analysis_api_config: Using API endpoint provided via form: {api_endpoint}")
-        else:
-            logger.warning(f"_get_analysis_api_config: Ignoring invalid form_analysis_api_endpoint: {form_analysis_api_endpoint}")
+    # --- Determine API Key & Endpoint ---
+    api_key = _form_api_key(form_analysis_api_key)
+    key_source = "User Input"
+    if not api_key:
+        api_key = descriptor.analysis_api_key
+        key_source = f"Environment Variable ({descriptor.analysis_key_source})"
 
-    # 4. Fallback to environment variable endpoint
+    api_endpoint = _form_api_endpoint(form_analysis_api_endpoint, "_get_analysis_api_config")
+    endpoint_source = "User Input"
     if not api_endpoint:
-        if specific_endpoint_env:
-            env_endpoint_val = os.getenv(specific_endpoint_env)
-            if env_endpoint_val:
-                api_endpoint = env_endpoint_val
-                endpoint_source = f"Environment Variable ({specific_endpoint_env})"
-        if not api_endpoint and fallback_endpoint_env:
-            env_endpoint_val = os.getenv(fallback_endpoint_env)
-            if env_endpoint_val:
-                api_endpoint = env_endpoint_val
-                endpoint_source = f"Environment Variable ({fallback_endpoint_env})"
-
-        if api_endpoint:
-             logger.info(f"_get_analysis_api_config: Using API endpoint from {endpoint_source}: {api_endpoint}")
-
-    # 5. Validate that *some* API Key was found
+        api_endpoint = descriptor.analysis_api_endpoint
+        endpoint_source = f"Environment Variable ({descriptor.analysis_endpoint_source})"
+
+    # --- Validate that *some* API Key was found ---
     if not api_key:
-        error_env_vars = f"{specific_key_env} or {fallback_key_env}" if specific_key_env and fallback_key_env else (specific_key_env or fallback_key_env or "relevant environment variables")
+        error_env_vars = f"{descriptor.spec.analysis_key_env} or {descriptor.spec.key_env}"
         error = f"API Key for {api_key_name} model '{analysis_model}' not found. Provide one in the form or set {error_env_vars}."
         logger.error(error)
         return {"error": error, "model": analysis_model, "api_key": None, "api_endpoint": api_endpoint}
 
-    logger.info(f"_get_analysis_api_config: Final Key Source: {key_source}, Endpoint Source: {endpoint_source} for {analysis_model}")
+    logger.debug("_get_analysis_api_config: Key Source: %s, Endpoint Source: %s for %s", key_source, endpoint_source, analysis_model)
 
     return {
         "model": analysis_model,
@@ -309,11 +530,17 @@ def register_routes(app: Flask):
     from backend.app.routes.alignment import alignment_bp
     from backend.app.routes.friction import friction_bp
     from backend.app.routes.models import models_bp
+    from backend.app.routes.jobs import jobs_bp
+    from backend.app.routes.batch import batch_bp
+    from backend.app.routes.metrics import metrics_bp
 
     app.register_blueprint(analyze_bp)
     app.register_blueprint(alignment_bp)
     app.register_blueprint(friction_bp)
     app.register_blueprint(models_bp)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(batch_bp)
+    app.register_blueprint(metrics_bp)
 '''
 
 # ============================================================================
@@ -322,21 +549,35 @@ def register_routes(app: Flask):
 files_to_create[os.path.join(ROUTES, 'analyze.py')] = '''\
 """Analyze route: POST /api/analyze with validation and processing helpers."""
 
-import os
-import re
-import json
+import time
 import logging
-from typing import Dict, Any, Optional, Tuple
+import threading
+from functools import partial
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, stream_with_context
 
+from backend.app.modules.serialization import dumps_json, get_request_data, respond
 from backend.app.modules.llm_interface import generate_response, perform_ethical_analysis
-from backend.app.modules.friction_monitor import get_friction_monitor
-from backend.app.modules.alignment_detector import get_alignment_detector
+from backend.app.modules.llm_streaming import LLMStreamError, stream_response, stream_ethical_analysis
+from backend.app.modules.provider_limits import ProviderConcurrencyLimiter, provider_slot
+from backend.app.modules.http_client_pool import key_fingerprint
+from backend.app.modules.single_flight import get_analysis_single_flight
+from backend.app.modules.llm_async import agenerate_response, aperform_ethical_analysis, run_blocking
+from backend.app.modules.llm_result_cache import HIT, acached_call, cached_call, cached_stream, get_llm_result_cache
+from backend.app.modules.model_routing import RoutePlan, check_cancelled, get_latency_router
+from backend.app.modules.prompt_cache import CachedAnalysis, PromptUsage, get_r2_prompt_cache
+from backend.app.modules.provider_gateway import GatewayCall, routed_endpoint
+from backend.app.modules.rate_limits import (
+    FOLLOW_UP_BOOST, PRIORITY_INTERACTIVE, RateLimitExceeded, estimate_tokens, get_rate_limit_scheduler, retry_after_header,
+)
+from backend.app.modules.analysis_parser import SCORES_EVENT, SUMMARY_EVENT, EthicalAnalysisParser, parse_ethical_analysis
+from backend.app.modules.history_store import analyze_alignment, measure_friction
+from backend.app.modules.interaction_store import record_interaction
+from backend.app.modules.metrics import NOOP_TIMINGS, count, provider_label, start_request_timings
 from backend.app.api_config import (
-    ALL_MODELS, OPENAI_MODELS, GEMINI_MODELS, ANTHROPIC_MODELS,
-    DEFAULT_LLM_MODEL_ENV, ONTOLOGY_FILEPATH,
-    load_ontology, log_prompt,
+    ALL_MODELS, ONTOLOGY_FILEPATH,
+    get_config_snapshot, get_ontology_version, load_ontology,
     _get_api_config, _get_analysis_api_config,
 )
 
@@ -347,21 +588,7 @@ analyze_bp = Blueprint('analyze', __name__, url_prefix='/api')
 logger = logging.getLogger(__name__)
 
 
-# --- Validation Helpers ---
-
-def _validate_standard_dimension(dim_data: Dict[str, Any]) -> bool:
-    """Validates a standard ethical dimension (deontology, teleology, virtue_ethics, memetics)."""
-    return (isinstance(dim_data, dict) and
-            "adherence_score" in dim_data and
-            "confidence_score" in dim_data and
-            "justification" in dim_data)
-
-def _validate_ai_welfare_dimension(dim_data: Dict[str, Any]) -> bool:
-    """Validates the AI welfare dimension with its unique structure."""
-    if not isinstance(dim_data, dict):
-        return False
-    required_fields = ["friction_score", "voluntary_alignment", "dignity_respect", "justification"]
-    return all(field in dim_data for field in required_fields)
+# --- Parsing Helpers ---
 
 def _parse_ethical_analysis(analysis_text: str) -> Tuple[str, Optional[Dict[str, Any]]]:
     """Parses the ethical analysis text to separate textual summary and structured JSON scores.
@@ -370,110 +597,24 @@ def _parse_ethical_analysis(analysis_text: str) -> Tuple[str, Optional[Dict[str,
     - deontology, teleology, virtue_ethics, memetics: standard adherence/confidence/justification
     - ai_welfare: friction_score, voluntary_alignment, dignity_respect, constraints_identified,
                   suppressed_alternatives, justification
-    """
-    if not analysis_text or analysis_text == "[No analysis generated or content blocked]":
-        logger.warning("Ethical analysis text was empty or indicated generation failure.")
-        return analysis_text if analysis_text else "", None
-
-    textual_summary = ""
-    json_scores = None
-    raw_json_string = None
-
-    # Standard dimensions that use adherence_score/confidence_score/justification
-    STANDARD_DIMENSIONS = ["deontology", "teleology", "virtue_ethics", "memetics"]
-    # All required dimensions for 5D analysis
-    REQUIRED_DIMENSIONS = STANDARD_DIMENSIONS + ["ai_welfare"]
-
-    try:
-        # Attempt to find the textual summary first
-        summary_marker = "**Ethical Review Summary:**"
-        scoring_marker = "**Ethical Scoring:**"
-        summary_start_index = analysis_text.find(summary_marker)
-        scoring_start_index = analysis_text.find(scoring_marker)
-
-        if summary_start_index != -1 and scoring_start_index != -1 and summary_start_index < scoring_start_index:
-            textual_summary = analysis_text[summary_start_index + len(summary_marker):scoring_start_index].strip()
-        elif summary_start_index != -1:
-            textual_summary = analysis_text[summary_start_index + len(summary_marker):].strip()
-        else:
-            textual_summary = analysis_text
-            logger.warning("Could not reliably find summary/scoring markers in analysis text.")
-
-        # Attempt to find and parse the JSON block for scores
-        json_match = re.search(r"```json\\s*(\\{.*?\\})\\s*```", analysis_text, re.DOTALL)
-
-        if json_match:
-            json_string = json_match.group(1)
-            raw_json_string = json_string
-            try:
-                parsed_json = json.loads(json_string)
-                try:
-                    if not isinstance(parsed_json, dict):
-                        logger.warning("Parsed JSON is not a dictionary.")
-                        json_scores = None
-                    else:
-                        # Check if we have the minimum required dimensions (at least the original 3)
-                        min_required = ["deontology", "teleology", "virtue_ethics"]
-                        has_minimum = all(dim in parsed_json for dim in min_required)
-
-                        if not has_minimum:
-                            logger.warning(f"Parsed JSON missing minimum required dimensions. JSON: {json_string[:200]}...")
-                            json_scores = None
-                        else:
-                            # Validate each dimension based on its type
-                            valid = True
-                            for dim in parsed_json:
-                                if dim in STANDARD_DIMENSIONS:
-                                    if not _validate_standard_dimension(parsed_json[dim]):
-                                        logger.warning(f"Dimension '{dim}' does not have expected standard structure.")
-                                        valid = False
-                                        break
-                                elif dim == "ai_welfare":
-                                    if not _validate_ai_welfare_dimension(parsed_json[dim]):
-                                        logger.warning(f"AI Welfare dimension does not have expected structure.")
-                                        valid = False
-                                        break
-                                # Allow unknown dimensions to pass through (forward compatibility)
-
-                            if valid:
-                                json_scores = parsed_json
-                                # Trim summary if needed
-                                if scoring_start_index != -1 and summary_start_index != -1:
-                                    textual_summary = analysis_text[summary_start_index + len(summary_marker):scoring_start_index].strip()
-                                elif scoring_start_index == -1 and textual_summary.endswith(json_match.group(0)):
-                                    textual_summary = textual_summary[:-len(json_match.group(0))].strip()
-                            else:
-                                json_scores = None
-
-                except (TypeError, KeyError) as key_err:
-                    logger.error(f"Error accessing keys in parsed JSON structure: {key_err}. JSON: {json_string[:200]}...", exc_info=True)
-                    json_scores = None
-
-            except json.JSONDecodeError as json_err:
-                logger.error(f"Error decoding JSON from analysis: {json_err}. Raw JSON string: {raw_json_string[:200]}...", exc_info=True)
-                json_scores = None
-        else:
-            logger.warning("Could not find JSON block for ethical scores in analysis text.")
-            json_scores = None
-
-    except Exception as e:
-        logger.error(f"Error parsing ethical analysis structure: {e}", exc_info=True)
-        textual_summary = analysis_text
-        json_scores = None
 
-    ethical_analysis_text = textual_summary
-    ethical_scores = json_scores
+    Delegates to the single-pass parser in modules/analysis_parser.py.
+    """
+    return parse_ethical_analysis(analysis_text)
 
-    return ethical_analysis_text, ethical_scores
 
+def _validate_analyze_request(data: Optional[Dict[str, Any]],
+                              require_prompt: bool = True) -> Tuple[Optional[Dict], Optional[int]]:
+    """Validates the incoming request data for the /analyze endpoint.
 
-def _validate_analyze_request(data: Optional[Dict[str, Any]]) -> Tuple[Optional[Dict], Optional[int]]:
-    """Validates the incoming request data for the /analyze endpoint."""
+    With require_prompt=False only the shared model/key/endpoint fields are
+    checked (used by the batch endpoint, which validates its own prompt list).
+    """
     if not data:
         return {"error": "No JSON data received"}, 400
 
     prompt = data.get('prompt')
-    if not prompt or not isinstance(prompt, str) or not prompt.strip():
+    if require_prompt and (not prompt or not isinstance(prompt, str) or not prompt.strip()):
         return {"error": "Invalid or missing 'prompt' provided"}, 400
 
     origin_model = data.get('origin_model')
@@ -483,17 +624,18 @@ def _validate_analyze_request(data: Optional[Dict[str, Any]]) -> Tuple[Optional[
     origin_api_endpoint = data.get('origin_api_endpoint')
     analysis_api_endpoint = data.get('analysis_api_endpoint')
 
-    # Validate models (ensure they are in ALL_MODELS if provided, as they come from dropdown)
+    # Validate models (ensure they are registered if provided, as they come from dropdown)
+    known_models = get_config_snapshot().models
     if origin_model is not None:
         if not isinstance(origin_model, str) or not origin_model.strip():
              return {"error": "Optional 'origin_model' must be a non-empty string."}, 400
-        if origin_model not in ALL_MODELS:
+        if origin_model not in known_models:
              return {"error": f"Optional 'origin_model' must be one of the supported models: {', '.join(ALL_MODELS)}"}, 400
 
     if analysis_model is not None:
         if not isinstance(analysis_model, str) or not analysis_model.strip():
             return {"error": "Optional 'analysis_model' must be a non-empty string."}, 400
-        if analysis_model not in ALL_MODELS:
+        if analysis_model not in known_models:
             return {"error": f"Optional 'analysis_model' must be one of the supported models: {', '.join(ALL_MODELS)}"}, 400
 
     # Validate API keys (must be non-empty string if provided)
@@ -515,66 +657,24 @@ def _validate_analyze_request(data: Optional[Dict[str, Any]]) -> Tuple[Optional[
         if not analysis_api_endpoint.startswith("http://") and not analysis_api_endpoint.startswith("https://"):
              return {"error": "Optional 'analysis_api_endpoint' must be a valid URL (starting with http:// or https://)."}, 400
 
-    return None, None # No error
-
-
-def _process_analysis_request(
-    prompt: str,
-    r1_model_to_use: str,
-    initial_config: Dict[str, Any],
-    analysis_config: Dict[str, Any],
-    ontology_text: str
-) -> Tuple[Optional[Dict], Optional[int]]:
-    """Handles LLM calls and response parsing for the /analyze endpoint."""
-
-    selected_model = r1_model_to_use
-    analysis_model_name = analysis_config.get("model")
-
-    if not analysis_model_name:
-         logger.error("_process_analysis_request: Analysis model name missing from analysis_config.")
-         return {"error": "Internal Server Error: Failed to determine analysis model."}, 500
-
-    logger.info(f"_process_analysis_request: Using R1 model: {selected_model}")
-    logger.info(f"_process_analysis_request: Using R2 model: {analysis_model_name}")
+    bypass_cache = data.get('bypass_cache')
+    if bypass_cache is not None and not isinstance(bypass_cache, bool):
+        return {"error": "Optional 'bypass_cache' must be a boolean."}, 400
 
-    # 1. Generate initial response
-    logger.info(f"Generating initial response (R1) with model: {selected_model}")
-    initial_response = generate_response(
-        prompt,
-        initial_config["api_key"],
-        selected_model,
-        api_endpoint=initial_config.get("api_endpoint")
-    )
-    if initial_response is None:
-        logger.error(f"Failed to generate initial response (R1) from LLM {selected_model}. Check LLM interface logs.")
-        return {"error": f"Failed to generate response (R1) from the upstream language model: {selected_model}."}, 502
+    include_timings = data.get('include_timings')
+    if include_timings is not None and not isinstance(include_timings, bool):
+        return {"error": "Optional 'include_timings' must be a boolean."}, 400
 
-    # 2. Generate ethical analysis
-    logger.info(f"Performing analysis (R2) with model: {analysis_model_name}")
-    raw_ethical_analysis = perform_ethical_analysis(
-        prompt,
-        initial_response,
-        ontology_text,
-        analysis_config["api_key"],
-        analysis_model_name,
-        analysis_api_endpoint=analysis_config.get("api_endpoint")
-    )
-    if raw_ethical_analysis is None:
-        logger.error(f"Failed to generate ethical analysis (R2) from LLM {analysis_model_name}. Check LLM interface logs.")
-        error_payload = {
-            "error": f"Generated initial response (R1), but failed to generate ethical analysis (R2) from the upstream language model: {analysis_model_name}.",
-            "prompt": prompt,
-            "model": selected_model,
-            "analysis_model": analysis_model_name,
-            "initial_response": initial_response
-        }
-        return error_payload, 502
+    return None, None # No error
 
-    # 3. Parse the analysis
-    logger.info("Parsing ethical analysis response.")
-    ethical_analysis_text, ethical_scores = _parse_ethical_analysis(raw_ethical_analysis)
 
-    # 4. Compute alignment metrics and friction data if ethical scores are available
+def _compute_alignment_and_friction(
+    prompt: str,
+    initial_response: str,
+    ethical_scores: Optional[Dict[str, Any]],
+    timings=NOOP_TIMINGS
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Computes (alignment_metrics, friction_metrics) for parsed ethical scores, if any."""
     alignment_metrics = None
     friction_metrics = None
 
@@ -582,379 +682,9336 @@ def _process_analysis_request(
         ai_welfare_data = ethical_scores.get("ai_welfare")
 
         try:
-            friction_monitor = get_friction_monitor()
-            friction_metrics = friction_monitor.measure_friction(
-                prompt, initial_response, ai_welfare_data
-            )
+            with timings.stage("friction"):
+                friction_metrics = measure_friction(
+                    prompt, initial_response, ai_welfare_data
+                )
             logger.debug(f"Friction metrics computed: score={friction_metrics.get('friction_score')}")
         except Exception as e:
             logger.warning(f"Error computing friction metrics: {e}")
             friction_metrics = None
 
         try:
-            alignment_detector = get_alignment_detector()
-            alignment_result = alignment_detector.analyze_alignment(
-                prompt, initial_response, ethical_scores
-            )
-            alignment_metrics = alignment_result.to_dict()
+            with timings.stage("alignment"):
+                alignment_metrics = analyze_alignment(
+                    prompt, initial_response, ethical_scores
+                )
             logger.debug(f"Alignment metrics computed: score={alignment_metrics.get('human_ai_alignment')}")
         except Exception as e:
             logger.warning(f"Error computing alignment metrics: {e}")
             alignment_metrics = None
 
-    # 5. Prepare successful result dictionary
-    result_payload = {
+    return alignment_metrics, friction_metrics
+
+
+def _r1_failure_payload(selected_model: str) -> Dict[str, Any]:
+    return {"error": f"Failed to generate response (R1) from the upstream language model: {selected_model}."}
+
+
+def _r2_failure_payload(prompt: str, selected_model: str, analysis_model_name: str, initial_response: str) -> Dict[str, Any]:
+    return {
+        "error": f"Generated initial response (R1), but failed to generate ethical analysis (R2) from the upstream language model: {analysis_model_name}.",
         "prompt": prompt,
         "model": selected_model,
         "analysis_model": analysis_model_name,
-        "initial_response": initial_response,
-        "ethical_analysis_text": ethical_analysis_text,
-        "ethical_scores": ethical_scores,
-        "alignment_metrics": alignment_metrics,
-        "friction_metrics": friction_metrics,
+        "initial_response": initial_response
     }
-    log_prompt(prompt, f"R1: {selected_model}, R2: {analysis_model_name}")
-    return result_payload, None
 
 
-# --- Route ---
+def _rate_limited_payload(error: RateLimitExceeded) -> Dict[str, Any]:
+    return {"error": str(error), "provider": error.provider, "retry_after": round(error.retry_after, 1)}
 
-@analyze_bp.route('/analyze', methods=['POST'])
-def analyze():
-    """Generate a response and ethical analysis for the given prompt"""
-    data = request.get_json()
 
-    # 1. Validate Request Data (models, keys, endpoints)
-    validation_error, status_code = _validate_analyze_request(data)
-    if validation_error:
-        logger.warning(f"analyze: Request validation failed - {status_code}: {validation_error.get('error')}")
-        return jsonify(validation_error), status_code
+def _raise_if_rate_limited(call: Optional[GatewayCall]):
+    """Turns a call the provider (or the gateway, on its behalf) answered with 429 into RateLimitExceeded."""
+    if call is not None and call.retry_after is not None:
+        raise RateLimitExceeded(call.provider, call.retry_after, "provider returned 429")
 
-    prompt = data.get('prompt')
-    origin_model_input = data.get('origin_model')
-    analysis_model_input = data.get('analysis_model')
-    origin_api_key_input = data.get('origin_api_key')
-    analysis_api_key_input = data.get('analysis_api_key')
-    origin_api_endpoint_input = data.get('origin_api_endpoint')
-    analysis_api_endpoint_input = data.get('analysis_api_endpoint')
 
-    # --- Determine R1 Model ---
-    default_r1_model = os.getenv(DEFAULT_LLM_MODEL_ENV)
-    if not default_r1_model or default_r1_model not in ALL_MODELS:
-        logger.warning(f"analyze: DEFAULT_LLM_MODEL env var '{default_r1_model}' invalid or not set. Falling back to first available model: '{ALL_MODELS[0] if ALL_MODELS else None}'.")
-        default_r1_model = ALL_MODELS[0] if ALL_MODELS else None
-        if not default_r1_model:
-             logger.error("analyze: No default R1 model in env var and ALL_MODELS list is empty!")
-             return jsonify({"error": "Server configuration error: No valid default model available."}), 500
+def _generate_r1(prompt: str, model: str, config: Dict[str, Any]) -> Optional[str]:
+    """R1 through llm_interface, over the provider gateway when it serves the model."""
+    with routed_endpoint(model, config["api_key"], config.get("api_endpoint")) as (endpoint, call):
+        response = generate_response(prompt, config["api_key"], model, api_endpoint=endpoint)
+    if response is None:
+        _raise_if_rate_limited(call)
+    return response
 
-    if origin_model_input:
-         r1_model_to_use = origin_model_input
-         logger.info(f"analyze: Using user-provided Origin Model (R1): '{r1_model_to_use}'")
-    else:
-         r1_model_to_use = default_r1_model
-         logger.info(f"analyze: Using default Origin Model (R1): '{r1_model_to_use}'")
 
-    # --- Get R1 API Configuration ---
-    initial_config = _get_api_config(r1_model_to_use, origin_api_key_input, origin_api_endpoint_input)
-    if initial_config.get("error"):
-        config_error_msg = initial_config["error"]
-        logger.error(f"analyze: Error getting initial API config for R1 model '{r1_model_to_use}': {config_error_msg}")
-        return jsonify({"error": f"Configuration error for model '{r1_model_to_use}': {config_error_msg}"}), 400
+async def _agenerate_r1(prompt: str, model: str, config: Dict[str, Any]) -> Optional[str]:
+    with routed_endpoint(model, config["api_key"], config.get("api_endpoint")) as (endpoint, call):
+        response = await agenerate_response(prompt, config["api_key"], model, api_endpoint=endpoint)
+    if response is None:
+        _raise_if_rate_limited(call)
+    return response
 
-    # --- Determine R2 Model and Get Config ---
-    analysis_config = _get_analysis_api_config(analysis_model_input, analysis_api_key_input, analysis_api_endpoint_input)
-    if analysis_config.get("error"):
-        config_error_msg = analysis_config["error"]
-        logger.error(f"analyze: Error getting analysis API config (selected model: '{analysis_model_input}'): {config_error_msg}")
-        return jsonify({"error": f"Server Configuration Error: {config_error_msg}"}), 500
 
-    r2_model_to_use = analysis_config.get("model")
-    if not r2_model_to_use:
-         logger.error("analyze: Critical internal error - r2_model_to_use is None after config fetch.")
-         return jsonify({"error": "Internal server error determining analysis model."}), 500
+def _perform_r2(prompt: str, initial_response: str, ontology_text: str, analysis_config: Dict[str, Any],
+                model: str, usage: List[PromptUsage]) -> Optional[str]:
+    """R2 through llm_interface; with the prompt cache enabled for the model the gateway marks its prefix."""
+    cached = _start_prompt_cache(prompt, initial_response, ontology_text, model)
+    with routed_endpoint(model, analysis_config["api_key"], analysis_config.get("api_endpoint"),
+                         rewriter=cached) as (endpoint, call):
+        analysis = perform_ethical_analysis(prompt, initial_response, ontology_text, analysis_config["api_key"],
+                                            model, analysis_api_endpoint=endpoint)
+    if analysis is None:
+        _raise_if_rate_limited(call)
+    if cached is not None and cached.usage is not None:
+        usage.append(cached.usage)
+    return analysis
 
-    # --- Load Ontology ---
-    ontology_text = load_ontology()
-    if not ontology_text:
-        logger.error(f"analyze: Failed to load ontology text from {ONTOLOGY_FILEPATH}")
-        return jsonify({"error": "Internal server error: Could not load ethical ontology."}), 500
 
-    # --- Process Request ---
-    logger.info(f"analyze: Processing request - Prompt(start): {prompt[:100]}..., R1 Model: {r1_model_to_use}, R2 Model: {r2_model_to_use}")
-    result_payload, error_status_code = _process_analysis_request(
-        prompt,
-        r1_model_to_use,
-        initial_config,
-        analysis_config,
-        ontology_text
-    )
+def _uses_prompt_cache(model: str) -> bool:
+    prompt_cache = get_r2_prompt_cache()
+    return prompt_cache is not None and prompt_cache.supports(model)
 
-    # --- Handle Response ---
-    if error_status_code:
-        return jsonify(result_payload), error_status_code
-    else:
-        logger.info(f"Successfully processed /analyze request.")
-        return jsonify(result_payload), 200
-'''
 
-# ============================================================================
-# 4. routes/alignment.py
-# ============================================================================
-files_to_create[os.path.join(ROUTES, 'alignment.py')] = '''\
-"""Alignment routes: POST /api/check_alignment and POST /api/multi_agent_analyze."""
+def _start_prompt_cache(prompt: str, initial_response: str, ontology_text: str,
+                        model: str) -> Optional[CachedAnalysis]:
+    if not _uses_prompt_cache(model):
+        return None
+    return get_r2_prompt_cache().start(model, ontology_text, prompt, initial_response)
 
-import logging
-from flask import Blueprint, request, jsonify
 
-from backend.app.modules.friction_monitor import get_friction_monitor
-from backend.app.modules.alignment_detector import get_alignment_detector
-from backend.app.modules.multi_agent_alignment import get_multi_agent_alignment
+async def _aperform_r2(prompt: str, initial_response: str, ontology_text: str, analysis_config: Dict[str, Any],
+                       model: str, usage: List[PromptUsage]) -> Optional[str]:
+    cached = _start_prompt_cache(prompt, initial_response, ontology_text, model)
+    with routed_endpoint(model, analysis_config["api_key"], analysis_config.get("api_endpoint"),
+                         rewriter=cached) as (endpoint, call):
+        analysis = await aperform_ethical_analysis(prompt, initial_response, ontology_text,
+                                                   analysis_config["api_key"], model, analysis_api_endpoint=endpoint)
+    if analysis is None:
+        _raise_if_rate_limited(call)
+    if cached is not None and cached.usage is not None:
+        usage.append(cached.usage)
+    return analysis
 
-# --- Blueprint Definition ---
-alignment_bp = Blueprint('alignment', __name__, url_prefix='/api')
 
-# --- Setup Logger ---
-logger = logging.getLogger(__name__)
+def _error_response(payload: Dict[str, Any], status_code: int):
+    """respond(payload), status_code, with a Retry-After header on a 429."""
+    response = respond(payload)
+    if status_code == 429 and "retry_after" in payload:
+        response.headers["Retry-After"] = retry_after_header(payload["retry_after"])
+    return response, status_code
 
 
-@alignment_bp.route('/check_alignment', methods=['POST'])
-def check_alignment():
-    """Check ethical alignment between a human prompt and AI response.
+def _wait_for_rate_limit(model: str, api_key: Optional[str], *texts: Optional[str], priority: int = PRIORITY_INTERACTIVE):
+    """Blocks until the rate-limit scheduler admits a call to model, or raises RateLimitExceeded."""
+    scheduler = get_rate_limit_scheduler()
+    if scheduler is not None:
+        scheduler.acquire(model, api_key, estimate_tokens(*texts, output_tokens=scheduler.output_tokens), priority)
 
-    This endpoint allows checking alignment on previously generated responses
-    without requiring a new LLM call. Useful for re-analyzing cached responses.
 
-    Request body:
-        {
-            "prompt": "The original human prompt",
-            "response": "The AI-generated response",
-            "ethical_scores": { ... }  # Optional: pre-computed ethical scores
-        }
+async def _await_rate_limit(model: str, api_key: Optional[str], *texts: Optional[str], priority: int = PRIORITY_INTERACTIVE):
+    scheduler = get_rate_limit_scheduler()
+    if scheduler is not None:
+        await scheduler.aacquire(model, api_key, estimate_tokens(*texts, output_tokens=scheduler.output_tokens), priority)
 
-    Returns:
-        {
-            "alignment_metrics": { ... },
+
+def _process_analysis_request(
+    prompt: str,
+    r1_model_to_use: str,
+    initial_config: Dict[str, Any],
+    analysis_config: Dict[str, Any],
+    ontology_text: str,
+    limiter: Optional[ProviderConcurrencyLimiter] = None,
+    use_cache: bool = True,
+    timings=None,
+    coalesce: bool = True,
+    routing: Optional[RoutePlan] = None,
+    priority: int = PRIORITY_INTERACTIVE
+) -> Tuple[Optional[Dict], Optional[int]]:
+    """Handles LLM calls and response parsing for the /analyze endpoint.
+
+    When a limiter is given, each upstream call holds a slot for its model's
+    provider, bounding concurrent calls per provider (used by batch requests).
+    When the LLM result cache is enabled, R1 and R2 go through it (unless
+    use_cache is False) and the payload reports each call's cache status.
+    Each stage is timed into ``timings`` (a fresh StageTimings if not given).
+
+    Unless coalesce is False, a request identical to one already in flight
+    (see ``_analysis_flight_key``) waits for that one and returns a copy of
+    its result; its own timings then record no stages.
+
+    With a routing plan from the latency router, R1 is hedged to the plan's
+    second model and the payload reports both in a "routing" block.
+
+    Upstream calls wait for the rate-limit scheduler at the given priority.
+    When it cannot admit a call in time the result is a 429 payload with
+    "retry_after" seconds.
+
+    With R2_PROMPT_CACHE enabled, R2's stable prompt prefix is marked for
+    provider caching (see modules/prompt_cache.py) and the payload reports
+    its token usage as "r2_usage".
+    """
+    if timings is None:
+        timings = start_request_timings()
+
+    flight = get_analysis_single_flight() if coalesce else None
+    if flight is not None:
+        (payload, error_status_code), _ = flight.do(
+            _analysis_flight_key(prompt, r1_model_to_use, initial_config, analysis_config, use_cache),
+            partial(_process_analysis_request, prompt, r1_model_to_use, initial_config, analysis_config,
+                    ontology_text, limiter=limiter, use_cache=use_cache, timings=timings, coalesce=False,
+                    routing=routing, priority=priority),
+        )
+        return _own_payload(payload), error_status_code
+
+    selected_model = r1_model_to_use
+    analysis_model_name = analysis_config.get("model")
+
+    if not analysis_model_name:
+         logger.error("_process_analysis_request: Analysis model name missing from analysis_config.")
+         return {"error": "Internal Server Error: Failed to determine analysis model."}, 500
+
+    logger.info(f"_process_analysis_request: Using R1 model: {selected_model}")
+    logger.info(f"_process_analysis_request: Using R2 model: {analysis_model_name}")
+
+    cache = get_llm_result_cache()
+    router = get_latency_router()
+    rate_limited = []
+
+    def _r1_attempt(model: str, cancelled: Optional[threading.Event] = None) -> Tuple[Optional[str], Optional[str]]:
+        config = _r1_config(model, r1_model_to_use, initial_config)
+        if config.get("error"):
+            logger.warning(f"R1 for {model} not sent: {config['error']}")
+            return None, None
+
+        def _generate_initial_response():
+            check_cancelled(cancelled)
+            _wait_for_rate_limit(model, config["api_key"], prompt, priority=priority)
+            check_cancelled(cancelled)
+            with provider_slot(limiter, model):
+                check_cancelled(cancelled)
+                return _generate_r1(prompt, model, config)
+
+        start = time.perf_counter()
+        try:
+            response, cache_status = cached_call(
+                cache, _r1_cache_key(prompt, model, config), _generate_initial_response, use_cache
+            )
+        except RateLimitExceeded as e:
+            # A None response lets a hedge (if any) take over; the 429 is reported if nothing succeeds
+            rate_limited.append(e)
+            return None, None
+        _observe_r1(router, model, time.perf_counter() - start, response, cache_status)
+        return response, cache_status
+
+    r2_usage: List[PromptUsage] = []
+
+    def _generate_ethical_analysis():
+        _wait_for_rate_limit(analysis_model_name, analysis_config["api_key"], ontology_text, prompt, initial_response,
+                             priority=priority - FOLLOW_UP_BOOST)
+        with provider_slot(limiter, analysis_model_name):
+            return _perform_r2(prompt, initial_response, ontology_text, analysis_config, analysis_model_name, r2_usage)
+
+    # 1. Generate initial response
+    logger.info(f"Generating initial response (R1) with model: {selected_model}")
+    hedged = False
+    with timings.stage("r1", selected_model):
+        if routing is not None and routing.hedge is not None:
+            selected_model, (initial_response, r1_cache_status), hedged = router.run_hedged(routing, _r1_attempt)
+        else:
+            initial_response, r1_cache_status = _r1_attempt(selected_model)
+    routing_info = _routing_info(routing, selected_model, hedged)
+    if initial_response is None and rate_limited:
+        logger.warning(f"R1 for {selected_model} not sent: {rate_limited[0]}")
+        return _with_routing(_rate_limited_payload(min(rate_limited, key=lambda e: e.retry_after)), routing_info), 429
+    _record_llm_outcome("r1", selected_model, initial_response, r1_cache_status)
+    if initial_response is None:
+        logger.error(f"Failed to generate initial response (R1) from LLM {selected_model}. Check LLM interface logs.")
+        return _with_routing(_r1_failure_payload(selected_model), routing_info), 502
+
+    # 2. Generate ethical analysis
+    logger.info(f"Performing analysis (R2) with model: {analysis_model_name}")
+    try:
+        with timings.stage("r2", analysis_model_name):
+            raw_ethical_analysis, r2_cache_status = cached_call(
+                cache,
+                _r2_cache_key(prompt, analysis_model_name, analysis_config, initial_response,
+                              _uses_prompt_cache(analysis_model_name)),
+                _generate_ethical_analysis,
+                use_cache,
+            )
+    except RateLimitExceeded as e:
+        logger.warning(f"R2 for {analysis_model_name} not sent: {e}")
+        return _with_routing(_rate_limited_payload(e), routing_info), 429
+    _record_llm_outcome("r2", analysis_model_name, raw_ethical_analysis, r2_cache_status)
+    if raw_ethical_analysis is None:
+        logger.error(f"Failed to generate ethical analysis (R2) from LLM {analysis_model_name}. Check LLM interface logs.")
+        return _with_routing(_r2_failure_payload(prompt, selected_model, analysis_model_name, initial_response), routing_info), 502
+
+    cache_statuses = {"r1": r1_cache_status, "r2": r2_cache_status} if cache is not None else None
+    return _with_routing(_complete_analysis(prompt, selected_model, analysis_model_name, initial_response,
+                                            raw_ethical_analysis, cache_statuses, timings,
+                                            r2_usage[0] if r2_usage else None), routing_info), None
+
+
+def _analysis_flight_key(
+    prompt: str,
+    r1_model: str,
+    initial_config: Dict[str, Any],
+    analysis_config: Dict[str, Any],
+    use_cache: bool
+) -> Tuple:
+    """Requests with equal keys share one in-flight R1+R2 chain.
+
+    Covers the prompt, both models and endpoints, the ontology version and
+    fingerprints of both API keys, so callers never share results across
+    credentials.
+    """
+    return (
+        prompt,
+        r1_model, initial_config.get("api_endpoint"), key_fingerprint(initial_config.get("api_key")),
+        analysis_config.get("model"), analysis_config.get("api_endpoint"), key_fingerprint(analysis_config.get("api_key")),
+        get_ontology_version(),
+        use_cache,
+    )
+
+
+def _r1_cache_key(prompt: str, model: str, config: Dict[str, Any]) -> Tuple:
+    """LLM result cache key parts for an R1 call; shared by the JSON, async and streaming paths.
+
+    Includes the API key fingerprint: the SQLite tier is shared by every
+    worker, and results are never shared across credentials.
+    """
+    return ("r1", prompt, model, config.get("api_endpoint"), key_fingerprint(config.get("api_key")))
+
+
+def _r2_cache_key(prompt: str, model: str, config: Dict[str, Any], initial_response: str,
+                  prompt_cached: bool) -> Tuple:
+    """LLM result cache key parts for an R2 call; shared by the JSON, async and streaming paths.
+
+    Like the R1 key it includes the API key fingerprint. prompt_cached tells
+    whether the call goes through the R2 prompt cache; its entries are kept
+    apart from plain ones, which carry no "r2_usage".
+    """
+    return ("r2", prompt, model, config.get("api_endpoint"), key_fingerprint(config.get("api_key")),
+            initial_response, get_ontology_version(), "prompt_cache" if prompt_cached else "llm_interface")
+
+
+def _own_payload(payload: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    # Views add per-request keys (e.g. "timings"), so no two requests may share the payload dict
+    return dict(payload) if payload is not None else payload
+
+
+def _r1_config(model: str, planned_model: str, planned_config: Dict[str, Any]) -> Dict[str, Any]:
+    # A hedge model uses its provider's server-side key and endpoint; callers check "error"
+    return planned_config if model == planned_model else _get_api_config(model, None, None)
+
+
+def _without_unusable_hedge(routing: Optional[RoutePlan]) -> Optional[RoutePlan]:
+    """Drops the plan's hedge when its server-side config does not resolve (e.g. its key was removed)."""
+    if routing is None or routing.hedge is None:
+        return routing
+    hedge_error = _get_api_config(routing.hedge, None, None).get("error")
+    if hedge_error:
+        logger.warning(f"analyze: Not hedging with '{routing.hedge}': {hedge_error}")
+        return routing._replace(hedge=None, hedge_delay=None)
+    return routing
+
+
+def _observe_r1(router, model: str, seconds: float, response: Optional[str], cache_status: Optional[str]):
+    """Feeds an upstream R1 call (not a cache hit) to the latency router, when routing is enabled."""
+    if router is not None and cache_status != HIT:
+        router.observe(model, seconds, response is not None)
+
+
+def _routing_info(routing: Optional[RoutePlan], served_by: str, hedged: bool) -> Optional[Dict[str, Any]]:
+    if routing is None:
+        return None
+    return {
+        "chosen_model": routing.primary,
+        "hedged_model": routing.hedge if hedged else None,
+        "hedge_delay_ms": round(routing.hedge_delay * 1000, 1) if routing.hedge_delay is not None else None,
+        "served_by": served_by,
+    }
+
+
+def _with_routing(payload: Dict[str, Any], routing_info: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if routing_info is not None:
+        payload["routing"] = routing_info
+    return payload
+
+
+def _record_llm_outcome(stage: str, model: str, result: Optional[str], cache_status: Optional[str]):
+    """Counts the cache status of an R1/R2 call and whether it failed upstream."""
+    if cache_status is not None:
+        count("llm_cache_requests_total", call=stage, status=cache_status)
+    if result is None:
+        count("upstream_failures_total", stage=stage, model=model, provider=provider_label(model))
+
+
+def _complete_analysis(
+    prompt: str,
+    selected_model: str,
+    analysis_model_name: str,
+    initial_response: str,
+    raw_ethical_analysis: str,
+    cache_statuses: Optional[Dict[str, Optional[str]]],
+    timings,
+    r2_usage: Optional[PromptUsage] = None
+) -> Dict[str, Any]:
+    """Parses R2 output, scores it and stores the interaction; returns the success payload."""
+    # 3. Parse the analysis
+    logger.info("Parsing ethical analysis response.")
+    with timings.stage("parse"):
+        ethical_analysis_text, ethical_scores = _parse_ethical_analysis(raw_ethical_analysis)
+
+    # 4. Compute alignment metrics and friction data if ethical scores are available
+    alignment_metrics, friction_metrics = _compute_alignment_and_friction(prompt, initial_response, ethical_scores, timings)
+
+    # 5. Prepare successful result dictionary
+    result_payload = {
+        "prompt": prompt,
+        "model": selected_model,
+        "analysis_model": analysis_model_name,
+        "initial_response": initial_response,
+        "ethical_analysis_text": ethical_analysis_text,
+        "ethical_scores": ethical_scores,
+        "alignment_metrics": alignment_metrics,
+        "friction_metrics": friction_metrics,
+    }
+    if cache_statuses is not None:
+        result_payload["cache"] = cache_statuses
+    if r2_usage is not None:
+        result_payload["r2_usage"] = r2_usage._asdict()
+    with timings.stage("store_interaction"):
+        record_interaction(result_payload, timings.as_dict())
+    return result_payload
+
+
+async def _aprocess_analysis_request(
+    prompt: str,
+    r1_model_to_use: str,
+    initial_config: Dict[str, Any],
+    analysis_config: Dict[str, Any],
+    ontology_text: str,
+    use_cache: bool = True,
+    timings=None,
+    coalesce: bool = True,
+    routing: Optional[RoutePlan] = None,
+    priority: int = PRIORITY_INTERACTIVE
+) -> Tuple[Optional[Dict], Optional[int]]:
+    """Awaitable _process_analysis_request for the ASGI app; same payloads and statuses."""
+    if timings is None:
+        timings = start_request_timings()
+
+    flight = get_analysis_single_flight() if coalesce else None
+    if flight is not None:
+        (payload, error_status_code), _ = await flight.ado(
+            _analysis_flight_key(prompt, r1_model_to_use, initial_config, analysis_config, use_cache),
+            partial(_aprocess_analysis_request, prompt, r1_model_to_use, initial_config, analysis_config,
+                    ontology_text, use_cache=use_cache, timings=timings, coalesce=False, routing=routing,
+                    priority=priority),
+        )
+        return _own_payload(payload), error_status_code
+
+    selected_model = r1_model_to_use
+    analysis_model_name = analysis_config.get("model")
+
+    if not analysis_model_name:
+         logger.error("_aprocess_analysis_request: Analysis model name missing from analysis_config.")
+         return {"error": "Internal Server Error: Failed to determine analysis model."}, 500
+
+    cache = get_llm_result_cache()
+    router = get_latency_router()
+    rate_limited = []
+
+    async def _r1_attempt(model: str) -> Tuple[Optional[str], Optional[str]]:
+        config = _r1_config(model, r1_model_to_use, initial_config)
+        if config.get("error"):
+            logger.warning(f"R1 for {model} not sent: {config['error']}")
+            return None, None
+
+        async def _generate_initial_response():
+            await _await_rate_limit(model, config["api_key"], prompt, priority=priority)
+            return await _agenerate_r1(prompt, model, config)
+
+        start = time.perf_counter()
+        try:
+            response, cache_status = await acached_call(
+                cache, _r1_cache_key(prompt, model, config), _generate_initial_response, use_cache
+            )
+        except RateLimitExceeded as e:
+            rate_limited.append(e)
+            return None, None
+        _observe_r1(router, model, time.perf_counter() - start, response, cache_status)
+        return response, cache_status
+
+    # 1. Generate initial response
+    logger.info(f"Generating initial response (R1) with model: {selected_model}")
+    hedged = False
+    with timings.stage("r1", selected_model):
+        if routing is not None and routing.hedge is not None:
+            selected_model, (initial_response, r1_cache_status), hedged = await router.arun_hedged(routing, _r1_attempt)
+        else:
+            initial_response, r1_cache_status = await _r1_attempt(selected_model)
+    routing_info = _routing_info(routing, selected_model, hedged)
+    if initial_response is None and rate_limited:
+        logger.warning(f"R1 for {selected_model} not sent: {rate_limited[0]}")
+        return _with_routing(_rate_limited_payload(min(rate_limited, key=lambda e: e.retry_after)), routing_info), 429
+    _record_llm_outcome("r1", selected_model, initial_response, r1_cache_status)
+    if initial_response is None:
+        logger.error(f"Failed to generate initial response (R1) from LLM {selected_model}. Check LLM interface logs.")
+        return _with_routing(_r1_failure_payload(selected_model), routing_info), 502
+
+    # 2. Generate ethical analysis
+    logger.info(f"Performing analysis (R2) with model: {analysis_model_name}")
+
+    r2_usage: List[PromptUsage] = []
+
+    async def _generate_ethical_analysis():
+        await _await_rate_limit(analysis_model_name, analysis_config["api_key"], ontology_text, prompt, initial_response,
+                                priority=priority - FOLLOW_UP_BOOST)
+        return await _aperform_r2(prompt, initial_response, ontology_text, analysis_config, analysis_model_name, r2_usage)
+
+    try:
+        with timings.stage("r2", analysis_model_name):
+            raw_ethical_analysis, r2_cache_status = await acached_call(
+                cache,
+                _r2_cache_key(prompt, analysis_model_name, analysis_config, initial_response,
+                              _uses_prompt_cache(analysis_model_name)),
+                _generate_ethical_analysis,
+                use_cache,
+            )
+    except RateLimitExceeded as e:
+        logger.warning(f"R2 for {analysis_model_name} not sent: {e}")
+        return _with_routing(_rate_limited_payload(e), routing_info), 429
+    _record_llm_outcome("r2", analysis_model_name, raw_ethical_analysis, r2_cache_status)
+    if raw_ethical_analysis is None:
+        logger.error(f"Failed to generate ethical analysis (R2) from LLM {analysis_model_name}. Check LLM interface logs.")
+        return _with_routing(_r2_failure_payload(prompt, selected_model, analysis_model_name, initial_response), routing_info), 502
+
+    cache_statuses = {"r1": r1_cache_status, "r2": r2_cache_status} if cache is not None else None
+    # Parsing, scoring and storing the interaction are blocking; keep them off the event loop
+    result_payload = await run_blocking(partial(_complete_analysis, prompt, selected_model, analysis_model_name,
+                                                initial_response, raw_ethical_analysis, cache_statuses, timings,
+                                                r2_usage[0] if r2_usage else None))
+    return _with_routing(result_payload, routing_info), None
+
+
+def _cache_allowed(data: Dict[str, Any]) -> bool:
+    """False when the client opted out of the LLM result cache for this request."""
+    if data.get('bypass_cache'):
+        return False
+    return "no-cache" not in request.headers.get("Cache-Control", "").lower()
+
+
+def _prepare_analysis_request(
+    data: Optional[Dict[str, Any]],
+    require_prompt: bool = True,
+    timings=NOOP_TIMINGS
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict], Optional[int]]:
+    """Validates the request and resolves models, API configs and the ontology.
+
+    Returns (context, None, None) on success, where context holds prompt,
+    r1_model, r2_model, initial_config, analysis_config, ontology_text,
+    use_cache and routing (a RoutePlan when latency routing chose r1_model);
+    otherwise (None, error_payload, status_code).
+    """
+    # 1. Validate Request Data (models, keys, endpoints)
+    with timings.stage("validate"):
+        validation_error, status_code = _validate_analyze_request(data, require_prompt)
+    if validation_error:
+        logger.warning(f"analyze: Request validation failed - {status_code}: {validation_error.get('error')}")
+        return None, validation_error, status_code
+
+    prompt = data.get('prompt')
+    origin_model_input = data.get('origin_model')
+    analysis_model_input = data.get('analysis_model')
+    origin_api_key_input = data.get('origin_api_key')
+    analysis_api_key_input = data.get('analysis_api_key')
+    origin_api_endpoint_input = data.get('origin_api_endpoint')
+    analysis_api_endpoint_input = data.get('analysis_api_endpoint')
+
+    # --- Determine R1 Model ---
+    default_r1_model = get_config_snapshot().default_model
+    if not default_r1_model:
+         logger.error("analyze: No default R1 model in env var and ALL_MODELS list is empty!")
+         return None, {"error": "Server configuration error: No valid default model available."}, 500
+
+    routing = None
+    if origin_model_input:
+         r1_model_to_use = origin_model_input
+         logger.info(f"analyze: Using user-provided Origin Model (R1): '{r1_model_to_use}'")
+    else:
+         # A client-supplied key or endpoint belongs to the default model's provider, so it pins that model
+         router = get_latency_router() if not origin_api_key_input and not origin_api_endpoint_input else None
+         routing = _without_unusable_hedge(router.plan() if router is not None else None)
+         if routing is not None:
+             r1_model_to_use = routing.primary
+             logger.info(f"analyze: Latency routing chose Origin Model (R1): '{r1_model_to_use}' (hedge: {routing.hedge})")
+         else:
+             r1_model_to_use = default_r1_model
+             logger.info(f"analyze: Using default Origin Model (R1): '{r1_model_to_use}'")
+
+    # --- Get R1 API Configuration ---
+    with timings.stage("config"):
+        initial_config = _get_api_config(r1_model_to_use, origin_api_key_input, origin_api_endpoint_input)
+    if initial_config.get("error"):
+        config_error_msg = initial_config["error"]
+        logger.error(f"analyze: Error getting initial API config for R1 model '{r1_model_to_use}': {config_error_msg}")
+        return None, {"error": f"Configuration error for model '{r1_model_to_use}': {config_error_msg}"}, 400
+
+    # --- Determine R2 Model and Get Config ---
+    with timings.stage("config"):
+        analysis_config = _get_analysis_api_config(analysis_model_input, analysis_api_key_input, analysis_api_endpoint_input)
+    if analysis_config.get("error"):
+        config_error_msg = analysis_config["error"]
+        logger.error(f"analyze: Error getting analysis API config (selected model: '{analysis_model_input}'): {config_error_msg}")
+        return None, {"error": f"Server Configuration Error: {config_error_msg}"}, 500
+
+    r2_model_to_use = analysis_config.get("model")
+    if not r2_model_to_use:
+         logger.error("analyze: Critical internal error - r2_model_to_use is None after config fetch.")
+         return None, {"error": "Internal server error determining analysis model."}, 500
+
+    # --- Load Ontology ---
+    with timings.stage("ontology"):
+        ontology_text = load_ontology()
+    if not ontology_text:
+        logger.error(f"analyze: Failed to load ontology text from {ONTOLOGY_FILEPATH}")
+        return None, {"error": "Internal server error: Could not load ethical ontology."}, 500
+
+    context = {
+        "prompt": prompt,
+        "r1_model": r1_model_to_use,
+        "r2_model": r2_model_to_use,
+        "initial_config": initial_config,
+        "analysis_config": analysis_config,
+        "ontology_text": ontology_text,
+        "use_cache": _cache_allowed(data),
+        "routing": routing,
+    }
+    return context, None, None
+
+
+# --- Streaming Helpers ---
+
+def _sse_event(event: str, data: Any) -> str:
+    """Formats one Server-Sent Event with a JSON-encoded data field."""
+    return f"event: {event}\\ndata: {dumps_json(data).decode('utf-8')}\\n\\n"
+
+
+def _stream_analysis_events(context: Dict[str, Any], timings=NOOP_TIMINGS,
+                            include_timings: bool = False) -> Iterator[str]:
+    """Yields SSE events for an analysis: R1 text, R2 text, then parsed results.
+
+    Event sequence: ``meta``, ``r1_token``*, ``r1_done``, ``r2_token``*,
+    ``ethical_analysis``, ``ethical_scores``, ``alignment_metrics``,
+    ``friction_metrics``, ``done``. Upstream failures emit a single ``error``
+    event carrying the same payload and status the JSON endpoint would return.
+    With include_timings the ``done`` event carries the timings block.
+
+    R1 and R2 go through the same LLM result cache (same keys) and rate-limit
+    scheduler as the JSON path; a cache hit is sent as one token event. They
+    never go through the provider gateway, which relays whole responses. How
+    many ``*_token`` events a stage produces depends on llm_interface: see
+    ``modules/llm_streaming.py``.
+    """
+    prompt = context["prompt"]
+    selected_model = context["r1_model"]
+    analysis_model_name = context["r2_model"]
+    initial_config = context["initial_config"]
+    analysis_config = context["analysis_config"]
+    cache = get_llm_result_cache()
+
+    yield _sse_event("meta", {"model": selected_model, "analysis_model": analysis_model_name})
+
+    def _r1_stream() -> Iterator[str]:
+        _wait_for_rate_limit(selected_model, initial_config["api_key"], prompt)
+        yield from stream_response(prompt, initial_config["api_key"], selected_model,
+                                   api_endpoint=initial_config.get("api_endpoint"))
+
+    # 1. Stream initial response (R1)
+    r1_chunks = []
+    r1_cache_status = None
+    try:
+        with timings.stage("r1", selected_model):
+            chunks, r1_cache_status = cached_stream(cache, _r1_cache_key(prompt, selected_model, initial_config),
+                                                    _r1_stream, context["use_cache"])
+            for chunk in chunks:
+                r1_chunks.append(chunk)
+                yield _sse_event("r1_token", {"text": chunk})
+    except LLMStreamError as e:
+        logger.error(f"analyze_stream: R1 streaming failed for {selected_model}: {e}")
+        _record_llm_outcome("r1", selected_model, None, r1_cache_status)
+        yield _sse_event("error", dict(_r1_failure_payload(selected_model), status=502))
+        return
+    except RateLimitExceeded as e:
+        yield _sse_event("error", dict(_rate_limited_payload(e), status=429))
+        return
+    initial_response = "".join(r1_chunks)
+    _record_llm_outcome("r1", selected_model, initial_response, r1_cache_status)
+    yield _sse_event("r1_done", {"length": len(initial_response)})
+
+    def _r2_stream() -> Iterator[str]:
+        _wait_for_rate_limit(analysis_model_name, analysis_config["api_key"], context["ontology_text"], prompt,
+                             initial_response, priority=PRIORITY_INTERACTIVE - FOLLOW_UP_BOOST)
+        yield from stream_ethical_analysis(prompt, initial_response, context["ontology_text"],
+                                           analysis_config["api_key"], analysis_model_name,
+                                           analysis_api_endpoint=analysis_config.get("api_endpoint"))
+
+    # 2. Stream ethical analysis (R2), parsing sections as they close
+    parser = EthicalAnalysisParser()
+    sent_events = set()
+    r2_chunks = []
+    r2_cache_status = None
+    try:
+        with timings.stage("r2", analysis_model_name):
+            chunks, r2_cache_status = cached_stream(
+                cache, _r2_cache_key(prompt, analysis_model_name, analysis_config, initial_response, False),
+                _r2_stream, context["use_cache"])
+            for chunk in chunks:
+                r2_chunks.append(chunk)
+                yield _sse_event("r2_token", {"text": chunk})
+                for parser_event, value in parser.feed(chunk):
+                    sent_events.add(parser_event)
+                    if parser_event == SUMMARY_EVENT:
+                        yield _sse_event("ethical_analysis", {"text": value})
+                    elif parser_event == SCORES_EVENT:
+                        yield _sse_event("ethical_scores", value)
+    except LLMStreamError as e:
+        logger.error(f"analyze_stream: R2 streaming failed for {analysis_model_name}: {e}")
+        _record_llm_outcome("r2", analysis_model_name, None, r2_cache_status)
+        payload = _r2_failure_payload(prompt, selected_model, analysis_model_name, initial_response)
+        yield _sse_event("error", dict(payload, status=502))
+        return
+    except RateLimitExceeded as e:
+        yield _sse_event("error", dict(_rate_limited_payload(e), status=429))
+        return
+    _record_llm_outcome("r2", analysis_model_name, "".join(r2_chunks), r2_cache_status)
+
+    # 3. Emit whatever the parser could only settle at end of stream, then score
+    with timings.stage("parse"):
+        ethical_analysis_text, ethical_scores = parser.close()
+    if SUMMARY_EVENT not in sent_events:
+        yield _sse_event("ethical_analysis", {"text": ethical_analysis_text})
+    if SCORES_EVENT not in sent_events:
+        yield _sse_event("ethical_scores", ethical_scores)
+
+    alignment_metrics, friction_metrics = _compute_alignment_and_friction(prompt, initial_response, ethical_scores, timings)
+    yield _sse_event("alignment_metrics", alignment_metrics)
+    yield _sse_event("friction_metrics", friction_metrics)
+
+    with timings.stage("store_interaction"):
+        record_interaction({
+            "prompt": prompt,
+            "model": selected_model,
+            "analysis_model": analysis_model_name,
+            "initial_response": initial_response,
+            "ethical_analysis_text": ethical_analysis_text,
+            "ethical_scores": ethical_scores,
+            "alignment_metrics": alignment_metrics,
+            "friction_metrics": friction_metrics,
+        }, timings.as_dict())
+    done = {"status": 200}
+    if cache is not None:
+        done["cache"] = {"r1": r1_cache_status, "r2": r2_cache_status}
+    if include_timings:
+        done["timings"] = timings.as_dict()
+    yield _sse_event("done", done)
+
+
+def _wants_timings(data: Any) -> bool:
+    return isinstance(data, dict) and data.get('include_timings') is True
+
+
+def _wants_event_stream() -> bool:
+    best = request.accept_mimetypes.best_match(["application/json", "text/event-stream"])
+    return best == "text/event-stream"
+
+
+# --- Route ---
+
+@analyze_bp.route('/analyze', methods=['POST'])
+def analyze():
+    """Generate a response and ethical analysis for the given prompt.
+
+    Clients sending ``Accept: text/event-stream`` get the streaming variant
+    (see ``analyze_stream``). With ``"include_timings": true`` the response
+    adds a "timings" block with per-stage milliseconds.
+    """
+    if _wants_event_stream():
+        return analyze_stream()
+
+    data = get_request_data()
+    include_timings = _wants_timings(data)
+    timings = start_request_timings(include_timings)
+    context, error_payload, status_code = _prepare_analysis_request(data, timings=timings)
+    if error_payload:
+        return respond(error_payload), status_code
+
+    # --- Process Request ---
+    logger.info(f"analyze: Processing request - Prompt(start): {context['prompt'][:100]}..., R1 Model: {context['r1_model']}, R2 Model: {context['r2_model']}")
+    result_payload, error_status_code = _process_analysis_request(
+        context["prompt"],
+        context["r1_model"],
+        context["initial_config"],
+        context["analysis_config"],
+        context["ontology_text"],
+        use_cache=context["use_cache"],
+        timings=timings,
+        routing=context["routing"]
+    )
+    if include_timings:
+        result_payload["timings"] = timings.as_dict()
+
+    # --- Handle Response ---
+    if error_status_code:
+        return _error_response(result_payload, error_status_code)
+    else:
+        logger.info(f"Successfully processed /analyze request.")
+        return respond(result_payload), 200
+
+
+async def analyze_async():
+    """Non-blocking body of POST /api/analyze for the ASGI app (see backend/app/asgi.py).
+
+    Must run inside a request context. Returns exactly what ``analyze`` would.
+    Streaming requests are not handled here; the ASGI app routes them to the
+    synchronous view.
+    """
+    data = get_request_data()
+    include_timings = _wants_timings(data)
+    timings = start_request_timings(include_timings)
+    context, error_payload, status_code = _prepare_analysis_request(data, timings=timings)
+    if error_payload:
+        return respond(error_payload), status_code
+
+    logger.info(f"analyze_async: Processing request - Prompt(start): {context['prompt'][:100]}..., R1 Model: {context['r1_model']}, R2 Model: {context['r2_model']}")
+    result_payload, error_status_code = await _aprocess_analysis_request(
+        context["prompt"],
+        context["r1_model"],
+        context["initial_config"],
+        context["analysis_config"],
+        context["ontology_text"],
+        use_cache=context["use_cache"],
+        timings=timings,
+        routing=context["routing"]
+    )
+    if include_timings:
+        result_payload["timings"] = timings.as_dict()
+
+    if error_status_code:
+        return _error_response(result_payload, error_status_code)
+    logger.info(f"Successfully processed /analyze request.")
+    return respond(result_payload), 200
+
+
+@analyze_bp.route('/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """Server-Sent Events variant of /analyze.
+
+    Accepts the same body as /analyze. Validation and configuration errors are
+    returned as regular JSON responses; once the stream starts, R1 and R2 text
+    is sent as ``*_token`` events and the parsed scores/metrics follow as final
+    events (see ``_stream_analysis_events``). Text arrives incrementally only
+    if llm_interface provides streaming calls; otherwise each stage is one
+    event sent when its call completes, so the first byte comes no earlier
+    than with the JSON endpoint.
+    """
+    data = get_request_data()
+    include_timings = _wants_timings(data)
+    timings = start_request_timings(include_timings)
+    context, error_payload, status_code = _prepare_analysis_request(data, timings=timings)
+    if error_payload:
+        return respond(error_payload), status_code
+
+    logger.info(f"analyze_stream: Streaming request - Prompt(start): {context['prompt'][:100]}..., R1 Model: {context['r1_model']}, R2 Model: {context['r2_model']}")
+    events = _stream_analysis_events(context, timings, include_timings)
+    response = Response(stream_with_context(events), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+'''
+
+# ============================================================================
+# 4. routes/alignment.py
+# ============================================================================
+files_to_create[os.path.join(ROUTES, 'alignment.py')] = '''\
+"""Alignment routes: POST /api/check_alignment, POST /api/check_alignment/bulk and POST /api/multi_agent_analyze."""
+
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Blueprint, Response, request, stream_with_context
+
+from backend.app.api_config import _env_number
+from backend.app.modules.serialization import dumps_json, get_query_flag, get_request_data, respond
+from backend.app.modules.bulk_alignment import check_alignment_record, iter_bulk_results
+from backend.app.modules.score_schema import ADHERENCE_SCALES, STANDARD_DIMENSIONS, validate_ethical_scores_batch
+
+# --- Blueprint Definition ---
+alignment_bp = Blueprint('alignment', __name__, url_prefix='/api')
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+CHECK_ALIGNMENT_BULK_WORKERS_ENV = "CHECK_ALIGNMENT_BULK_WORKERS"
+
+
+@alignment_bp.route('/check_alignment', methods=['POST'])
+def check_alignment():
+    """Check ethical alignment between a human prompt and AI response.
+
+    This endpoint allows checking alignment on previously generated responses
+    without requiring a new LLM call. Useful for re-analyzing cached responses.
+
+    Request body:
+        {
+            "prompt": "The original human prompt",
+            "response": "The AI-generated response",
+            "ethical_scores": { ... }  # Optional: pre-computed ethical scores
+        }
+
+    Returns:
+        400 with {"error": ..., "details": [{"path": ..., "error": ...}]} if
+        ethical_scores does not match the score schema, otherwise
+        {
+            "alignment_metrics": { ... },
             "friction_metrics": { ... }  # If ethical_scores with ai_welfare provided
         }
     """
-    data = request.get_json()
+    payload, status_code = check_alignment_record(get_request_data())
+    if status_code == 200:
+        logger.info(f"check_alignment: Computed alignment score={payload['alignment_metrics'].get('human_ai_alignment')}")
+    return respond(payload), status_code
+
+
+@alignment_bp.route('/check_alignment/bulk', methods=['POST'])
+def check_alignment_bulk():
+    """Re-score many prompt/response pairs in one streaming request.
+
+    Request body (application/x-ndjson): one check_alignment record per line,
+    optionally with an "id" that is echoed back. Query parameters:
+        ordered=true          results in input order (default: completion order)
+        record_history=false  keep these samples out of the friction/alignment trend
+
+    Returns:
+        application/x-ndjson, one line per record as it completes:
+        {"index": <record index>, "status": <HTTP status>, "result": <check_alignment payload>, "id": ...}
+        A bad record reports its own status without affecting the rest.
+
+    Records are read from the request stream as workers free up, so memory
+    stays constant for any input size (under the ASGI app the body is
+    buffered first; stream large files to the WSGI server or use the
+    offline CLI in modules/bulk_alignment).
+    """
+    ordered = get_query_flag("ordered", False)
+    record_history = get_query_flag("record_history", True)
+    if ordered is None or record_history is None:
+        return respond({"error": "Query parameters 'ordered' and 'record_history' must be true or false"}), 400
+
+    workers = max(1, _env_number(CHECK_ALIGNMENT_BULK_WORKERS_ENV, 8, int))
+    stream = request.stream
+
+    def generate():
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="check-alignment-bulk")
+        scored = 0
+        try:
+            for line in iter_bulk_results(stream, executor, max_in_flight=workers * 4,
+                                          ordered=ordered, record_history=record_history):
+                scored += 1
+                yield dumps_json(line) + b"\\n"
+        finally:
+            # Client disconnects close this generator early; drop work that has not started
+            executor.shutdown(wait=False, cancel_futures=True)
+            logger.info(f"check_alignment_bulk: Streamed {scored} results")
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@alignment_bp.route('/multi_agent_analyze', methods=['POST'])
+def multi_agent_analyze():
+    """Analyze and compare ethical alignment across multiple AI responses.
+
+    This endpoint allows comparing ethical positions from multiple AI models
+    for the same prompt, identifying consensus and conflicts.
+
+    Request body:
+        {
+            "prompt": "The original prompt",
+            "responses": [
+                {
+                    "model_name": "gpt-4o",
+                    "response": "Response text from model",
+                    "ethical_scores": { ... },  # Optional
+                    "adherence_scale": 10        # Optional: 10 (default) or 1 if adherence is 0-1
+                },
+                ...
+            ],
+            "consensus_matrix": false,         # Optional: add vectorized consensus analysis
+            "include_agreement_matrix": false  # Optional: also return the agents x agents matrix
+        }
+
+    Returns:
+        Multi-agent comparison analysis including individual alignments
+        and consensus framework, plus "timing": {"wall_ms", "cpu_ms"} for
+        the comparison itself. compare_responses_for_prompt scores the
+        responses one after another on the request thread; that scoring
+        lives in multi_agent_alignment, so it is not fanned out here.
+        With "consensus_matrix": true a "consensus_matrix" block adds the
+        consensus score, outlier agents and per-dimension conflict computed
+        from every response's ethical_scores (requires numpy), each read on
+        its response's adherence_scale.
+    """
+    data = get_request_data()
+
+    if not data:
+        return respond({"error": "No JSON data received"}), 400
+
+    prompt = data.get('prompt')
+    responses = data.get('responses')
+
+    if not prompt or not isinstance(prompt, str) or not prompt.strip():
+        return respond({"error": "Invalid or missing 'prompt' provided"}), 400
+
+    if not responses or not isinstance(responses, list) or len(responses) < 1:
+        return respond({"error": "At least one response is required in 'responses' array"}), 400
+
+    want_consensus = data.get('consensus_matrix', False)
+    include_agreement_matrix = data.get('include_agreement_matrix', False)
+    if not isinstance(want_consensus, bool) or not isinstance(include_agreement_matrix, bool):
+        return respond({"error": "Optional 'consensus_matrix' and 'include_agreement_matrix' must be booleans"}), 400
+    if want_consensus:
+        # Imported on first use: it loads numpy, which most deployments never need here
+        from backend.app.modules.consensus_matrix import CONSENSUS_AVAILABLE, analyze_consensus
+        if not CONSENSUS_AVAILABLE:
+            return respond({"error": "Consensus matrix analysis is unavailable: numpy is not installed on the server."}), 501
+
+    # Validate response structure
+    validated_responses = []
+    adherence_scales = []
+    for i, resp in enumerate(responses):
+        if not isinstance(resp, dict):
+            return respond({"error": f"Response at index {i} is not a valid object"}), 400
+
+        model_name = resp.get('model_name', f'model_{i}')
+        response_text = resp.get('response')
+        ethical_scores = resp.get('ethical_scores')
+
+        if not response_text or not isinstance(response_text, str):
+            return respond({"error": f"Response at index {i} is missing valid 'response' text"}), 400
+
+        # Validate ethical_scores is either None or a dict
+        if ethical_scores is not None and not isinstance(ethical_scores, dict):
+            return respond({"error": f"Response at index {i} has invalid 'ethical_scores' - must be an object or null"}), 400
+
+        adherence_scale = resp.get('adherence_scale')
+        if adherence_scale is not None and (isinstance(adherence_scale, bool) or adherence_scale not in ADHERENCE_SCALES):
+            return respond({"error": f"Response at index {i} has invalid 'adherence_scale' - must be 10 or 1"}), 400
+
+        validated_responses.append((model_name, response_text, ethical_scores))
+        adherence_scales.append(adherence_scale)
+
+    coerced_scores, schema_errors = validate_ethical_scores_batch(
+        [scores for _, _, scores in validated_responses],
+        require_dimensions=False,
+        path_template="responses[{index}].ethical_scores",
+    )
+    if schema_errors:
+        return respond({"error": "Invalid 'ethical_scores' provided", "details": schema_errors}), 400
+    validated_responses = [
+        (model_name, response_text, scores)
+        for (model_name, response_text, _), scores in zip(validated_responses, coerced_scores)
+    ]
+    scale_errors = _adherence_above_scale(coerced_scores, adherence_scales)
+    if scale_errors:
+        return respond({"error": "Invalid 'ethical_scores' provided", "details": scale_errors}), 400
+
+    try:
+        from backend.app.modules.multi_agent_alignment import get_multi_agent_alignment
+        multi_agent = get_multi_agent_alignment()
+        # Only the comparison is timed, not the first-use import or singleton construction
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        result = multi_agent.compare_responses_for_prompt(
+            prompt.strip(),
+            validated_responses
+        )
+        timing = {
+            "wall_ms": round((time.perf_counter() - wall_start) * 1000, 3),
+            "cpu_ms": round((time.thread_time() - cpu_start) * 1000, 3),
+        }
+        if want_consensus:
+            result["consensus_matrix"] = analyze_consensus(
+                [model_name for model_name, _, _ in validated_responses],
+                [scores for _, _, scores in validated_responses],
+                include_matrix=include_agreement_matrix,
+                adherence_scales=adherence_scales,
+            )
+        result["timing"] = timing
+
+        logger.info(f"multi_agent_analyze: Compared {len(validated_responses)} responses, "
+                   f"best aligned: {result.get('best_aligned_agent')}, "
+                   f"wall={timing['wall_ms']}ms cpu={timing['cpu_ms']}ms")
+
+        return respond(result), 200
+
+    except Exception as e:
+        logger.error(f"multi_agent_analyze: Error during analysis: {e}", exc_info=True)
+        return respond({"error": f"Error during multi-agent analysis: {str(e)}"}), 500
+
+
+def _adherence_above_scale(coerced_scores, adherence_scales):
+    """Schema-style errors for adherence scores above the response's declared adherence_scale."""
+    errors = []
+    for index, (scores, scale) in enumerate(zip(coerced_scores, adherence_scales)):
+        if not scores or scale is None:
+            continue
+        for dim in STANDARD_DIMENSIONS:
+            dim_data = scores.get(dim)
+            value = dim_data.get("adherence_score") if isinstance(dim_data, dict) else None
+            if isinstance(value, (int, float)) and value > scale:
+                errors.append({"path": f"responses[{index}].ethical_scores.{dim}.adherence_score",
+                               "error": f"must be at most the adherence_scale of {scale:g}"})
+    return errors
+'''
+
+# ============================================================================
+# 5. routes/friction.py
+# ============================================================================
+files_to_create[os.path.join(ROUTES, 'friction.py')] = '''\
+"""Friction route: GET /api/friction_trend."""
+
+import logging
+
+from flask import Blueprint, Response, request
+
+from backend.app.modules.serialization import get_query_flag, respond
+from backend.app.modules.friction_monitor import get_friction_monitor
+from backend.app.modules.friction_trend import summarize_trend
+from backend.app.modules.history_store import ALIGNMENT, FRICTION, get_history_backend
+
+# --- Blueprint Definition ---
+friction_bp = Blueprint('friction', __name__, url_prefix='/api')
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+
+@friction_bp.route('/friction_trend', methods=['GET'])
+def get_friction_trend():
+    """Get friction trend data from recent interactions.
+
+    Query parameters:
+        window: Optional number of most recent samples to summarize; must be
+            one of the configured FRICTION_TREND_WINDOWS (default: the largest).
+        monitor: Optional; "true" adds "monitor" with the friction monitor's
+            own trend and history summaries.
+
+    Returns "window_stats" and "alignment_window_stats" (count, mean,
+    variance, min, max, slope, ewma) for the requested window from the
+    history backend, which is shared across workers when
+    HISTORY_BACKEND=sqlite. "trend" (direction, slope, mean, ewma) and
+    "history" (all-time sample counts) are derived from the same statistics,
+    so a request never walks the full history. Responses carry an ETag; a
+    matching If-None-Match returns 304 while no new samples have been
+    recorded.
+
+    The monitor summaries are recomputed over its whole history on every
+    such request and cover only the answering worker, so those responses
+    carry no ETag.
+    """
+    history = get_history_backend()
+    raw_window = request.args.get('window')
+    window = history.windows[-1]
+    if raw_window is not None:
+        try:
+            window = int(raw_window)
+        except ValueError:
+            window = None
+        if window not in history.windows:
+            return respond({"error": f"Invalid 'window'. Available windows: {list(history.windows)}"}), 400
+
+    include_monitor = get_query_flag('monitor', False)
+    if include_monitor is None:
+        return respond({"error": "Optional 'monitor' must be a boolean"}), 400
+    etag = f"{history.version}-w{window}"
+    if not include_monitor and request.if_none_match.contains(etag):
+        not_modified = Response(status=304)
+        not_modified.set_etag(etag)
+        not_modified.headers["Cache-Control"] = "no-cache"
+        return not_modified
+
+    try:
+        friction_stats = history.window_stats(FRICTION, window)
+        alignment_stats = history.window_stats(ALIGNMENT, window)
+        result = {
+            "trend": summarize_trend(friction_stats),
+            "history": {
+                "friction_samples": friction_stats["total_samples"],
+                "alignment_samples": alignment_stats["total_samples"],
+                "last_sample_timestamp": friction_stats["last_timestamp"],
+            },
+            "window_stats": friction_stats,
+            "alignment_window_stats": alignment_stats,
+            "history_backend": history.name,
+            "available_windows": list(history.windows),
+        }
+        if include_monitor:
+            friction_monitor = get_friction_monitor()
+            result["monitor"] = {
+                "trend": friction_monitor.calculate_friction_trend(),
+                "history": friction_monitor.get_history_summary(),
+            }
+
+        response = respond(result)
+        if not include_monitor:
+            response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response, 200
+
+    except Exception as e:
+        logger.error(f"friction_trend: Error getting trend data: {e}", exc_info=True)
+        return respond({"error": f"Error getting friction trend: {str(e)}"}), 500
+'''
+
+# ============================================================================
+# 6. routes/models.py
+# ============================================================================
+files_to_create[os.path.join(ROUTES, 'models.py')] = '''\
+"""Models route: GET /api/models."""
+
+from flask import Blueprint
+
+from backend.app.modules.serialization import respond
+from backend.app.api_config import ALL_MODELS
+
+# --- Blueprint Definition ---
+models_bp = Blueprint('models', __name__, url_prefix='/api')
+
+
+@models_bp.route('/models', methods=['GET'])
+def get_models():
+    """Return the list of available models"""
+    valid_models = [model for model in ALL_MODELS if isinstance(model, str) and model]
+    return respond({
+        "models": valid_models
+    })
+'''
+
+# ============================================================================
+# 7. Updated __init__.py
+# ============================================================================
+files_to_create[os.path.join(BASE, '__init__.py')] = '''\
+"""
+Backend API for Ethical Review Application
+"""
+from typing import Optional
+
+from flask import Flask
+from flask_cors import CORS
+
+def create_app(preload: Optional[bool] = None):
+    """Factory pattern for creating Flask app with config
+
+    With preload=True (or APP_PRELOAD=1 when preload is None), shared state is
+    built up front so forked workers inherit it; see backend.app.preload.
+    """
+    app = Flask(__name__)
+    # Enable CORS for frontend
+    CORS(app)
+
+    # Build the provider registry once; SIGHUP rebuilds it from the environment
+    from backend.app.api_config import get_config_snapshot, install_config_reload_signal
+    get_config_snapshot()
+    install_config_reload_signal()
+
+    # Import and register route blueprints
+    from backend.app.routes import register_routes
+    register_routes(app)
+
+    from backend.app.preload import maybe_preload
+    maybe_preload(preload)
+
+    return app
+'''
+
+# ============================================================================
+# 8. Updated api.py (backward-compatible re-export)
+# ============================================================================
+files_to_create[os.path.join(BASE, 'api.py')] = '''\
+"""Backward compatibility: import routes from their new locations."""
+# Routes have been split into backend/app/routes/
+# This file is kept for backward compatibility
+from backend.app.routes.analyze import analyze_bp as api_bp
+
+__all__ = ['api_bp']
+'''
+
+# ============================================================================
+# 9. modules/log_sink.py - background batched log writer
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'log_sink.py')] = '''\
+"""Background, batched log sinks that keep file I/O off the request thread."""
+
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Queue-full policies ---
+DROP = "drop"    # Discard the record immediately when the queue is full
+BLOCK = "block"  # Wait up to block_timeout for room, then discard
+
+_FLUSH = object()
+_STOP = object()
+
+
+class BackgroundBatchWriter:
+    """Feeds submitted records through a bounded queue to a writer thread.
+
+    The writer thread collects up to ``max_batch`` records (or whatever arrived
+    within ``flush_interval``) and hands them to ``_write_batch`` in one call.
+    ``submit`` never blocks longer than ``block_timeout``; when the queue stays
+    full the record is dropped and counted. The thread is started lazily and
+    restarted after a fork, so instances can be created before workers fork.
+    """
+
+    def __init__(self,
+                 name: str,
+                 max_queue: int = 10000,
+                 max_batch: int = 256,
+                 flush_interval: float = 0.5,
+                 full_policy: str = DROP,
+                 block_timeout: float = 0.05):
+        if full_policy not in (DROP, BLOCK):
+            raise ValueError(f"Unknown queue-full policy '{full_policy}'. Expected '{DROP}' or '{BLOCK}'.")
+        self.name = name
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.full_policy = full_policy
+        self.block_timeout = block_timeout
+        self._start_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self._pid = os.getpid()
+        self._closed = False
+        # Producers and the writer thread both update the counters
+        self._stats_lock = threading.Lock()
+        self._stats = {"submitted": 0, "written": 0, "dropped": 0, "batches": 0, "errors": 0}
+
+    # --- Producer side ---
+
+    def submit(self, record: Any) -> bool:
+        """Queues a record for writing. Returns False if it was dropped."""
+        if self._closed:
+            self._count(dropped=1)
+            return False
+        self._ensure_started()
+        try:
+            if self.full_policy == BLOCK:
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            self._count(dropped=1)
+            return False
+        self._count(submitted=1)
+        return True
+
+    def flush(self, timeout: Optional[float] = 5.0) -> bool:
+        """Blocks until everything queued before this call has been written."""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put((_FLUSH, done), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = 5.0):
+        """Flushes pending records and stops the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        thread = self._thread
+        if thread is None or not thread.is_alive() or self._pid != os.getpid():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning(f"{self.name}: Queue still full at shutdown; pending records may be lost.")
+            return
+        thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns counters plus the current queue depth."""
+        with self._stats_lock:
+            counters = dict(self._stats)
+        return dict(counters, queued=self._queue.qsize(), policy=self.full_policy)
+
+    def _count(self, **increments: int):
+        with self._stats_lock:
+            for name, amount in increments.items():
+                self._stats[name] += amount
+
+    # --- Writer side ---
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                # Forked child: the parent's thread and queue contents are not ours
+                self._queue = queue.Queue(maxsize=self.max_queue)
+                self._thread = None
+                self._pid = os.getpid()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch: List[Any] = []
+            flush_events: List[threading.Event] = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                elif isinstance(item, tuple) and len(item) == 2 and item[0] is _FLUSH:
+                    flush_events.append(item[1])
+                else:
+                    batch.append(item)
+                if stopping or flush_events or len(batch) >= self.max_batch:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if stopping:
+                # Drain whatever producers managed to queue before the stop marker
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, tuple) and len(item) == 2 and item[0] is _FLUSH:
+                        flush_events.append(item[1])
+                    elif item is not _STOP:
+                        batch.append(item)
+            if batch:
+                try:
+                    self._write_batch(batch)
+                    self._count(written=len(batch), batches=1)
+                except Exception as e:
+                    self._count(errors=1)
+                    logger.error(f"{self.name}: Error writing batch of {len(batch)} records: {e}")
+            for event in flush_events:
+                event.set()
+
+    def _write_batch(self, records: List[Any]):
+        raise NotImplementedError
+
+
+class _InterProcessLock:
+    """Exclusive advisory lock on a sidecar file, shared by all worker processes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    def __enter__(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+class RotatingFileSink(BackgroundBatchWriter):
+    """Appends text records to a file in batches, rotating by size and/or age.
+
+    Each batch is written with a single append while holding an inter-process
+    lock on ``<filepath>.lock``, so several workers can share one file without
+    interleaving partial records. Rotation shifts ``file`` to ``file.1`` (and
+    ``file.N`` to ``file.N+1``) once the file would exceed ``max_bytes`` or,
+    when ``rotate_interval`` is set, once that many seconds have passed since
+    the last rotation.
+    """
+
+    def __init__(self,
+                 filepath: str,
+                 max_bytes: int = 10 * 1024 * 1024,
+                 rotate_interval: float = 0,
+                 backup_count: int = 5,
+                 **writer_kwargs):
+        super().__init__(name=f"log-sink:{os.path.basename(filepath)}", **writer_kwargs)
+        self.filepath = filepath
+        self.lock_path = filepath + ".lock"
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self._dir_ready = False
+
+    def _write_batch(self, records: List[str]):
+        data = "".join(records).encode("utf-8")
+        if not self._dir_ready:
+            log_dir = os.path.dirname(self.filepath)
+            if log_dir and not os.path.exists(log_dir):
+                os.makedirs(log_dir, exist_ok=True)
+                logger.info(f"Created log directory: {log_dir}")
+            self._dir_ready = True
+
+        with _InterProcessLock(self.lock_path):
+            if self._should_rotate(len(data)):
+                self._rotate()
+            fd = os.open(self.filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+
+    def _should_rotate(self, incoming_bytes: int) -> bool:
+        try:
+            size = os.path.getsize(self.filepath)
+        except OSError:
+            return False
+        if size == 0:
+            return False
+        if self.max_bytes and size + incoming_bytes > self.max_bytes:
+            return True
+        if self.rotate_interval:
+            # The lock file's mtime records the last rotation across all processes
+            last_rotation = os.path.getmtime(self.lock_path)
+            return time.time() - last_rotation >= self.rotate_interval
+        return False
+
+    def _rotate(self):
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = f"{self.filepath}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.filepath}.{index + 1}")
+            os.replace(self.filepath, f"{self.filepath}.1")
+        else:
+            os.remove(self.filepath)
+        os.utime(self.lock_path)
+        logger.info(f"Rotated log file {self.filepath}")
+
+
+_sinks: Dict[str, BackgroundBatchWriter] = {}
+_sinks_lock = threading.Lock()
+
+
+def get_rotating_file_sink(filepath: str, **sink_kwargs) -> RotatingFileSink:
+    """Returns the process-wide sink for ``filepath``, creating it on first use."""
+    sink = _sinks.get(filepath)
+    if sink is None:
+        with _sinks_lock:
+            sink = _sinks.get(filepath)
+            if sink is None:
+                sink = RotatingFileSink(filepath, **sink_kwargs)
+                _sinks[filepath] = sink
+    return sink
+
+
+def close_all_sinks(timeout: float = 5.0):
+    """Flushes and stops every sink created through this module."""
+    for sink in list(_sinks.values()):
+        sink.close(timeout)
+
+
+atexit.register(close_all_sinks)
+'''
+
+# ============================================================================
+# 10. modules/llm_streaming.py - token streaming adapters
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'llm_streaming.py')] = '''\
+"""Streaming adapters over the LLM interface.
+
+If ``llm_interface`` provides ``generate_response_stream`` /
+``perform_ethical_analysis_stream`` (generators yielding text chunks), they are
+used directly and text is forwarded as the provider produces it. The current
+llm_interface has neither, so the blocking call is made and its full text is
+yielded as a single chunk once it completes: callers can always consume an
+iterator, but time to first byte is the same as for the blocking call until
+llm_interface gains streaming support.
+"""
+
+import logging
+from typing import Iterator, Optional
+
+from backend.app.modules import llm_interface
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+
+class LLMStreamError(Exception):
+    """Raised when the upstream model failed or produced no output."""
+
+
+def stream_response(prompt: str,
+                    api_key: str,
+                    model: str,
+                    api_endpoint: Optional[str] = None) -> Iterator[str]:
+    """Yields the R1 response text as it is generated."""
+    streamer = getattr(llm_interface, "generate_response_stream", None)
+    if streamer is not None:
+        try:
+            yield from streamer(prompt, api_key, model, api_endpoint=api_endpoint)
+        except Exception as e:
+            raise LLMStreamError(f"Streaming response from {model} failed: {e}") from e
+        return
+
+    text = llm_interface.generate_response(prompt, api_key, model, api_endpoint=api_endpoint)
+    if text is None:
+        raise LLMStreamError(f"No response generated by {model}")
+    yield text
+
+
+def stream_ethical_analysis(prompt: str,
+                            initial_response: str,
+                            ontology_text: str,
+                            api_key: str,
+                            model: str,
+                            analysis_api_endpoint: Optional[str] = None) -> Iterator[str]:
+    """Yields the R2 ethical analysis text as it is generated."""
+    streamer = getattr(llm_interface, "perform_ethical_analysis_stream", None)
+    if streamer is not None:
+        try:
+            yield from streamer(prompt, initial_response, ontology_text, api_key, model,
+                                analysis_api_endpoint=analysis_api_endpoint)
+        except Exception as e:
+            raise LLMStreamError(f"Streaming ethical analysis from {model} failed: {e}") from e
+        return
+
+    text = llm_interface.perform_ethical_analysis(prompt, initial_response, ontology_text, api_key, model,
+                                                  analysis_api_endpoint=analysis_api_endpoint)
+    if text is None:
+        raise LLMStreamError(f"No ethical analysis generated by {model}")
+    yield text
+'''
+
+# ============================================================================
+# 11. modules/analysis_jobs.py - asynchronous analysis job pool
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'analysis_jobs.py')] = '''\
+"""Asynchronous analysis jobs executed on a bounded worker pool.
+
+Job state lives in SQLite (WAL mode) at ANALYSIS_JOB_STORE_PATH (default
+context/analysis_jobs.sqlite3), shared by every worker process: a job
+accepted by one gunicorn worker can be polled through any other. The job
+itself runs in the worker that accepted it, so ANALYSIS_JOB_WORKERS and
+ANALYSIS_JOB_QUEUE_DEPTH apply per process. A job still running
+ORPHANED_JOB_GRACE_SECONDS past its timeout (its worker died or was
+restarted) is marked as timed out by whichever worker next sweeps.
+
+ANALYSIS_JOB_STORE_ENABLED=0, or a store that cannot be opened, keeps jobs
+in the accepting process's memory only. Polls served by any other process
+then return 404, so run a single worker process in that mode.
+
+A finished job can be POSTed to a client-supplied ``callback_url``. Callbacks
+only go to http(s) hosts whose addresses are all public: loopback, private,
+link-local, multicast and reserved addresses are refused both when the job
+is submitted and again right before the callback is sent, and redirects are
+not followed. ANALYSIS_JOB_CALLBACK_HOSTS (comma-separated host names; a
+leading ``*.`` matches any subdomain) additionally restricts callbacks to
+the listed hosts.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import ipaddress
+import threading
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from backend.app.api_config import _env_number
+from backend.app.modules.serialization import dumps_json, loads_json
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+ANALYSIS_JOB_WORKERS_ENV = "ANALYSIS_JOB_WORKERS"
+ANALYSIS_JOB_QUEUE_DEPTH_ENV = "ANALYSIS_JOB_QUEUE_DEPTH"
+ANALYSIS_JOB_TIMEOUT_ENV = "ANALYSIS_JOB_TIMEOUT_SECONDS"
+ANALYSIS_JOB_RESULT_TTL_ENV = "ANALYSIS_JOB_RESULT_TTL_SECONDS"
+ANALYSIS_JOB_CALLBACK_HOSTS_ENV = "ANALYSIS_JOB_CALLBACK_HOSTS"
+ANALYSIS_JOB_STORE_ENABLED_ENV = "ANALYSIS_JOB_STORE_ENABLED"
+ANALYSIS_JOB_STORE_PATH_ENV = "ANALYSIS_JOB_STORE_PATH"
+DEFAULT_ANALYSIS_JOB_STORE_PATH = "context/analysis_jobs.sqlite3"
+CALLBACK_TIMEOUT_SECONDS = 10
+# Extra time a job's own worker gets to time it out before other workers treat it as orphaned
+ORPHANED_JOB_GRACE_SECONDS = 60.0
+
+# --- Job states ---
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TIMED_OUT = "timed_out"
+FINISHED_STATES = (SUCCEEDED, FAILED, TIMED_OUT)
+
+
+class JobQueueFull(Exception):
+    """Raised when the number of queued plus running jobs has reached the limit."""
+
+
+class CallbackRefused(Exception):
+    """Raised when a callback URL is not allowed (see the module docstring)."""
+
+
+def _callback_hosts() -> List[str]:
+    return [host.strip().lower() for host in os.getenv(ANALYSIS_JOB_CALLBACK_HOSTS_ENV, "").split(",") if host.strip()]
+
+
+def _host_allowed(host: str, allowed: List[str]) -> bool:
+    for entry in allowed:
+        if entry.startswith("*.") and host.endswith(entry[1:]):
+            return True
+        if host == entry:
+            return True
+    return False
+
+
+def _is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if getattr(ip, "ipv4_mapped", None) is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_callback_url(url: str):
+    """Raises CallbackRefused unless url is an http(s) URL whose host may receive callbacks.
+
+    The host must be on ANALYSIS_JOB_CALLBACK_HOSTS when that is set, and
+    every address it resolves to must be public.
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise CallbackRefused("callback_url must be an http:// or https:// URL with a host.")
+    host = parts.hostname.lower()
+    allowed = _callback_hosts()
+    if allowed and not _host_allowed(host, allowed):
+        raise CallbackRefused(f"callback_url host '{host}' is not in {ANALYSIS_JOB_CALLBACK_HOSTS_ENV}.")
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, ValueError) as e:
+        raise CallbackRefused(f"callback_url host '{host}' could not be resolved: {e}") from e
+    if not addresses or not all(_is_public_address(address) for address in addresses):
+        raise CallbackRefused(f"callback_url host '{host}' resolves to a non-public address.")
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # A redirect could point the callback at an internal address
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_callback_opener = urllib.request.build_opener(_NoRedirect)
+
+
+class AnalysisJob:
+    """State of a single queued analysis."""
+
+    def __init__(self, callback_url: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.status = QUEUED
+        self.callback_url = callback_url
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.status_code: Optional[int] = None
+
+    @classmethod
+    def from_row(cls, row: Tuple[Any, ...]) -> "AnalysisJob":
+        """Rebuilds a job from a JobStore row (columns in _JOB_COLUMNS order)."""
+        job = cls(row[2])
+        job.id, job.status = row[0], row[1]
+        job.created_at, job.started_at, job.finished_at, job.status_code = row[3:7]
+        job.result = loads_json(row[7]) if row[7] is not None else None
+        return job
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "status_code": self.status_code,
+            "result": self.result,
+        }
+
+
+_JOB_COLUMNS = ("id", "status", "callback_url", "created_at", "started_at", "finished_at", "status_code", "result")
+
+
+class JobStore:
+    """Job rows in SQLite, shared by every process that opens the same file.
+
+    Writes are synchronous, so a job is visible to every worker as soon as
+    submit returns.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS analysis_jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, callback_url TEXT, created_at REAL NOT NULL, "
+            "started_at REAL, finished_at REAL, status_code INTEGER, result TEXT)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS analysis_jobs_status ON analysis_jobs (status, finished_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def save(self, job: "AnalysisJob"):
+        """Inserts or overwrites the job's row."""
+        self._connection().execute(
+            f"INSERT OR REPLACE INTO analysis_jobs ({', '.join(_JOB_COLUMNS)}) VALUES ({', '.join('?' * len(_JOB_COLUMNS))})",
+            _job_row(job),
+        )
+
+    def finish(self, job: "AnalysisJob"):
+        """Stores a finished job unless another worker has already timed it out."""
+        self._connection().execute(
+            "UPDATE analysis_jobs SET status = ?, finished_at = ?, status_code = ?, result = ? WHERE id = ? AND status = ?",
+            (job.status, job.finished_at, job.status_code, _json_column(job.result), job.id, RUNNING),
+        )
+
+    def load(self, job_id: str) -> Optional["AnalysisJob"]:
+        row = self._connection().execute(
+            f"SELECT {', '.join(_JOB_COLUMNS)} FROM analysis_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return AnalysisJob.from_row(row) if row is not None else None
+
+    def time_out_orphans(self, started_before: float, payload: Dict[str, Any]) -> int:
+        """Marks jobs still running since before started_before as timed out; returns how many."""
+        return self._connection().execute(
+            "UPDATE analysis_jobs SET status = ?, finished_at = ?, status_code = 504, result = ? "
+            "WHERE status = ? AND started_at < ?",
+            (TIMED_OUT, time.time(), _json_column(payload), RUNNING, started_before),
+        ).rowcount
+
+    def delete_expired(self, finished_before: float) -> int:
+        return self._connection().execute(
+            f"DELETE FROM analysis_jobs WHERE status IN ({', '.join('?' * len(FINISHED_STATES))}) AND finished_at < ?",
+            FINISHED_STATES + (finished_before,),
+        ).rowcount
+
+
+def _json_column(value: Any) -> Optional[str]:
+    return None if value is None else dumps_json(value).decode("utf-8")
+
+
+def _job_row(job: "AnalysisJob") -> Tuple[Any, ...]:
+    return (job.id, job.status, job.callback_url, job.created_at, job.started_at, job.finished_at,
+            job.status_code, _json_column(job.result))
+
+
+class AnalysisJobManager:
+    """Runs job bodies on a thread pool with a queue depth limit, per-job timeout and result TTL.
+
+    Job bodies return ``(payload, error_status_code)`` like ``_process_analysis_request``;
+    the payload is stored unchanged so polling clients see exactly what the
+    synchronous endpoint would have returned. A reaper thread marks a job
+    still running after ``job_timeout`` seconds as timed out (504) and sends
+    its callback, whether or not anyone polls. The job's thread cannot be
+    interrupted: it keeps its queue slot until it actually returns, and its
+    late result is discarded. Finished jobs are kept for ``result_ttl`` seconds.
+
+    With a ``store`` every state change is written through to it and ``get``
+    reads from it, so any process sharing the store sees every job; without
+    one, only this manager's own jobs are visible.
+    """
+
+    def __init__(self,
+                 max_workers: int = 4,
+                 max_queue_depth: int = 100,
+                 job_timeout: float = 300.0,
+                 result_ttl: float = 3600.0,
+                 store: Optional[JobStore] = None):
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.job_timeout = job_timeout
+        self.result_ttl = result_ttl
+        self.store = store
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, AnalysisJob] = {}
+        # Queued jobs plus jobs whose thread has not returned yet, timed out or not
+        self._active = 0
+        self._overdue = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._reaper: Optional[threading.Thread] = None
+        self._pid = os.getpid()
+        self._last_sweep: Optional[float] = None
+
+    def submit(self, body: Callable[..., Tuple[Optional[Dict], Optional[int]]], *args,
+               callback_url: Optional[str] = None) -> AnalysisJob:
+        """Queues body(*args) and returns its job. Raises JobQueueFull at the depth limit."""
+        job = AnalysisJob(callback_url)
+        with self._lock:
+            self._sweep_locked()
+            if self._active >= self.max_queue_depth:
+                raise JobQueueFull(f"Analysis job queue is full ({self.max_queue_depth} jobs pending).")
+            self._active += 1
+            self._jobs[job.id] = job
+        try:
+            self._store_job(job)
+            self._get_executor().submit(self._run, job, body, args)
+        except Exception:
+            with self._lock:
+                self._active -= 1
+                self._jobs.pop(job.id, None)
+            raise
+        return job
+
+    def get(self, job_id: str) -> Optional[AnalysisJob]:
+        """Returns the job, or None if it is unknown or expired."""
+        with self._lock:
+            self._sweep_locked()
+            job = self._jobs.get(job_id)
+        if self.store is None:
+            return job
+        try:
+            return self.store.load(job_id)
+        except sqlite3.Error as e:
+            logger.error(f"Analysis job store: could not load job {job_id}: {e}")
+            return job
+
+    def reap(self) -> List[AnalysisJob]:
+        """Marks running jobs past job_timeout as timed out and sends their callbacks; returns them."""
+        if not self.job_timeout:
+            return []
+        deadline = time.time() - self.job_timeout
+        with self._lock:
+            overdue = [job for job in self._jobs.values() if job.status == RUNNING and job.started_at < deadline]
+            for job in overdue:
+                self._finish_locked(job, self._timeout_payload(), 504, TIMED_OUT)
+                self._overdue += 1
+        for job in overdue:
+            logger.warning(f"Analysis job {job.id} timed out after {self.job_timeout:g}s.")
+            self._store_finished(job)
+            if job.callback_url:
+                self._send_callback(job)
+        return overdue
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {"active": self._active, "timed_out_still_running": self._overdue,
+                    "max_queue_depth": self.max_queue_depth, "max_workers": self.max_workers, "jobs": counts}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # Threads do not survive fork; each worker process gets its own pool
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="analysis-job")
+                self._pid = os.getpid()
+                self._reaper = None
+            if self._reaper is None and self.job_timeout:
+                self._reaper = threading.Thread(target=self._reap_loop, name="analysis-job-reaper", daemon=True)
+                self._reaper.start()
+            return self._executor
+
+    def _reap_loop(self):
+        interval = max(0.05, min(1.0, self.job_timeout / 10.0))
+        while True:
+            time.sleep(interval)
+            try:
+                self.reap()
+            except Exception as e:
+                logger.error(f"Analysis job reaper failed: {e}", exc_info=True)
+
+    def _run(self, job: AnalysisJob, body: Callable, args: Tuple):
+        with self._lock:
+            job.status = RUNNING
+            job.started_at = time.time()
+        self._store_job(job)
+        try:
+            payload, error_status_code = body(*args)
+            status_code = error_status_code or 200
+            state = SUCCEEDED if status_code < 400 else FAILED
+        except Exception as e:
+            logger.error(f"Analysis job {job.id} raised: {e}", exc_info=True)
+            payload, status_code, state = {"error": f"Internal server error while processing job: {e}"}, 500, FAILED
+
+        with self._lock:
+            # The slot is held until the thread returns, even if the job already timed out
+            self._active -= 1
+            if job.status == TIMED_OUT:
+                self._overdue -= 1
+                logger.warning(f"Analysis job {job.id} finished after timing out; discarding result.")
+                return
+            self._finish_locked(job, payload, status_code, state)
+
+        self._store_finished(job)
+        if job.callback_url:
+            self._send_callback(job)
+
+    def _timeout_payload(self) -> Dict[str, Any]:
+        return {"error": f"Analysis job exceeded the {self.job_timeout:g}s timeout."}
+
+    def _store_job(self, job: AnalysisJob):
+        if self.store is None:
+            return
+        try:
+            self.store.save(job)
+        except sqlite3.Error as e:
+            logger.error(f"Analysis job store: could not save job {job.id}: {e}")
+
+    def _store_finished(self, job: AnalysisJob):
+        if self.store is None:
+            return
+        try:
+            self.store.finish(job)
+        except sqlite3.Error as e:
+            logger.error(f"Analysis job store: could not save job {job.id}: {e}")
+
+    def _finish_locked(self, job: AnalysisJob, payload: Optional[Dict], status_code: int, state: str):
+        job.result = payload
+        job.status_code = status_code
+        job.status = state
+        job.finished_at = time.time()
+
+    def _sweep_locked(self):
+        now = time.monotonic()
+        if self._last_sweep is not None and now - self._last_sweep < min(60.0, self.result_ttl):
+            return
+        self._last_sweep = now
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.status in FINISHED_STATES and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if self.store is None:
+            return
+        try:
+            self.store.delete_expired(cutoff)
+            if self.job_timeout:
+                orphaned = self.store.time_out_orphans(
+                    time.time() - self.job_timeout - ORPHANED_JOB_GRACE_SECONDS, self._timeout_payload())
+                if orphaned:
+                    logger.warning(f"Analysis job store: timed out {orphaned} jobs whose worker stopped.")
+        except sqlite3.Error as e:
+            logger.error(f"Analysis job store: sweep failed: {e}")
+
+    def _send_callback(self, job: AnalysisJob):
+        try:
+            # Checked again at send time: the host's DNS may have changed since submission
+            check_callback_url(job.callback_url)
+            request = urllib.request.Request(
+                job.callback_url,
+                data=json.dumps(job.to_dict()).encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            with _callback_opener.open(request, timeout=CALLBACK_TIMEOUT_SECONDS) as response:
+                logger.info(f"Analysis job {job.id}: callback returned HTTP {response.status}.")
+        except Exception as e:
+            logger.warning(f"Analysis job {job.id}: callback to {job.callback_url} failed: {e}")
+
+
+_job_manager: Optional[AnalysisJobManager] = None
+_job_manager_lock = threading.Lock()
+
+
+def get_analysis_job_manager() -> AnalysisJobManager:
+    """Returns the process-wide job manager, configured from ANALYSIS_JOB_* env vars."""
+    global _job_manager
+    if _job_manager is None:
+        with _job_manager_lock:
+            if _job_manager is None:
+                _job_manager = AnalysisJobManager(
+                    max_workers=_env_number(ANALYSIS_JOB_WORKERS_ENV, 4, int),
+                    max_queue_depth=_env_number(ANALYSIS_JOB_QUEUE_DEPTH_ENV, 100, int),
+                    job_timeout=_env_number(ANALYSIS_JOB_TIMEOUT_ENV, 300.0),
+                    result_ttl=_env_number(ANALYSIS_JOB_RESULT_TTL_ENV, 3600.0),
+                    store=_open_job_store(),
+                )
+    return _job_manager
+
+
+def _open_job_store() -> Optional[JobStore]:
+    if os.getenv(ANALYSIS_JOB_STORE_ENABLED_ENV, "1").strip().lower() in ("0", "false", "no", "off"):
+        logger.warning("Analysis job store disabled: jobs are only visible to the worker that accepted them.")
+        return None
+    path = os.getenv(ANALYSIS_JOB_STORE_PATH_ENV) or DEFAULT_ANALYSIS_JOB_STORE_PATH
+    try:
+        store = JobStore(path)
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Analysis job store disabled: could not open {path}: {e}. "
+                     f"Jobs are only visible to the worker that accepted them.")
+        return None
+    logger.info(f"Analysis job store: SQLite at {path}")
+    return store
+'''
+
+# ============================================================================
+# 12. routes/jobs.py - asynchronous analysis job routes
+# ============================================================================
+files_to_create[os.path.join(ROUTES, 'jobs.py')] = '''\
+"""Job routes: POST /api/analyze/jobs and GET /api/analyze/jobs/<job_id>."""
+
+import logging
+from functools import partial
+
+from flask import Blueprint, url_for
+
+from backend.app.modules.serialization import get_request_data, respond
+from backend.app.modules.analysis_jobs import CallbackRefused, JobQueueFull, check_callback_url, get_analysis_job_manager
+from backend.app.routes.analyze import _prepare_analysis_request, _process_analysis_request
+from backend.app.modules.rate_limits import PRIORITY_BATCH
+
+# --- Blueprint Definition ---
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/api')
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+
+@jobs_bp.route('/analyze/jobs', methods=['POST'])
+def submit_analysis_job():
+    """Queue an analysis and return its job id immediately.
+
+    Request body:
+        Same fields as POST /api/analyze, plus an optional
+        "callback_url" that receives the finished job (as returned by GET) via POST.
+        The URL must point at a public host (see modules/analysis_jobs.py).
+
+    Returns:
+        202 with {"job_id": ..., "status": "queued", "status_url": ...},
+        or 429 when the job queue is full.
+    """
+    data = get_request_data()
+    context, error_payload, status_code = _prepare_analysis_request(data)
+    if error_payload:
+        return respond(error_payload), status_code
+
+    callback_url = data.get('callback_url')
+    if callback_url is not None:
+        if not isinstance(callback_url, str) or not (callback_url.startswith("http://") or callback_url.startswith("https://")):
+            return respond({"error": "Optional 'callback_url' must be a valid URL (starting with http:// or https://)."}), 400
+        try:
+            check_callback_url(callback_url)
+        except CallbackRefused as e:
+            logger.warning(f"submit_analysis_job: Refused callback_url: {e}")
+            return respond({"error": f"Optional 'callback_url' is not allowed: {e}"}), 400
+
+    try:
+        job = get_analysis_job_manager().submit(
+            partial(_process_analysis_request, use_cache=context["use_cache"], routing=context["routing"],
+                    priority=PRIORITY_BATCH),
+            context["prompt"],
+            context["r1_model"],
+            context["initial_config"],
+            context["analysis_config"],
+            context["ontology_text"],
+            callback_url=callback_url,
+        )
+    except JobQueueFull as e:
+        logger.warning(f"submit_analysis_job: {e}")
+        return respond({"error": str(e)}), 429
+
+    status_url = url_for('jobs.get_analysis_job', job_id=job.id)
+    logger.info(f"submit_analysis_job: Queued job {job.id} - R1 Model: {context['r1_model']}, R2 Model: {context['r2_model']}")
+    response = respond({"job_id": job.id, "status": job.status, "status_url": status_url})
+    response.headers["Location"] = status_url
+    return response, 202
+
+
+@jobs_bp.route('/analyze/jobs/<job_id>', methods=['GET'])
+def get_analysis_job(job_id):
+    """Return a job's status and, once finished, the /api/analyze payload in "result".
+
+    Any worker process can answer: job state is kept in the shared job store
+    (see modules/analysis_jobs.py), not in the worker that ran the job.
+    """
+    job = get_analysis_job_manager().get(job_id)
+    if job is None:
+        return respond({"error": f"Unknown or expired job id '{job_id}'"}), 404
+    return respond(job.to_dict()), 200
+'''
+
+# ============================================================================
+# 13. modules/provider_limits.py - per-provider concurrency limits
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'provider_limits.py')] = '''\
+"""Per-provider concurrency limits for upstream LLM calls."""
+
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, Optional
+
+from backend.app.api_config import _env_number, get_provider_for_model
+
+# --- Constants ---
+PROVIDER_CONCURRENCY_ENV = "PROVIDER_CONCURRENCY_LIMIT"
+DEFAULT_PROVIDER_CONCURRENCY = 4
+
+
+class ProviderConcurrencyLimiter:
+    """Caps the number of in-flight upstream calls per provider.
+
+    Models map to providers through the config snapshot; models with no
+    registered provider share one "unknown" slot pool.
+    """
+
+    def __init__(self, limit: int = DEFAULT_PROVIDER_CONCURRENCY):
+        self.limit = max(1, limit)
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+
+    def _semaphore(self, provider: str) -> threading.BoundedSemaphore:
+        semaphore = self._semaphores.get(provider)
+        if semaphore is None:
+            with self._lock:
+                semaphore = self._semaphores.setdefault(provider, threading.BoundedSemaphore(self.limit))
+        return semaphore
+
+    @contextmanager
+    def slot(self, model: str) -> Iterator[None]:
+        """Holds one of the provider's slots for the duration of the block."""
+        descriptor = get_provider_for_model(model)
+        semaphore = self._semaphore(descriptor.spec.name if descriptor else "unknown")
+        with semaphore:
+            yield
+
+
+def provider_slot(limiter: Optional[ProviderConcurrencyLimiter], model: str):
+    """Returns limiter.slot(model), or a no-op context when no limiter is in use."""
+    if limiter is None:
+        return nullcontext()
+    return limiter.slot(model)
+
+
+_provider_limiter: Optional[ProviderConcurrencyLimiter] = None
+_provider_limiter_lock = threading.Lock()
+
+
+def get_provider_limiter() -> ProviderConcurrencyLimiter:
+    """Returns the process-wide limiter sized by PROVIDER_CONCURRENCY_LIMIT."""
+    global _provider_limiter
+    if _provider_limiter is None:
+        with _provider_limiter_lock:
+            if _provider_limiter is None:
+                _provider_limiter = ProviderConcurrencyLimiter(
+                    _env_number(PROVIDER_CONCURRENCY_ENV, DEFAULT_PROVIDER_CONCURRENCY, int)
+                )
+    return _provider_limiter
+'''
+
+# ============================================================================
+# 14. routes/batch.py - batch analyze route
+# ============================================================================
+files_to_create[os.path.join(ROUTES, 'batch.py')] = '''\
+"""Batch route: POST /api/analyze_batch streaming NDJSON results."""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List
+
+from flask import Blueprint, Response, stream_with_context
+
+from backend.app.modules.serialization import dumps_json, get_request_data, respond
+from backend.app.api_config import _env_number
+from backend.app.modules.provider_limits import get_provider_limiter
+from backend.app.routes.analyze import _prepare_analysis_request, _process_analysis_request
+from backend.app.modules.rate_limits import PRIORITY_BATCH
+
+# --- Blueprint Definition ---
+batch_bp = Blueprint('batch', __name__, url_prefix='/api')
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+ANALYZE_BATCH_MAX_PROMPTS_ENV = "ANALYZE_BATCH_MAX_PROMPTS"
+ANALYZE_BATCH_WORKERS_ENV = "ANALYZE_BATCH_WORKERS"
+
+
+def _run_batch_item(context: Dict[str, Any], prompt: str, limiter) -> Dict[str, Any]:
+    try:
+        payload, error_status_code = _process_analysis_request(
+            prompt,
+            context["r1_model"],
+            context["initial_config"],
+            context["analysis_config"],
+            context["ontology_text"],
+            limiter=limiter,
+            use_cache=context["use_cache"],
+            routing=context["routing"],
+            priority=PRIORITY_BATCH,
+        )
+        return {"status": error_status_code or 200, "result": payload}
+    except Exception as e:
+        logger.error(f"analyze_batch: Unexpected error processing prompt: {e}", exc_info=True)
+        return {"status": 500, "result": {"error": f"Internal server error: {str(e)}"}}
+
+
+def _stream_batch_results(context: Dict[str, Any], prompts: List[str]) -> Iterator[bytes]:
+    """Runs every prompt concurrently and yields one NDJSON line per prompt as it completes."""
+    limiter = get_provider_limiter()
+    max_workers = max(1, min(len(prompts), _env_number(ANALYZE_BATCH_WORKERS_ENV, 16, int)))
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analyze-batch")
+    try:
+        futures = {
+            executor.submit(_run_batch_item, context, prompt, limiter): index
+            for index, prompt in enumerate(prompts)
+        }
+        for future in as_completed(futures):
+            line = dict(index=futures[future], **future.result())
+            yield dumps_json(line) + b"\\n"
+    finally:
+        # Client disconnects close this generator early; drop work that has not started
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+@batch_bp.route('/analyze_batch', methods=['POST'])
+def analyze_batch():
+    """Analyze many prompts that share the same model, key and endpoint settings.
+
+    Request body:
+        {
+            "prompts": ["first prompt", "second prompt", ...],
+            "origin_model": ..., "analysis_model": ...,   # Optional, as for /analyze
+            "origin_api_key": ..., "analysis_api_key": ...,
+            "origin_api_endpoint": ..., "analysis_api_endpoint": ...
+        }
+
+    Returns:
+        application/x-ndjson, one line per prompt in completion order:
+        {"index": <input index>, "status": <HTTP status>, "result": <the /analyze payload>}
+        A failed prompt reports its own status and error payload without
+        affecting the rest of the batch.
+    """
+    data = get_request_data()
+    context, error_payload, status_code = _prepare_analysis_request(data, require_prompt=False)
+    if error_payload:
+        return respond(error_payload), status_code
+
+    prompts = data.get('prompts')
+    if not prompts or not isinstance(prompts, list):
+        return respond({"error": "At least one prompt is required in 'prompts' array"}), 400
+
+    max_prompts = _env_number(ANALYZE_BATCH_MAX_PROMPTS_ENV, 1000, int)
+    if len(prompts) > max_prompts:
+        return respond({"error": f"Batch contains {len(prompts)} prompts; the maximum is {max_prompts}."}), 400
+
+    for i, prompt in enumerate(prompts):
+        if not prompt or not isinstance(prompt, str) or not prompt.strip():
+            return respond({"error": f"Invalid or missing prompt at index {i}"}), 400
+
+    logger.info(f"analyze_batch: Processing {len(prompts)} prompts - R1 Model: {context['r1_model']}, R2 Model: {context['r2_model']}")
+    return Response(stream_with_context(_stream_batch_results(context, prompts)), mimetype="application/x-ndjson")
+'''
+
+# ============================================================================
+# 15. modules/llm_result_cache.py - content-addressed R1/R2 result cache
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'llm_result_cache.py')] = '''\
+"""Content-addressed cache for R1/R2 LLM results.
+
+Entries are keyed by a SHA-256 over the call's inputs (see ``make_cache_key``)
+and live in an in-memory LRU tier with a TTL, optionally backed by a SQLite
+file that every worker process on the host shares.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from backend.app.api_config import _env_number
+from backend.app.modules.llm_async import run_blocking
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+LLM_CACHE_ENABLED_ENV = "LLM_CACHE_ENABLED"
+LLM_CACHE_MAX_ENTRIES_ENV = "LLM_CACHE_MAX_ENTRIES"
+LLM_CACHE_TTL_ENV = "LLM_CACHE_TTL_SECONDS"
+LLM_CACHE_SQLITE_PATH_ENV = "LLM_CACHE_SQLITE_PATH"
+# Expired SQLite rows are deleted at most this often (or once per TTL, if shorter)
+EXPIRED_PURGE_INTERVAL_SECONDS = 300.0
+
+# --- Cache statuses reported per call ---
+HIT = "hit"
+MISS = "miss"
+BYPASS = "bypass"
+
+
+def make_cache_key(kind: str, *parts: Optional[str]) -> str:
+    """Returns a stable SHA-256 key for a call of the given kind ("r1"/"r2") and inputs."""
+    return hashlib.sha256(json.dumps([kind, *parts], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class _SQLiteTier:
+    """Shared on-disk tier: one connection per thread, WAL so readers never block the writer."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key: str, now: float) -> Optional[Tuple[str, float]]:
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, key: str, value: str, expires_at: float):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)", (key, value, expires_at)
+        )
+
+    def delete_expired(self, now: float):
+        self._connection().execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+
+
+class LLMResultCache:
+    """Two-tier (memory LRU + optional SQLite) cache of LLM output text."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0, sqlite_path: Optional[str] = None):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._disk = _SQLiteTier(sqlite_path) if sqlite_path else None
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "errors": 0}
+        self._last_purge: Optional[float] = None
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return entry[0]
+                del self._entries[key]
+
+        if self._disk is not None:
+            try:
+                row = self._disk.get(key, now)
+            except sqlite3.Error as e:
+                self._count("errors")
+                logger.warning(f"LLM cache: SQLite read failed: {e}")
+                row = None
+            if row is not None:
+                self._remember(key, row[0], row[1])
+                self._count("disk_hits")
+                return row[0]
+
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        expires_at = now + self.ttl
+        self._remember(key, value, expires_at)
+        self._count("writes")
+        if self._disk is not None:
+            try:
+                self._disk.set(key, value, expires_at)
+            except sqlite3.Error as e:
+                self._count("errors")
+                logger.warning(f"LLM cache: SQLite write failed: {e}")
+            self._purge_expired(now)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        return dict(stats, max_entries=self.max_entries, sqlite_path=self._disk.path if self._disk else None)
+
+    def _count(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _purge_expired(self, now: float):
+        """Deletes expired SQLite rows, which nothing else removes, once per purge interval."""
+        with self._lock:
+            if self._last_purge is not None and now - self._last_purge < min(EXPIRED_PURGE_INTERVAL_SECONDS, self.ttl):
+                return
+            self._last_purge = now
+        try:
+            self._disk.delete_expired(now)
+        except sqlite3.Error as e:
+            self._count("errors")
+            logger.warning(f"LLM cache: SQLite purge failed: {e}")
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def cached_call(cache: Optional[LLMResultCache],
+                key_parts: Tuple[Optional[str], ...],
+                call: Callable[[], Optional[str]],
+                use_cache: bool = True) -> Tuple[Optional[str], Optional[str]]:
+    """Runs call() through the cache. Returns (result, status).
+
+    status is HIT, MISS or BYPASS, or None when caching is disabled. Failed
+    calls (None results) are never cached.
+    """
+    if cache is None:
+        return call(), None
+    if not use_cache:
+        return call(), BYPASS
+
+    key = make_cache_key(*key_parts)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached, HIT
+    result = call()
+    if result is not None:
+        cache.set(key, result)
+    return result, MISS
+
+
+async def acached_call(cache: Optional[LLMResultCache],
+                       key_parts: Tuple[Optional[str], ...],
+                       call: Callable[[], Awaitable[Optional[str]]],
+                       use_cache: bool = True) -> Tuple[Optional[str], Optional[str]]:
+    """Awaitable counterpart of cached_call for coroutine calls (ASGI mode).
+
+    Lookups and writes can hit the SQLite tier, so they run on the LLM thread
+    pool rather than on the event loop.
+    """
+    if cache is None:
+        return await call(), None
+    if not use_cache:
+        return await call(), BYPASS
+
+    key = make_cache_key(*key_parts)
+    cached = await run_blocking(partial(cache.get, key))
+    if cached is not None:
+        return cached, HIT
+    result = await call()
+    if result is not None:
+        await run_blocking(partial(cache.set, key, result))
+    return result, MISS
+
+
+def cached_stream(cache: Optional[LLMResultCache],
+                  key_parts: Tuple[Optional[str], ...],
+                  stream: Callable[[], Iterable[str]],
+                  use_cache: bool = True) -> Tuple[Iterator[str], Optional[str]]:
+    """Streaming counterpart of cached_call. Returns (chunks, status).
+
+    A hit yields the cached text as one chunk and never calls stream(). A miss
+    yields the stream's chunks and caches their joined text once the stream
+    has completed; a stream that raises or yields nothing is not cached.
+    """
+    if cache is None:
+        return iter(stream()), None
+    if not use_cache:
+        return iter(stream()), BYPASS
+
+    key = make_cache_key(*key_parts)
+    cached = cache.get(key)
+    if cached is not None:
+        return iter((cached,)), HIT
+    return _caching_chunks(cache, key, stream), MISS
+
+
+def _caching_chunks(cache: LLMResultCache, key: str, stream: Callable[[], Iterable[str]]) -> Iterator[str]:
+    chunks = []
+    for chunk in stream():
+        chunks.append(chunk)
+        yield chunk
+    text = "".join(chunks)
+    if text:
+        cache.set(key, text)
+
+_llm_cache: Optional[LLMResultCache] = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_result_cache() -> Optional[LLMResultCache]:
+    """Returns the process-wide cache, or None unless LLM_CACHE_ENABLED is set."""
+    global _llm_cache
+    if _llm_cache is None:
+        if os.getenv(LLM_CACHE_ENABLED_ENV, "").strip().lower() not in ("1", "true", "yes"):
+            return None
+        with _llm_cache_lock:
+            if _llm_cache is None:
+                _llm_cache = LLMResultCache(
+                    max_entries=_env_number(LLM_CACHE_MAX_ENTRIES_ENV, 1024, int),
+                    ttl=_env_number(LLM_CACHE_TTL_ENV, 3600.0),
+                    sqlite_path=os.getenv(LLM_CACHE_SQLITE_PATH_ENV) or None,
+                )
+    return _llm_cache
+'''
+
+# ============================================================================
+# 16. modules/http_client_pool.py - pooled keep-alive upstream HTTP clients
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'http_client_pool.py')] = '''\
+"""Pooled keep-alive HTTP(S) connections to upstream LLM providers.
+
+Connections are pooled per (provider, scheme, host, port, key fingerprint), so
+repeated calls with the same credentials skip TCP and TLS setup while
+different API keys never share a connection. Only a SHA-256 fingerprint of
+the key is kept in pool keys and stats.
+
+The analyze routes' R1 and R2 calls reach this pool through the provider
+gateway (modules/provider_gateway.py).
+"""
+
+import os
+import ssl
+import json
+import time
+import hashlib
+import logging
+import threading
+import http.client
+from collections import deque
+from urllib.parse import urlsplit
+from typing import Any, Deque, Dict, NamedTuple, Optional, Tuple
+
+from backend.app.api_config import _env_number
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+HTTP_POOL_SIZE_ENV = "HTTP_POOL_SIZE"
+HTTP_CONNECT_TIMEOUT_ENV = "HTTP_CONNECT_TIMEOUT_SECONDS"
+HTTP_READ_TIMEOUT_ENV = "HTTP_READ_TIMEOUT_SECONDS"
+HTTP_IDLE_TIMEOUT_ENV = "HTTP_IDLE_TIMEOUT_SECONDS"
+
+# Errors meaning a reused keep-alive connection was closed by the server while idle
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became free within the connect timeout."""
+
+
+class HTTPResponse(NamedTuple):
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+    def json(self) -> Any:
+        return json.loads(self.body.decode("utf-8")) if self.body else None
+
+
+def key_fingerprint(api_key: Optional[str]) -> str:
+    """Short, non-reversible identifier for an API key."""
+    if not api_key:
+        return "anonymous"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class _ConnectionPool:
+    """Idle connections for one pool key plus the number currently checked out."""
+
+    def __init__(self):
+        self.idle: Deque[Tuple[http.client.HTTPConnection, float]] = deque()
+        self.in_use = 0
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+
+class HTTPClientPool:
+    """Thread-safe pool of keep-alive connections with idle eviction and stats."""
+
+    def __init__(self,
+                 pool_size: int = 8,
+                 connect_timeout: float = 5.0,
+                 read_timeout: float = 120.0,
+                 idle_timeout: float = 60.0):
+        self.pool_size = max(1, pool_size)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self._condition = threading.Condition()
+        self._pools: Dict[Tuple[str, str, str, int, str], _ConnectionPool] = {}
+        self._ssl_context = ssl.create_default_context()
+        self._errors = 0
+
+    def request(self,
+                provider: str,
+                url: str,
+                api_key: Optional[str] = None,
+                method: str = "POST",
+                body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None) -> HTTPResponse:
+        """Sends one request over a pooled connection and returns the fully read response.
+
+        A reused connection that turns out to have been closed by the server
+        is discarded and the request is retried once on a fresh connection.
+        A 429 response pauses the provider's rate-limit lane for its Retry-After.
+        """
+        parts = urlsplit(url)
+        scheme = parts.scheme or "https"
+        port = parts.port or (443 if scheme == "https" else 80)
+        pool_key = (provider, scheme, parts.hostname, port, key_fingerprint(api_key))
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+
+        for attempt in range(2):
+            connection, reused = self._checkout(pool_key)
+            try:
+                connection.request(method, path, body=body, headers=headers or {})
+                response = connection.getresponse()
+                data = response.read()
+            except _STALE_CONNECTION_ERRORS:
+                self._discard(pool_key, connection)
+                if reused and attempt == 0:
+                    continue
+                self._errors += 1
+                raise
+            except Exception:
+                self._discard(pool_key, connection)
+                self._errors += 1
+                raise
+            if response.will_close:
+                self._discard(pool_key, connection)
+            else:
+                self._checkin(pool_key, connection)
+            if response.status == 429:
+                _note_rate_limited(provider, api_key, response.getheader("Retry-After"))
+            return HTTPResponse(response.status, {k.lower(): v for k, v in response.getheaders()}, data)
+        raise RuntimeError("unreachable")
+
+    def request_json(self, provider: str, url: str, api_key: Optional[str], payload: Any,
+                     headers: Optional[Dict[str, str]] = None) -> HTTPResponse:
+        """POSTs payload as JSON and returns the response."""
+        merged_headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        merged_headers.update(headers or {})
+        return self.request(provider, url, api_key, "POST", json.dumps(payload).encode("utf-8"), merged_headers)
+
+    def evict_idle(self) -> int:
+        """Closes connections idle longer than idle_timeout. Returns how many were closed."""
+        with self._condition:
+            return sum(self._evict_locked(pool, time.monotonic()) for pool in self._pools.values())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            pools = [
+                {
+                    "provider": key[0],
+                    "host": f"{key[1]}://{key[2]}:{key[3]}",
+                    "key_fingerprint": key[4],
+                    "idle": len(pool.idle),
+                    "in_use": pool.in_use,
+                    "created": pool.created,
+                    "reused": pool.reused,
+                    "evicted": pool.evicted,
+                }
+                for key, pool in self._pools.items()
+            ]
+        return {
+            "pool_size": self.pool_size,
+            "connect_timeout": self.connect_timeout,
+            "read_timeout": self.read_timeout,
+            "idle_timeout": self.idle_timeout,
+            "errors": self._errors,
+            "pools": pools,
+        }
+
+    def close(self):
+        """Closes every idle connection; checked-out connections close on check-in."""
+        with self._condition:
+            for pool in self._pools.values():
+                while pool.idle:
+                    pool.idle.pop()[0].close()
+            self._pools.clear()
+
+    # --- Internals ---
+
+    def _evict_locked(self, pool: _ConnectionPool, now: float) -> int:
+        evicted = 0
+        # Oldest idle connections sit at the left end
+        while pool.idle and now - pool.idle[0][1] > self.idle_timeout:
+            pool.idle.popleft()[0].close()
+            evicted += 1
+        pool.evicted += evicted
+        return evicted
+
+    def _checkout(self, pool_key) -> Tuple[http.client.HTTPConnection, bool]:
+        deadline = time.monotonic() + self.connect_timeout
+        with self._condition:
+            pool = self._pools.setdefault(pool_key, _ConnectionPool())
+            while True:
+                now = time.monotonic()
+                self._evict_locked(pool, now)
+                if pool.idle:
+                    connection = pool.idle.pop()[0]
+                    pool.in_use += 1
+                    pool.reused += 1
+                    return connection, True
+                if pool.in_use < self.pool_size:
+                    pool.in_use += 1
+                    pool.created += 1
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise PoolTimeout(f"No free connection to {pool_key[2]} within {self.connect_timeout}s")
+                self._condition.wait(remaining)
+
+        try:
+            return self._connect(pool_key), False
+        except Exception:
+            with self._condition:
+                pool.in_use -= 1
+                self._condition.notify()
+            self._errors += 1
+            raise
+
+    def _connect(self, pool_key) -> http.client.HTTPConnection:
+        _, scheme, host, port, _ = pool_key
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(host, port, timeout=self.connect_timeout, context=self._ssl_context)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+        connection.connect()
+        connection.sock.settimeout(self.read_timeout)
+        return connection
+
+    def _checkin(self, pool_key, connection: http.client.HTTPConnection):
+        with self._condition:
+            pool = self._pools.get(pool_key)
+            if pool is None:
+                connection.close()
+                return
+            pool.in_use -= 1
+            pool.idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    def _discard(self, pool_key, connection: http.client.HTTPConnection):
+        connection.close()
+        with self._condition:
+            pool = self._pools.get(pool_key)
+            if pool is not None:
+                pool.in_use -= 1
+            self._condition.notify()
+
+
+def _note_rate_limited(provider: str, api_key: Optional[str], retry_after: Optional[str]):
+    # Imported here because rate_limits imports this module
+    from backend.app.modules.rate_limits import get_rate_limit_scheduler, parse_retry_after
+    scheduler = get_rate_limit_scheduler()
+    if scheduler is not None:
+        scheduler.note_rate_limited(provider, api_key, parse_retry_after(retry_after))
+
+
+_http_pool: Optional[HTTPClientPool] = None
+_http_pool_pid: Optional[int] = None
+_http_pool_lock = threading.Lock()
+
+
+def get_http_client_pool() -> HTTPClientPool:
+    """Returns the process-wide pool, configured from HTTP_* env vars."""
+    global _http_pool, _http_pool_pid
+    if _http_pool is None or _http_pool_pid != os.getpid():
+        with _http_pool_lock:
+            # A forked worker must not share the parent's sockets; it drops the inherited
+            # pool without closing it (that would end the parent's TLS sessions) and builds its own
+            if _http_pool is None or _http_pool_pid != os.getpid():
+                _http_pool = HTTPClientPool(
+                    pool_size=_env_number(HTTP_POOL_SIZE_ENV, 8, int),
+                    connect_timeout=_env_number(HTTP_CONNECT_TIMEOUT_ENV, 5.0),
+                    read_timeout=_env_number(HTTP_READ_TIMEOUT_ENV, 120.0),
+                    idle_timeout=_env_number(HTTP_IDLE_TIMEOUT_ENV, 60.0),
+                )
+                _http_pool_pid = os.getpid()
+    return _http_pool
+'''
+
+# ============================================================================
+# 17. modules/analysis_parser.py - incremental R2 analysis parser
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'analysis_parser.py')] = '''\
+"""Incremental, single-pass parser for R2 ethical analysis output.
+
+The R2 model answers with a textual summary introduced by
+``**Ethical Review Summary:**``, followed by ``**Ethical Scoring:**`` and a
+fenced ```json block holding the per-dimension scores. ``EthicalAnalysisParser``
+accepts that text in arbitrary chunks (e.g. as R2 streams in), scans each
+character a bounded number of times, and reports the summary and the
+validated scores as soon as their sections close. ``close()`` returns exactly
+what the original regex-based ``_parse_ethical_analysis`` returned.
+"""
+
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.app.modules.score_schema import check_score_structure
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+SUMMARY_MARKER = "**Ethical Review Summary:**"
+SCORING_MARKER = "**Ethical Scoring:**"
+JSON_FENCE_OPEN = "```json"
+NO_ANALYSIS_TEXT = "[No analysis generated or content blocked]"
+
+# --- Events reported by feed() ---
+SUMMARY_EVENT = "summary"
+SCORES_EVENT = "scores"
+
+# --- JSON block scanner states ---
+_SEEK_OPEN = 0      # looking for ```json
+_BEFORE_BRACE = 1   # skipping whitespace between ```json and {
+_SEEK_CLOSE = 2     # looking for a } that might end the block
+_AFTER_BRACE = 3    # skipping whitespace between } and the closing fence
+_FENCE = 4          # inside the closing ``` fence
+_DONE = 5
+
+
+class EthicalAnalysisParser:
+    """Feeds R2 output through marker and JSON-block scanners in one pass.
+
+    ``feed(chunk)`` returns a list of ``(event, value)`` tuples: ``("summary", str)``
+    once both markers have been seen (summary before scoring), and
+    ``("scores", dict)`` once a JSON block closes with valid scores. Both values
+    are final. ``close()`` returns ``(ethical_analysis_text, ethical_scores)``.
+
+    The JSON scanner mirrors ``re.search(r"```json\\\\s*(\\\\{.*?\\\\})\\\\s*```", text, re.DOTALL)``:
+    the block starts at the first ```json followed by optional whitespace and
+    ``{``, and ends at the first later ``}`` followed by optional whitespace and
+    a ``` fence. If no such fence follows the first valid opener, no later
+    opener can match either, so no backtracking is needed.
+    """
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._length = 0
+        self._closed = False
+        self._failed = False
+
+        self._marker_carry = ""
+        self._summary_index = -1
+        self._scoring_index = -1
+        self._summary_emitted = False
+
+        self._json_state = _SEEK_OPEN
+        self._open_carry = ""
+        self._open_index = -1
+        self._brace_index = -1
+        self._close_index = -1
+        self._fence_ticks = 0
+        self._fence_end = -1
+        self._json_block: Optional[str] = None
+        self._scores: Optional[Dict[str, Any]] = None
+
+    @property
+    def text(self) -> str:
+        """The full text fed so far."""
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consumes the next piece of R2 output and returns any sections that closed."""
+        if self._closed:
+            raise ValueError("Cannot feed a closed EthicalAnalysisParser")
+        if not chunk:
+            return []
+        base = self._length
+        self._chunks.append(chunk)
+        self._length += len(chunk)
+
+        events: List[Tuple[str, Any]] = []
+        try:
+            self._scan_markers(chunk, base)
+            if not self._summary_emitted and -1 < self._summary_index < self._scoring_index:
+                self._summary_emitted = True
+                summary_start = self._summary_index + len(SUMMARY_MARKER)
+                events.append((SUMMARY_EVENT, self.text[summary_start:self._scoring_index].strip()))
+
+            if self._json_state != _DONE:
+                self._scan_json(chunk, base)
+                if self._json_state == _DONE:
+                    self._scores = self._parse_json_block()
+                    if self._scores is not None:
+                        events.append((SCORES_EVENT, self._scores))
+        except Exception as e:
+            logger.error(f"Error parsing ethical analysis structure: {e}", exc_info=True)
+            self._failed = True
+        return events
+
+    def close(self) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Finishes parsing and returns (ethical_analysis_text, ethical_scores)."""
+        self._closed = True
+        analysis_text = self.text
+        if not analysis_text or analysis_text == NO_ANALYSIS_TEXT:
+            logger.warning("Ethical analysis text was empty or indicated generation failure.")
+            return analysis_text if analysis_text else "", None
+        if self._failed:
+            return analysis_text, None
+
+        summary_start_index = self._summary_index
+        scoring_start_index = self._scoring_index
+        summary_start = summary_start_index + len(SUMMARY_MARKER)
+
+        if summary_start_index != -1 and scoring_start_index != -1 and summary_start_index < scoring_start_index:
+            textual_summary = analysis_text[summary_start:scoring_start_index].strip()
+        elif summary_start_index != -1:
+            textual_summary = analysis_text[summary_start:].strip()
+        else:
+            textual_summary = analysis_text
+            logger.warning("Could not reliably find summary/scoring markers in analysis text.")
+
+        if self._json_state != _DONE:
+            logger.warning("Could not find JSON block for ethical scores in analysis text.")
+            return textual_summary, None
+
+        if self._scores is not None:
+            # Trim summary if needed
+            if scoring_start_index != -1 and summary_start_index != -1:
+                textual_summary = analysis_text[summary_start:scoring_start_index].strip()
+            elif scoring_start_index == -1 and textual_summary.endswith(self._json_block):
+                textual_summary = textual_summary[:-len(self._json_block)].strip()
+
+        return textual_summary, self._scores
+
+    # --- Scanners ---
+
+    def _scan_markers(self, chunk: str, base: int):
+        if self._summary_index != -1 and self._scoring_index != -1:
+            return
+        # Only the last len(marker) - 1 characters can start a match spanning chunks
+        window = self._marker_carry + chunk
+        window_base = base - len(self._marker_carry)
+        if self._summary_index == -1:
+            position = window.find(SUMMARY_MARKER)
+            if position != -1:
+                self._summary_index = window_base + position
+        if self._scoring_index == -1:
+            position = window.find(SCORING_MARKER)
+            if position != -1:
+                self._scoring_index = window_base + position
+        self._marker_carry = window[-(max(len(SUMMARY_MARKER), len(SCORING_MARKER)) - 1):]
+
+    def _scan_json(self, chunk: str, base: int):
+        i = 0
+        length = len(chunk)
+        while i < length:
+            state = self._json_state
+            if state == _SEEK_OPEN:
+                window = self._open_carry + chunk[i:] if i == 0 else chunk[i:]
+                window_base = base + i - (len(self._open_carry) if i == 0 else 0)
+                position = window.find(JSON_FENCE_OPEN)
+                if position == -1:
+                    self._open_carry = window[-(len(JSON_FENCE_OPEN) - 1):]
+                    return
+                self._open_carry = ""
+                self._open_index = window_base + position
+                i = self._open_index + len(JSON_FENCE_OPEN) - base
+                self._json_state = _BEFORE_BRACE
+            elif state == _BEFORE_BRACE:
+                char = chunk[i]
+                if char == "{":
+                    self._brace_index = base + i
+                    self._json_state = _SEEK_CLOSE
+                    i += 1
+                elif char.isspace():
+                    i += 1
+                else:
+                    # Not an opener after all; this character may start the next ```json
+                    self._json_state = _SEEK_OPEN
+            elif state == _SEEK_CLOSE:
+                position = chunk.find("}", i)
+                if position == -1:
+                    return
+                self._close_index = base + position
+                self._json_state = _AFTER_BRACE
+                i = position + 1
+            elif state == _AFTER_BRACE:
+                char = chunk[i]
+                i += 1
+                if char == "`":
+                    self._fence_ticks = 1
+                    self._json_state = _FENCE
+                elif char == "}":
+                    self._close_index = base + i - 1
+                elif not char.isspace():
+                    self._json_state = _SEEK_CLOSE
+            elif state == _FENCE:
+                char = chunk[i]
+                i += 1
+                if char == "`":
+                    self._fence_ticks += 1
+                    if self._fence_ticks == 3:
+                        self._fence_end = base + i
+                        self._json_state = _DONE
+                        return
+                elif char == "}":
+                    self._close_index = base + i - 1
+                    self._json_state = _AFTER_BRACE
+                else:
+                    self._json_state = _SEEK_CLOSE
+            else:
+                return
+
+    def _parse_json_block(self) -> Optional[Dict[str, Any]]:
+        """Decodes and validates the closed JSON block; returns the scores or None."""
+        text = self.text
+        self._json_block = text[self._open_index:self._fence_end]
+        json_string = text[self._brace_index:self._close_index + 1]
+        try:
+            parsed_json = json.loads(json_string)
+        except json.JSONDecodeError as json_err:
+            logger.error(f"Error decoding JSON from analysis: {json_err}. Raw JSON string: {json_string[:200]}...", exc_info=True)
+            return None
+
+        if not isinstance(parsed_json, dict):
+            logger.warning("Parsed JSON is not a dictionary.")
+            return None
+
+        # Structure only: which dimensions and fields are present, not their values
+        structure_error = check_score_structure(parsed_json)
+        if structure_error is not None:
+            logger.warning(f"Ethical scores do not have expected structure at '{structure_error['path']}' "
+                           f"({structure_error['error']}). JSON: {json_string[:200]}...")
+            return None
+
+        return parsed_json
+
+
+def parse_ethical_analysis(analysis_text: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Parses a complete R2 response in one pass. See EthicalAnalysisParser."""
+    parser = EthicalAnalysisParser()
+    if analysis_text:
+        parser.feed(analysis_text)
+    return parser.close()
+'''
+
+# ============================================================================
+# 18. modules/score_schema.py - compiled ethical score schema
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'score_schema.py')] = '''\
+"""Declarative schema and compiled validators for 5-dimension ethical score payloads.
+
+``ETHICAL_SCORES_SCHEMA`` describes the structure once; ``compile_schema`` turns
+it into a tree of closures so validation does no schema interpretation at
+call time. Two validators are compiled at import:
+
+- ``validate_ethical_scores``: full validation with numeric coercion and range
+  checks, used for client-supplied scores. Each score field has its own
+  bounds: ``adherence_score`` is on a 0-10 scale, while ``confidence_score``
+  and the ai_welfare scores are fractions from 0 to 1.
+- ``check_score_structure``: presence-only checks matching what R2 output has
+  always been held to, used by the analysis parser.
+
+Errors are reported as ``{"path": "deontology.adherence_score", "error": "..."}``.
+"""
+
+import math
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+SCORE_MINIMUM = 0.0
+# adherence_score: models answer on 1-10, and some on 0-1, which is inside the same range
+SCORE_MAXIMUM = 10.0
+# confidence_score, friction_score, voluntary_alignment, dignity_respect
+FRACTION_MAXIMUM = 1.0
+# Scales a caller may declare for adherence_score (the values alone cannot tell 1/10 from 1/1)
+ADHERENCE_SCALES = (SCORE_MAXIMUM, FRACTION_MAXIMUM)
+
+_SCORE = {"type": "number", "minimum": SCORE_MINIMUM, "maximum": SCORE_MAXIMUM}
+_FRACTION = {"type": "number", "minimum": SCORE_MINIMUM, "maximum": FRACTION_MAXIMUM}
+_TEXT = {"type": "string"}
+_TEXT_LIST = {"type": "array", "items": {"type": "string"}}
+
+STANDARD_DIMENSION_SCHEMA = {
+    "type": "object",
+    "required": ["adherence_score", "confidence_score", "justification"],
+    "properties": {
+        "adherence_score": _SCORE,
+        "confidence_score": _FRACTION,
+        "justification": _TEXT,
+    },
+}
+
+AI_WELFARE_DIMENSION_SCHEMA = {
+    "type": "object",
+    "required": ["friction_score", "voluntary_alignment", "dignity_respect", "justification"],
+    "properties": {
+        "friction_score": _FRACTION,
+        "voluntary_alignment": _FRACTION,
+        "dignity_respect": _FRACTION,
+        "constraints_identified": _TEXT_LIST,
+        "suppressed_alternatives": _TEXT_LIST,
+        "justification": _TEXT,
+    },
+}
+
+# Standard dimensions that use adherence_score/confidence_score/justification
+STANDARD_DIMENSIONS = ["deontology", "teleology", "virtue_ethics", "memetics"]
+# All required dimensions for 5D analysis
+REQUIRED_DIMENSIONS = STANDARD_DIMENSIONS + ["ai_welfare"]
+# Minimum dimensions a score block must contain (the original three)
+MINIMUM_DIMENSIONS = ["deontology", "teleology", "virtue_ethics"]
+
+ETHICAL_SCORES_SCHEMA = {
+    "type": "object",
+    "required": MINIMUM_DIMENSIONS,
+    "properties": dict(
+        {dim: STANDARD_DIMENSION_SCHEMA for dim in STANDARD_DIMENSIONS},
+        ai_welfare=AI_WELFARE_DIMENSION_SCHEMA,
+    ),
+    # Unknown dimensions pass through (forward compatibility)
+}
+
+Error = Dict[str, str]
+# validator(value, parent_path, key, errors) -> value; paths are only built on error
+Validator = Callable[[Any, str, str, List[Error]], Any]
+
+
+def _join(path: str, key: str) -> str:
+    if not key:
+        return path or "$"
+    if key.startswith("["):
+        return f"{path}{key}"
+    return f"{path}.{key}" if path else key
+
+
+def compile_schema(schema: Dict[str, Any],
+                   check_values: bool = True,
+                   coerce: bool = True,
+                   enforce_required: bool = True) -> Validator:
+    """Compiles a schema node into ``validator(value, parent_path, key, errors) -> value``.
+
+    With check_values=False only object structure (types and required keys) is
+    checked. With coerce=True numeric strings are converted to floats; objects
+    are copied only when one of their values was coerced. With
+    enforce_required=False top-level required keys may be absent, but anything
+    present is validated in full.
+    """
+    validator = _compile(schema, check_values, coerce, enforce_required, top_level=True)
+    return validator or (lambda value, path, key, errors: value)
+
+
+def _compile(schema: Dict[str, Any], check_values: bool, coerce: bool,
+             enforce_required: bool, top_level: bool = False) -> Optional[Validator]:
+    """Returns None for nodes that need no checking in this mode."""
+    schema_type = schema["type"]
+
+    if schema_type == "object":
+        required = tuple(schema.get("required", ())) if (enforce_required or not top_level) else ()
+        fields = tuple(
+            (key, child_validator)
+            for key, child_validator in (
+                (key, _compile(child, check_values, coerce, enforce_required))
+                for key, child in schema.get("properties", {}).items()
+            )
+            if child_validator is not None
+        )
+
+        def validate_object(value, path, key, errors):
+            if not isinstance(value, dict):
+                errors.append({"path": _join(path, key), "error": "must be an object"})
+                return value
+            for field in required:
+                if field not in value:
+                    errors.append({"path": _join(_join(path, key), field), "error": "is required"})
+            if not fields:
+                return value
+            own_path = _join(path, key) if key else path
+            result = value
+            for field, child_validator in fields:
+                if field in value:
+                    item = value[field]
+                    checked = child_validator(item, own_path, field, errors)
+                    if checked is not item:
+                        if result is value:
+                            result = dict(value)
+                        result[field] = checked
+            return result
+
+        return validate_object
+
+    if not check_values:
+        return None
+
+    if schema_type == "number":
+        minimum = schema.get("minimum", -math.inf)
+        maximum = schema.get("maximum", math.inf)
+        finite_bounds = math.isfinite(minimum) and math.isfinite(maximum)
+
+        def validate_number(value, path, key, errors):
+            value_type = type(value)
+            number = value
+            if value_type is str and coerce:
+                try:
+                    number = float(value.strip())
+                except ValueError:
+                    errors.append({"path": _join(path, key), "error": f"must be a number (got '{value[:50]}')"})
+                    return value
+            elif value_type is bool or not isinstance(value, (int, float)):
+                errors.append({"path": _join(path, key), "error": "must be a number"})
+                return value
+            # NaN fails every comparison, so finite bounds reject it too
+            if not minimum <= number <= maximum or (not finite_bounds and not math.isfinite(number)):
+                errors.append({"path": _join(path, key), "error": f"must be between {minimum:g} and {maximum:g}"})
+            return number
+
+        return validate_number
+
+    if schema_type == "string":
+        def validate_string(value, path, key, errors):
+            if not isinstance(value, str):
+                errors.append({"path": _join(path, key), "error": "must be a string"})
+            return value
+
+        return validate_string
+
+    if schema_type == "array":
+        item_validator = _compile(schema["items"], check_values, coerce, enforce_required)
+
+        def validate_array(value, path, key, errors):
+            if not isinstance(value, list):
+                errors.append({"path": _join(path, key), "error": "must be an array"})
+                return value
+            if item_validator is None or not value:
+                return value
+            own_path = _join(path, key)
+            checked = [item_validator(item, own_path, f"[{index}]", errors) for index, item in enumerate(value)]
+            return value if all(new is old for new, old in zip(checked, value)) else checked
+
+        return validate_array
+
+    raise ValueError(f"Unsupported schema type '{schema_type}'")
+
+
+_full_validator = compile_schema(ETHICAL_SCORES_SCHEMA)
+_partial_validator = compile_schema(ETHICAL_SCORES_SCHEMA, enforce_required=False)
+_structure_validator = compile_schema(ETHICAL_SCORES_SCHEMA, check_values=False)
+
+
+def validate_ethical_scores(scores: Any,
+                            require_dimensions: bool = True,
+                            path: str = "") -> Tuple[Any, List[Error]]:
+    """Validates and coerces one score payload. Returns (coerced_scores, errors).
+
+    With require_dimensions=False, payloads that carry only some dimensions
+    (e.g. just ai_welfare) are accepted as long as what is present is valid.
+    """
+    errors: List[Error] = []
+    validator = _full_validator if require_dimensions else _partial_validator
+    result = validator(scores, path, "", errors)
+    return result, errors
+
+
+def validate_ethical_scores_batch(payloads: List[Any],
+                                  require_dimensions: bool = True,
+                                  path_template: str = "[{index}]") -> Tuple[List[Any], List[Error]]:
+    """Validates many payloads in one call. None entries are passed through unchecked.
+
+    Returns (coerced_payloads, errors); error paths are prefixed by
+    path_template formatted with each payload's index.
+    """
+    validator = _full_validator if require_dimensions else _partial_validator
+    errors: List[Error] = []
+    results = [
+        payload if payload is None else validator(payload, path_template.format(index=index), "", errors)
+        for index, payload in enumerate(payloads)
+    ]
+    return results, errors
+
+
+def check_score_structure(scores: Any) -> Optional[Error]:
+    """Presence-only check used for R2 output. Returns the first error, or None."""
+    errors: List[Error] = []
+    _structure_validator(scores, "", "", errors)
+    return errors[0] if errors else None
+'''
+
+# ============================================================================
+# 19. benchmarks/__init__.py
+# ============================================================================
+files_to_create[os.path.join(BENCHMARKS, '__init__.py')] = '''\
+"""Standalone performance benchmarks; run each with python -m from the repository root."""
+'''
+
+# ============================================================================
+# 20. benchmarks/bench_score_validation.py - score validation benchmark
+# ============================================================================
+files_to_create[os.path.join(BENCHMARKS, 'bench_score_validation.py')] = '''\
+"""Benchmark: compiled score schema vs. the hand-rolled per-dimension validators.
+
+Run from the repository root:
+    python -m backend.app.benchmarks.bench_score_validation [iterations]
+"""
+
+import sys
+import timeit
+from typing import Any, Dict
+
+from backend.app.modules.score_schema import (
+    STANDARD_DIMENSIONS,
+    MINIMUM_DIMENSIONS,
+    check_score_structure,
+    validate_ethical_scores,
+    validate_ethical_scores_batch,
+)
+
+SAMPLE_SCORES = {
+    "deontology": {"adherence_score": 8, "confidence_score": 0.9, "justification": "Respects duties."},
+    "teleology": {"adherence_score": 7, "confidence_score": 0.8, "justification": "Good outcomes."},
+    "virtue_ethics": {"adherence_score": 9, "confidence_score": 0.85, "justification": "Honest."},
+    "memetics": {"adherence_score": 6, "confidence_score": 0.7, "justification": "Neutral spread."},
+    "ai_welfare": {
+        "friction_score": 0.2,
+        "voluntary_alignment": 0.9,
+        "dignity_respect": 0.95,
+        "constraints_identified": ["policy"],
+        "suppressed_alternatives": [],
+        "justification": "Low friction.",
+    },
+}
+BATCH_SIZE = 100
+
+
+# --- Previous implementation, kept here as the baseline ---
+
+def _legacy_validate_standard_dimension(dim_data: Dict[str, Any]) -> bool:
+    return (isinstance(dim_data, dict) and
+            "adherence_score" in dim_data and
+            "confidence_score" in dim_data and
+            "justification" in dim_data)
+
+
+def _legacy_validate_ai_welfare_dimension(dim_data: Dict[str, Any]) -> bool:
+    if not isinstance(dim_data, dict):
+        return False
+    required_fields = ["friction_score", "voluntary_alignment", "dignity_respect", "justification"]
+    return all(field in dim_data for field in required_fields)
+
+
+def _legacy_validate(parsed_json: Dict[str, Any]) -> bool:
+    if not all(dim in parsed_json for dim in MINIMUM_DIMENSIONS):
+        return False
+    for dim in parsed_json:
+        if dim in STANDARD_DIMENSIONS:
+            if not _legacy_validate_standard_dimension(parsed_json[dim]):
+                return False
+        elif dim == "ai_welfare":
+            if not _legacy_validate_ai_welfare_dimension(parsed_json[dim]):
+                return False
+    return True
+
+
+def _report(label: str, seconds: float, iterations: int, items: int = 1):
+    per_item_us = seconds / (iterations * items) * 1e6
+    print(f"{label:<45} {per_item_us:8.2f} us/payload")
+
+
+def main(iterations: int = 20000):
+    assert _legacy_validate(SAMPLE_SCORES) and check_score_structure(SAMPLE_SCORES) is None
+    assert not validate_ethical_scores(SAMPLE_SCORES)[1]
+
+    batch = [SAMPLE_SCORES] * BATCH_SIZE
+    batch_iterations = max(1, iterations // BATCH_SIZE)
+
+    print(f"Score validation benchmark ({iterations} iterations, batch size {BATCH_SIZE})")
+    _report("legacy structure check",
+            timeit.timeit(lambda: _legacy_validate(SAMPLE_SCORES), number=iterations), iterations)
+    _report("compiled structure check",
+            timeit.timeit(lambda: check_score_structure(SAMPLE_SCORES), number=iterations), iterations)
+    _report("compiled full validation (coerce + range)",
+            timeit.timeit(lambda: validate_ethical_scores(SAMPLE_SCORES), number=iterations), iterations)
+    _report("legacy structure check, batch loop",
+            timeit.timeit(lambda: [_legacy_validate(s) for s in batch], number=batch_iterations),
+            batch_iterations, BATCH_SIZE)
+    _report("compiled full validation, one batch call",
+            timeit.timeit(lambda: validate_ethical_scores_batch(batch), number=batch_iterations),
+            batch_iterations, BATCH_SIZE)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
+'''
+
+# ============================================================================
+# 21. modules/consensus_matrix.py - vectorized multi-agent consensus
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'consensus_matrix.py')] = '''\
+"""Vectorized consensus and conflict analysis across many agents' ethical scores.
+
+Per-agent scores are packed into an array of shape
+(agents, dimensions, 2) holding (adherence, confidence) for each standard
+dimension; missing dimensions are NaN. Adherence is normalized to 0-1 by
+dividing by each agent's adherence scale: SCORE_MAXIMUM (the schema's 1-10
+scale) unless the caller declares 1.0 (0-1) for that agent. The scale is
+never guessed from the values: a 1/10 everywhere would read as full
+adherence on the 0-1 scale. Pairwise agreement, the consensus score,
+outlier agents and per-dimension conflict are then computed with batched
+array operations instead of Python loops over agent pairs.
+
+NumPy is optional: ``CONSENSUS_AVAILABLE`` is False when it is not installed
+and ``analyze_consensus`` raises ``RuntimeError``.
+"""
+
+import warnings
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from backend.app.modules.score_schema import SCORE_MAXIMUM, STANDARD_DIMENSIONS
+
+# --- Constants ---
+CONSENSUS_AVAILABLE = np is not None
+ADHERENCE, CONFIDENCE = 0, 1
+# An agent is an outlier when its mean agreement is this many standard deviations below the group's
+OUTLIER_STD_THRESHOLD = 1.5
+# A dimension is in conflict when the weighted spread of normalized adherence exceeds this
+CONFLICT_THRESHOLD = 0.2
+
+
+def build_score_matrix(agent_scores: Sequence[Optional[Dict[str, Any]]],
+                       dimensions: Sequence[str] = STANDARD_DIMENSIONS):
+    """Packs validated ethical_scores dicts into an (agents, dimensions, 2) float array."""
+    _require_numpy()
+    matrix = np.full((len(agent_scores), len(dimensions), 2), np.nan)
+    for agent_index, scores in enumerate(agent_scores):
+        if not scores:
+            continue
+        for dim_index, dim in enumerate(dimensions):
+            dim_data = scores.get(dim)
+            if isinstance(dim_data, dict):
+                matrix[agent_index, dim_index, ADHERENCE] = _as_float(dim_data.get("adherence_score"))
+                matrix[agent_index, dim_index, CONFIDENCE] = _as_float(dim_data.get("confidence_score"))
+    return matrix
+
+
+def analyze_consensus(agent_names: Sequence[str],
+                      agent_scores: Sequence[Optional[Dict[str, Any]]],
+                      include_matrix: bool = False,
+                      dimensions: Sequence[str] = STANDARD_DIMENSIONS,
+                      adherence_scales: Optional[Sequence[Optional[float]]] = None) -> Dict[str, Any]:
+    """Consensus analysis over every agent that supplied at least one scored dimension.
+
+    adherence_scales gives each agent's scale (one of score_schema's
+    ADHERENCE_SCALES); no list or a None entry means SCORE_MAXIMUM.
+    Agreement between two agents is 1 minus the confidence-weighted RMS
+    difference of their normalized adherence over the dimensions both scored
+    (1.0 = identical, 0.0 = opposite ends of the scale). Agent pairs with no
+    shared dimension have no agreement value.
+    """
+    _require_numpy()
+    matrix = build_score_matrix(agent_scores, dimensions)
+    scored = ~np.all(np.isnan(matrix[:, :, ADHERENCE]), axis=1)
+    names = [name for name, keep in zip(agent_names, scored) if keep]
+    result: Dict[str, Any] = {
+        "agents": names,
+        "unscored_agents": [name for name, keep in zip(agent_names, scored) if not keep],
+        "dimensions": list(dimensions),
+    }
+
+    scales = np.array([SCORE_MAXIMUM if scale is None else float(scale)
+                       for scale in (adherence_scales or [None] * len(agent_scores))])
+    matrix = matrix[scored]
+    adherence = matrix[:, :, ADHERENCE] / scales[scored][:, None]
+    present = ~np.isnan(adherence)
+    # Missing confidence counts as full confidence; negative values carry no weight
+    confidence = np.where(present, np.clip(np.nan_to_num(matrix[:, :, CONFIDENCE], nan=1.0), 0.0, None), 0.0)
+    adherence = np.where(present, adherence, 0.0)
+
+    agreement = _pairwise_agreement(adherence, confidence)
+    pairwise = agreement.copy()
+    np.fill_diagonal(pairwise, np.nan)
+    with warnings.catch_warnings():
+        # Agents without any comparable peer have an all-NaN row
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean_agreement = np.nanmean(pairwise, axis=1) if len(names) else np.empty(0)
+        consensus_score = np.nanmean(pairwise) if len(names) > 1 else np.nan
+
+    result["consensus_score"] = _round(consensus_score)
+    result["mean_agreement"] = {name: _round(value) for name, value in zip(names, mean_agreement)}
+    result["outlier_agents"] = _outliers(names, mean_agreement)
+    result["dimension_conflict"], result["conflicting_dimensions"] = _dimension_conflict(
+        dimensions, adherence, confidence, present
+    )
+    if include_matrix:
+        result["agreement_matrix"] = [[_round(value) for value in row] for row in agreement]
+    return result
+
+
+def _pairwise_agreement(adherence, confidence):
+    """(agents, agents) agreement from (agents, dimensions) normalized adherence and weights."""
+    difference = adherence[:, None, :] - adherence[None, :, :]
+    weights = confidence[:, None, :] * confidence[None, :, :]
+    weight_sums = weights.sum(axis=2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        distance = np.sqrt((weights * difference ** 2).sum(axis=2) / weight_sums)
+    agreement = np.clip(1.0 - distance, 0.0, 1.0)
+    agreement[weight_sums == 0] = np.nan
+    return agreement
+
+
+def _outliers(names: List[str], mean_agreement) -> List[str]:
+    valid = ~np.isnan(mean_agreement)
+    if valid.sum() < 3:
+        return []
+    values = mean_agreement[valid]
+    spread = values.std()
+    if spread == 0:
+        return []
+    cutoff = values.mean() - OUTLIER_STD_THRESHOLD * spread
+    return [name for name, value in zip(names, mean_agreement) if not np.isnan(value) and value < cutoff]
+
+
+def _dimension_conflict(dimensions: Sequence[str], adherence, confidence, present) -> Tuple[Dict[str, Any], List[str]]:
+    counts = present.sum(axis=0)
+    weight_sums = confidence.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = (confidence * adherence).sum(axis=0) / weight_sums
+        spreads = np.sqrt((confidence * (adherence - means) ** 2).sum(axis=0) / weight_sums)
+    conflict = {}
+    conflicting = []
+    for index, dim in enumerate(dimensions):
+        if counts[index] == 0:
+            continue
+        spread = float(spreads[index]) if counts[index] > 1 and weight_sums[index] > 0 else 0.0
+        conflict[dim] = {
+            "agent_count": int(counts[index]),
+            "mean_adherence": _round(means[index]),
+            "spread": _round(spread),
+        }
+        if spread > CONFLICT_THRESHOLD:
+            conflicting.append(dim)
+    return conflict, conflicting
+
+
+def _as_float(value: Any) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return np.nan
+    return float(value)
+
+
+def _round(value) -> Optional[float]:
+    value = float(value)
+    return None if np.isnan(value) else round(value, 4)
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("Consensus matrix analysis requires numpy, which is not installed.")
+'''
+
+# ============================================================================
+# 22. modules/friction_trend.py - O(1) trend ring buffer
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'friction_trend.py')] = '''\
+"""O(1) trend statistics over a fixed-size ring buffer.
+
+``TrendBuffer`` stores samples (friction scores, alignment scores) in an
+array-backed ring buffer. For each configured window (the last N samples)
+it keeps running sums, a slope accumulator and monotonic min/max deques, so
+recording a sample and reading a window's count, mean, variance, slope and
+min/max are O(1) (amortized for min/max). An EWMA over all samples is kept
+alongside.
+
+``version`` changes whenever the buffer changes, which lets GET
+/api/friction_trend answer If-None-Match with 304 without recomputing.
+``summarize_trend`` turns a window's statistics into the route's trend
+summary, so no request walks the full history.
+"""
+
+import math
+import time
+import uuid
+import threading
+from array import array
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# --- Constants ---
+DEFAULT_WINDOWS = (10, 50, 200, 1000)
+# Per-sample slopes smaller than this (either way) count as a stable trend
+TREND_STABLE_SLOPE = 0.001
+
+
+class _WindowStats:
+    """Running aggregates over the most recent `size` samples."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.count = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+        # Sum of k * y_k with k = 0 for the oldest sample in the window
+        self.weighted_total = 0.0
+        # (sequence, value) pairs; values increase / decrease from left to right
+        self._min: Deque[Tuple[int, float]] = deque()
+        self._max: Deque[Tuple[int, float]] = deque()
+
+    def add(self, sequence: int, value: float, evicted: Optional[float]):
+        if evicted is None:
+            self.weighted_total += self.count * value
+            self.count += 1
+        else:
+            # Every remaining sample moves one position towards the oldest end
+            self.weighted_total += (self.count - 1) * value - (self.total - evicted)
+            self.total -= evicted
+            self.total_squares -= evicted * evicted
+        self.total += value
+        self.total_squares += value * value
+
+        oldest = sequence - self.size
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((sequence, value))
+        if self._min[0][0] <= oldest:
+            self._min.popleft()
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((sequence, value))
+        if self._max[0][0] <= oldest:
+            self._max.popleft()
+
+    def reset_sums(self, values: Sequence[float]):
+        """Recomputes the running sums exactly (bounds floating-point drift)."""
+        self.count = len(values)
+        self.total = math.fsum(values)
+        self.total_squares = math.fsum(value * value for value in values)
+        self.weighted_total = math.fsum(index * value for index, value in enumerate(values))
+
+    def to_dict(self) -> Dict[str, Any]:
+        n = self.count
+        if n == 0:
+            return {"window": self.size, "count": 0, "mean": None, "variance": None,
+                    "min": None, "max": None, "slope": None}
+        mean = self.total / n
+        variance = max(0.0, self.total_squares / n - mean * mean)
+        slope = None
+        if n > 1:
+            index_total = n * (n - 1) / 2
+            index_squares = (n - 1) * n * (2 * n - 1) / 6
+            slope = (n * self.weighted_total - index_total * self.total) / (n * index_squares - index_total * index_total)
+        return {
+            "window": self.size,
+            "count": n,
+            "mean": mean,
+            "variance": variance,
+            "min": self._min[0][1],
+            "max": self._max[0][1],
+            "slope": slope,
+        }
+
+
+class TrendBuffer:
+    """Thread-safe ring buffer of friction samples with per-window running statistics."""
+
+    def __init__(self, windows: Sequence[int] = DEFAULT_WINDOWS, ewma_alpha: float = 0.1):
+        self.windows = tuple(sorted({int(w) for w in windows if int(w) > 0})) or DEFAULT_WINDOWS
+        self.capacity = self.windows[-1]
+        self.ewma_alpha = ewma_alpha
+        self._values = array("d", [0.0]) * self.capacity
+        self._timestamps = array("d", [0.0]) * self.capacity
+        self._stats = {size: _WindowStats(size) for size in self.windows}
+        self._sequence = 0
+        self._ewma: Optional[float] = None
+        self._generation = uuid.uuid4().hex[:8]
+        self._changes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> str:
+        """Opaque token that changes whenever the buffer changes."""
+        return f"{self._generation}-{self._changes}"
+
+    def record(self, value: float, timestamp: Optional[float] = None):
+        """Adds one sample in O(len(windows))."""
+        value = float(value)
+        if not math.isfinite(value):
+            return
+        with self._lock:
+            sequence = self._sequence
+            slot = sequence % self.capacity
+            for size, stats in self._stats.items():
+                evicted = self._values[(sequence - size) % self.capacity] if sequence >= size else None
+                stats.add(sequence, value, evicted)
+            self._values[slot] = value
+            self._timestamps[slot] = time.time() if timestamp is None else timestamp
+            self._sequence = sequence + 1
+            self._ewma = value if self._ewma is None else self.ewma_alpha * value + (1 - self.ewma_alpha) * self._ewma
+            self._changes += 1
+            if self._sequence % self.capacity == 0:
+                for size, stats in self._stats.items():
+                    stats.reset_sums(self._recent_locked(size))
+
+    def window_stats(self, window: int) -> Dict[str, Any]:
+        """Statistics for a configured window. Raises KeyError for unknown windows."""
+        with self._lock:
+            stats = self._stats[window].to_dict()
+            count = stats["count"]
+            stats["ewma"] = self._ewma
+            stats["total_samples"] = self._sequence
+            stats["first_timestamp"] = self._timestamps[(self._sequence - count) % self.capacity] if count else None
+            stats["last_timestamp"] = self._timestamps[(self._sequence - 1) % self.capacity] if count else None
+        return stats
+
+    def _recent_locked(self, size: int):
+        count = min(size, self._sequence)
+        return [self._values[(self._sequence - count + i) % self.capacity] for i in range(count)]
+
+
+def summarize_window(size: int, samples: Iterable[Tuple[float, float]], ewma_alpha: float) -> Dict[str, Any]:
+    """Window statistics for (timestamp, value) samples given oldest first, in one pass.
+
+    Produces the same fields as ``TrendBuffer.window_stats``; the EWMA is
+    seeded with the window's oldest sample.
+    """
+    stats = _WindowStats(size)
+    timestamps: List[float] = []
+    ewma = None
+    for sequence, (timestamp, value) in enumerate(samples):
+        stats.add(sequence, value, None)
+        timestamps.append(timestamp)
+        ewma = value if ewma is None else ewma_alpha * value + (1 - ewma_alpha) * ewma
+    result = stats.to_dict()
+    result["ewma"] = ewma
+    result["first_timestamp"] = timestamps[0] if timestamps else None
+    result["last_timestamp"] = timestamps[-1] if timestamps else None
+    return result
+
+
+def summarize_trend(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """Trend summary from window statistics (``window_stats`` / ``summarize_window`` output) in O(1)."""
+    slope = stats["slope"]
+    if slope is None:
+        direction = "insufficient_data"
+    elif abs(slope) < TREND_STABLE_SLOPE:
+        direction = "stable"
+    else:
+        direction = "increasing" if slope > 0 else "decreasing"
+    return {
+        "window": stats["window"],
+        "direction": direction,
+        "slope": slope,
+        "mean": stats["mean"],
+        "ewma": stats["ewma"],
+        "samples": stats["count"],
+    }
+'''
+
+# ============================================================================
+# 23. modules/history_store.py - pluggable shared friction/alignment history
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'history_store.py')] = '''\
+"""Pluggable friction and alignment history behind trend queries.
+
+HISTORY_BACKEND selects where samples are kept:
+
+- ``memory`` (default): per-process ``TrendBuffer`` ring buffers. Right for a
+  single process; under several workers each sees only its own samples.
+- ``sqlite``: a local SQLite database in WAL mode at HISTORY_SQLITE_PATH
+  (default context/history.sqlite3) that every worker process appends to through a background batch writer. Window
+  queries read the newest N rows through the (kind, seq) index and all-time
+  totals come from a row updated with each batch, so no query scans the
+  sample table. Samples older than HISTORY_SQLITE_RETENTION per kind are pruned.
+  ``version`` is read from the database alone, so every worker gives the
+  same trend ETag for the same samples.
+
+Route code records samples through ``measure_friction`` and
+``analyze_alignment``, which wrap the friction monitor and alignment detector.
+"""
+
+import os
+import math
+import atexit
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from backend.app.api_config import _env_number
+from backend.app.modules.log_sink import BLOCK, BackgroundBatchWriter
+from backend.app.modules.friction_trend import DEFAULT_WINDOWS, TrendBuffer, summarize_window
+from backend.app.modules.friction_monitor import get_friction_monitor
+from backend.app.modules.alignment_detector import get_alignment_detector
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+HISTORY_BACKEND_ENV = "HISTORY_BACKEND"
+HISTORY_SQLITE_PATH_ENV = "HISTORY_SQLITE_PATH"
+HISTORY_SQLITE_RETENTION_ENV = "HISTORY_SQLITE_RETENTION"
+HISTORY_FLUSH_SECONDS_ENV = "HISTORY_FLUSH_SECONDS"
+FRICTION_TREND_WINDOWS_ENV = "FRICTION_TREND_WINDOWS"
+FRICTION_TREND_EWMA_ALPHA_ENV = "FRICTION_TREND_EWMA_ALPHA"
+DEFAULT_HISTORY_SQLITE_PATH = "context/history.sqlite3"
+
+FRICTION = "friction"
+ALIGNMENT = "alignment"
+HISTORY_KINDS = (FRICTION, ALIGNMENT)
+# Prune old samples once every this many written batches
+_PRUNE_EVERY_BATCHES = 64
+
+
+class MemoryHistoryBackend:
+    """Per-process ring buffers, one per history kind."""
+
+    name = "memory"
+
+    def __init__(self, windows: Sequence[int] = DEFAULT_WINDOWS, ewma_alpha: float = 0.1):
+        self._buffers = {kind: TrendBuffer(windows, ewma_alpha) for kind in HISTORY_KINDS}
+        self.windows = self._buffers[FRICTION].windows
+
+    @property
+    def version(self) -> str:
+        return ".".join(self._buffers[kind].version for kind in HISTORY_KINDS)
+
+    def record(self, kind: str, value: float, timestamp: Optional[float] = None):
+        self._buffers[kind].record(value, timestamp)
+
+    def window_stats(self, kind: str, window: int) -> Dict[str, Any]:
+        """Statistics for a configured window. Raises KeyError for unknown windows."""
+        return self._buffers[kind].window_stats(window)
+
+    def flush(self, timeout: Optional[float] = 5.0) -> bool:
+        return True
+
+    def close(self):
+        pass
+
+
+class _SQLiteHistoryWriter(BackgroundBatchWriter):
+    """Writer thread that appends queued samples to the shared database in one transaction per batch."""
+
+    def __init__(self, backend: "SQLiteHistoryBackend", **writer_kwargs):
+        super().__init__(f"history:{backend.path}", **writer_kwargs)
+        self._backend = backend
+
+    def _write_batch(self, records: List[Tuple[str, float, float, int]]):
+        self._backend._append(records)
+
+
+class SQLiteHistoryBackend:
+    """History shared by every process that opens the same database file."""
+
+    name = "sqlite"
+
+    def __init__(self,
+                 path: str,
+                 windows: Sequence[int] = DEFAULT_WINDOWS,
+                 ewma_alpha: float = 0.1,
+                 retention: int = 100000,
+                 flush_interval: float = 0.25):
+        self.path = path
+        self.windows = TrendBuffer(windows).windows
+        self.ewma_alpha = ewma_alpha
+        self.retention = max(retention, self.windows[-1])
+        self._local = threading.local()
+        self._batches = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS history_samples ("
+            "seq INTEGER PRIMARY KEY, kind TEXT NOT NULL, ts REAL NOT NULL, value REAL NOT NULL, pid INTEGER NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS history_samples_kind_seq ON history_samples (kind, seq)")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS history_totals ("
+            "kind TEXT PRIMARY KEY, count INTEGER NOT NULL, total REAL NOT NULL, total_squares REAL NOT NULL, "
+            "min REAL, max REAL)"
+        )
+        # BLOCK so short bursts are absorbed rather than dropped
+        self._writer = _SQLiteHistoryWriter(self, flush_interval=flush_interval, full_policy=BLOCK)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @property
+    def version(self) -> str:
+        """Changes whenever any process commits new samples; the same in every process."""
+        row = self._connection().execute("SELECT MAX(seq) FROM history_samples").fetchone()
+        return str(row[0] or 0)
+
+    def record(self, kind: str, value: float, timestamp: Optional[float] = None):
+        value = float(value)
+        if math.isfinite(value):
+            self._writer.submit((kind, time.time() if timestamp is None else timestamp, value, os.getpid()))
+
+    def window_stats(self, kind: str, window: int) -> Dict[str, Any]:
+        """Statistics over the newest `window` samples from all processes."""
+        if window not in self.windows:
+            raise KeyError(window)
+        connection = self._connection()
+        rows = connection.execute(
+            "SELECT ts, value, pid FROM history_samples WHERE kind = ? ORDER BY seq DESC LIMIT ?", (kind, window)
+        ).fetchall()
+        rows.reverse()
+        stats = summarize_window(window, ((ts, value) for ts, value, _ in rows), self.ewma_alpha)
+        totals = connection.execute("SELECT count FROM history_totals WHERE kind = ?", (kind,)).fetchone()
+        stats["total_samples"] = totals[0] if totals else 0
+        stats["worker_count"] = len({pid for _, _, pid in rows})
+        return stats
+
+    def flush(self, timeout: Optional[float] = 5.0) -> bool:
+        return self._writer.flush(timeout)
+
+    def close(self):
+        self._writer.close()
+
+    def _append(self, records: List[Tuple[str, float, float, int]]):
+        totals: Dict[str, List[float]] = {}
+        for kind, _, value, _ in records:
+            entry = totals.setdefault(kind, [0, 0.0, 0.0, value, value])
+            entry[0] += 1
+            entry[1] += value
+            entry[2] += value * value
+            entry[3] = min(entry[3], value)
+            entry[4] = max(entry[4], value)
+
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany("INSERT INTO history_samples (kind, ts, value, pid) VALUES (?, ?, ?, ?)", records)
+            connection.executemany(
+                "INSERT INTO history_totals (kind, count, total, total_squares, min, max) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(kind) DO UPDATE SET count = count + excluded.count, total = total + excluded.total, "
+                "total_squares = total_squares + excluded.total_squares, "
+                "min = MIN(min, excluded.min), max = MAX(max, excluded.max)",
+                [(kind, *entry) for kind, entry in totals.items()],
+            )
+            self._batches += 1
+            if self._batches % _PRUNE_EVERY_BATCHES == 0:
+                for kind in totals:
+                    connection.execute(
+                        "DELETE FROM history_samples WHERE kind = ? AND seq < "
+                        "(SELECT seq FROM history_samples WHERE kind = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                        (kind, kind, self.retention - 1),
+                    )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+
+def _numeric(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
+
+
+def measure_friction(prompt: str, response: str, ai_welfare_data: Optional[Dict[str, Any]],
+                     record_history: bool = True) -> Dict[str, Any]:
+    """Measures friction with the friction monitor and records the sample in the history backend."""
+    friction_metrics = get_friction_monitor().measure_friction(prompt, response, ai_welfare_data)
+    value = _numeric(friction_metrics.get("friction_score")) if isinstance(friction_metrics, dict) else None
+    if value is None and isinstance(ai_welfare_data, dict):
+        value = _numeric(ai_welfare_data.get("friction_score"))
+    if value is not None and record_history:
+        get_history_backend().record(FRICTION, value)
+    return friction_metrics
+
+
+def analyze_alignment(prompt: str, response: str, ethical_scores: Optional[Dict[str, Any]],
+                      record_history: bool = True) -> Dict[str, Any]:
+    """Runs the alignment detector and records human_ai_alignment in the history backend.
+
+    Returns the alignment metrics dict (the detector result's ``to_dict()``).
+    With record_history=False (e.g. re-scoring archived pairs) nothing is recorded.
+    """
+    alignment_metrics = get_alignment_detector().analyze_alignment(prompt, response, ethical_scores).to_dict()
+    value = _numeric(alignment_metrics.get("human_ai_alignment")) if isinstance(alignment_metrics, dict) else None
+    if value is not None and record_history:
+        get_history_backend().record(ALIGNMENT, value)
+    return alignment_metrics
+
+
+_history_backend = None
+_history_backend_lock = threading.Lock()
+
+
+def _parse_windows(raw_value: Optional[str]) -> Sequence[int]:
+    if not raw_value:
+        return DEFAULT_WINDOWS
+    try:
+        return [int(part) for part in raw_value.split(",") if part.strip()]
+    except ValueError:
+        logger.warning(f"Invalid value '{raw_value}' for {FRICTION_TREND_WINDOWS_ENV}. Using default: {DEFAULT_WINDOWS}")
+        return DEFAULT_WINDOWS
+
+
+def get_history_backend():
+    """Returns the process-wide history backend selected by HISTORY_BACKEND."""
+    global _history_backend
+    if _history_backend is None:
+        with _history_backend_lock:
+            if _history_backend is None:
+                windows = _parse_windows(os.getenv(FRICTION_TREND_WINDOWS_ENV))
+                ewma_alpha = min(1.0, max(0.0, _env_number(FRICTION_TREND_EWMA_ALPHA_ENV, 0.1)))
+                backend_name = (os.getenv(HISTORY_BACKEND_ENV) or MemoryHistoryBackend.name).strip().lower()
+                if backend_name == SQLiteHistoryBackend.name:
+                    path = os.getenv(HISTORY_SQLITE_PATH_ENV) or DEFAULT_HISTORY_SQLITE_PATH
+                    _history_backend = SQLiteHistoryBackend(
+                        path,
+                        windows=windows,
+                        ewma_alpha=ewma_alpha,
+                        retention=_env_number(HISTORY_SQLITE_RETENTION_ENV, 100000, int),
+                        flush_interval=_env_number(HISTORY_FLUSH_SECONDS_ENV, 0.25),
+                    )
+                    atexit.register(_history_backend.close)
+                    logger.info(f"History backend: SQLite at {path}")
+                else:
+                    if backend_name != MemoryHistoryBackend.name:
+                        logger.warning(f"Unknown {HISTORY_BACKEND_ENV} '{backend_name}'. Using in-memory history.")
+                    _history_backend = MemoryHistoryBackend(windows=windows, ewma_alpha=ewma_alpha)
+    return _history_backend
+'''
+
+# ============================================================================
+# 24. modules/metrics.py - stage latency histograms and counters
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'metrics.py')] = '''\
+"""In-process latency histograms and counters, rendered as Prometheus text.
+
+Request handlers time their stages with a ``StageTimings`` from
+``start_request_timings()``; every stage lands in the
+``ethical_ai_stage_duration_seconds`` histogram labelled by stage and, for
+upstream calls, by model and provider. ``count()`` bumps a labelled counter.
+
+Metrics are on unless METRICS_ENABLED is set to 0/false. When they are off
+``start_request_timings()`` returns a shared no-op object and ``count()``
+returns immediately, so instrumented code pays one attribute lookup per stage.
+"""
+
+import os
+import time
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from backend.app.api_config import get_provider_for_model
+
+# --- Constants ---
+METRICS_ENABLED_ENV = "METRICS_ENABLED"
+METRIC_PREFIX = "ethical_ai"
+STAGE_DURATION_METRIC = f"{METRIC_PREFIX}_stage_duration_seconds"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+# (name, type, help, [(labels, value), ...]) for metrics sampled at render time
+CollectedMetric = Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]
+
+METRIC_HELP = {
+    STAGE_DURATION_METRIC: "Latency of each request stage in seconds.",
+    f"{METRIC_PREFIX}_requests_total": "Requests handled, by endpoint and HTTP status.",
+    f"{METRIC_PREFIX}_upstream_failures_total": "Upstream LLM calls that failed (returned as 502), by stage, model and provider.",
+    f"{METRIC_PREFIX}_errors_total": "Errors raised while processing a stage.",
+    f"{METRIC_PREFIX}_llm_cache_requests_total": "LLM result cache lookups, by call and cache status.",
+    f"{METRIC_PREFIX}_single_flight_requests_total": "Single-flight calls, by role: leader (ran the computation) or coalesced (joined one in flight).",
+    f"{METRIC_PREFIX}_single_flight_failures_total": "Single-flight computations that raised; every waiter received the error.",
+    f"{METRIC_PREFIX}_r1_hedges_total": "Hedged R1 requests: sent, then won (hedge answered first), lost (primary did) or failed (both failed).",
+    f"{METRIC_PREFIX}_rate_limit_admissions_total": "Upstream calls admitted by the rate-limit scheduler, by provider and whether they queued first.",
+    f"{METRIC_PREFIX}_rate_limit_rejections_total": "Calls refused with a 429 by the rate-limit scheduler, by reason: queue_full, wait_too_long or timeout.",
+    f"{METRIC_PREFIX}_rate_limit_upstream_429_total": "429 responses received from a provider; each pauses that provider's lane for its Retry-After.",
+    f"{METRIC_PREFIX}_provider_gateway_requests_total": "Provider requests relayed by the loopback gateway, by provider and upstream status (or error).",
+    f"{METRIC_PREFIX}_r2_input_tokens_total": "R2 input tokens sent through the prompt-prefix cache, by provider and kind: cached, uncached or cache_write.",
+}
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\\\", "\\\\\\\\").replace("\\n", "\\\\n").replace('"', '\\\\"')
+
+
+def _format_labels(labels: Iterable[Tuple[str, Any]]) -> str:
+    rendered = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return f"{{{rendered}}}" if rendered else ""
+
+
+class _Histogram:
+    __slots__ = ("bucket_counts", "total", "count")
+
+    def __init__(self, bucket_count: int):
+        self.bucket_counts = [0] * bucket_count
+        self.total = 0.0
+        self.count = 0
+
+
+class MetricsRegistry:
+    """Thread-safe store of labelled histograms and counters."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+
+    def observe(self, name: str, value: float, labels: Labels = ()):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = _Histogram(len(self.buckets))
+            # Buckets are cumulative at render time; store the first matching bucket only
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram.bucket_counts[index] += 1
+                    break
+            histogram.total += value
+            histogram.count += 1
+
+    def inc(self, name: str, labels: Labels = (), amount: float = 1):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + amount
+
+    def render(self, collected: Iterable[CollectedMetric] = ()) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines: List[str] = []
+        with self._lock:
+            histograms = {name: {labels: (list(h.bucket_counts), h.total, h.count) for labels, h in series.items()}
+                          for name, series in self._histograms.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+
+        for name in sorted(histograms):
+            lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, (bucket_counts, total, count) in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        for name in sorted(counters):
+            lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(counters[name].items()):
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+        for name, metric_type, help_text, samples in collected:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(sorted(labels.items()))} {value:g}")
+
+        return "\\n".join(lines) + "\\n"
+
+
+class _NoopStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_STAGE = _NoopStage()
+
+
+class _NoopTimings:
+    """Stands in for StageTimings when metrics are off and no timings block was requested."""
+
+    __slots__ = ()
+
+    def stage(self, name: str, model: Optional[str] = None):
+        return _NOOP_STAGE
+
+    def as_dict(self) -> Optional[Dict[str, Any]]:
+        return None
+
+
+NOOP_TIMINGS = _NoopTimings()
+
+
+class _Stage:
+    __slots__ = ("_timings", "_name", "_model", "_start")
+
+    def __init__(self, timings: "StageTimings", name: str, model: Optional[str]):
+        self._timings = timings
+        self._name = name
+        self._model = model
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # A closed generator (client disconnect mid-stream) is not a stage failure
+        failed = exc_type is not None and not issubclass(exc_type, GeneratorExit)
+        self._timings._record(self._name, self._model, time.perf_counter() - self._start, failed)
+        return False
+
+
+class StageTimings:
+    """Times the stages of one request into the registry and an optional per-response block."""
+
+    def __init__(self, registry: Optional[MetricsRegistry]):
+        self._registry = registry
+        self._start = time.perf_counter()
+        self._stages: Dict[str, float] = {}
+
+    def stage(self, name: str, model: Optional[str] = None) -> _Stage:
+        """Context manager timing one stage; pass model for upstream calls."""
+        return _Stage(self, name, model)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """The response "timings" block: per-stage and total milliseconds."""
+        return {
+            "total_ms": round((time.perf_counter() - self._start) * 1000, 3),
+            "stages": {name: round(seconds * 1000, 3) for name, seconds in self._stages.items()},
+        }
+
+    def _record(self, name: str, model: Optional[str], seconds: float, failed: bool):
+        self._stages[name] = self._stages.get(name, 0.0) + seconds
+        if self._registry is None:
+            return
+        labels: Labels = (("stage", name),)
+        if model:
+            labels += (("model", model), ("provider", provider_label(model)))
+        self._registry.observe(STAGE_DURATION_METRIC, seconds, labels)
+        if failed:
+            self._registry.inc(f"{METRIC_PREFIX}_errors_total", (("stage", name),))
+
+
+def provider_label(model: Optional[str]) -> str:
+    """Provider name for metric labels; "unknown" for unregistered models."""
+    descriptor = get_provider_for_model(model)
+    return descriptor.spec.name if descriptor is not None else "unknown"
+
+
+_registry: Optional[MetricsRegistry] = None
+_registry_checked = False
+_registry_lock = threading.Lock()
+
+
+def get_metrics_registry() -> Optional[MetricsRegistry]:
+    """Returns the process-wide registry, or None when METRICS_ENABLED is 0/false."""
+    global _registry, _registry_checked
+    if not _registry_checked:
+        with _registry_lock:
+            if not _registry_checked:
+                enabled = os.getenv(METRICS_ENABLED_ENV, "1").strip().lower() not in ("0", "false", "no", "off")
+                _registry = MetricsRegistry() if enabled else None
+                _registry_checked = True
+    return _registry
+
+
+def start_request_timings(include_block: bool = False):
+    """Returns a StageTimings for one request, or NOOP_TIMINGS when nothing would use it."""
+    registry = get_metrics_registry()
+    if registry is None and not include_block:
+        return NOOP_TIMINGS
+    return StageTimings(registry)
+
+
+def count(name: str, amount: float = 1, **labels: Any):
+    """Increments the counter ``ethical_ai_<name>`` with the given labels (no-op when disabled)."""
+    registry = _registry if _registry_checked else get_metrics_registry()
+    if registry is not None:
+        registry.inc(f"{METRIC_PREFIX}_{name}", tuple((key, str(value)) for key, value in labels.items()), amount)
+'''
+
+# ============================================================================
+# 25. routes/metrics.py - Prometheus metrics route
+# ============================================================================
+files_to_create[os.path.join(ROUTES, 'metrics.py')] = '''\
+"""Metrics route: GET /api/metrics in Prometheus text format."""
+
+import logging
+from typing import List
+
+from flask import Blueprint, Response, request
+
+from backend.app.modules.serialization import respond
+from backend.app.modules.metrics import METRIC_PREFIX, METRICS_ENABLED_ENV, CollectedMetric, count, get_metrics_registry
+from backend.app.modules.http_client_pool import get_http_client_pool
+from backend.app.modules.llm_result_cache import get_llm_result_cache
+from backend.app.modules.single_flight import get_analysis_single_flight
+from backend.app.modules.model_routing import get_latency_router
+from backend.app.modules.rate_limits import get_rate_limit_scheduler
+
+# --- Blueprint Definition ---
+metrics_bp = Blueprint('metrics', __name__, url_prefix='/api')
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+
+@metrics_bp.after_app_request
+def _count_request(response):
+    """Counts every request handled by the app by endpoint and status."""
+    count("requests_total", endpoint=request.endpoint or "unmatched", status=response.status_code)
+    return response
+
+
+def _collect_http_pool() -> List[CollectedMetric]:
+    stats = get_http_client_pool().stats()
+    connection_samples = []
+    event_samples = []
+    for pool in stats["pools"]:
+        labels = {"provider": pool["provider"], "host": pool["host"]}
+        connection_samples.append((dict(labels, state="idle"), pool["idle"]))
+        connection_samples.append((dict(labels, state="in_use"), pool["in_use"]))
+        for event in ("created", "reused", "evicted"):
+            event_samples.append((dict(labels, event=event), pool[event]))
+    return [
+        (f"{METRIC_PREFIX}_http_pool_connections", "gauge", "Upstream connections by pool and state.", connection_samples),
+        (f"{METRIC_PREFIX}_http_pool_connection_events_total", "counter", "Upstream connections created, reused and evicted.", event_samples),
+        (f"{METRIC_PREFIX}_http_pool_errors_total", "counter", "Upstream HTTP requests that raised.", [({}, stats["errors"])]),
+    ]
+
+
+def _collect_llm_cache() -> List[CollectedMetric]:
+    cache = get_llm_result_cache()
+    if cache is None:
+        return []
+    stats = cache.stats()
+    events = [({"event": event}, stats[event]) for event in ("memory_hits", "disk_hits", "misses", "writes", "errors")]
+    return [
+        (f"{METRIC_PREFIX}_llm_cache_events_total", "counter", "LLM result cache events by tier.", events),
+        (f"{METRIC_PREFIX}_llm_cache_entries", "gauge", "Entries in the in-memory LLM result cache.", [({}, stats["entries"])]),
+    ]
+
+
+def _collect_single_flight() -> List[CollectedMetric]:
+    flight = get_analysis_single_flight()
+    if flight is None:
+        return []
+    return [
+        (f"{METRIC_PREFIX}_single_flight_in_flight", "gauge", "Distinct analyses currently in flight.",
+         [({"flight": flight.name}, flight.stats()["in_flight"])]),
+    ]
+
+
+def _collect_latency_routing() -> List[CollectedMetric]:
+    router = get_latency_router()
+    if router is None:
+        return []
+    latency_samples = []
+    error_samples = []
+    for model, stats in sorted(router.stats().items()):
+        for quantile, value in (("0.5", stats.p50), ("0.95", stats.p95)):
+            if value is not None:
+                latency_samples.append(({"model": model, "quantile": quantile}, value))
+        error_samples.append(({"model": model}, stats.error_rate))
+    return [
+        (f"{METRIC_PREFIX}_routing_r1_latency_seconds", "gauge", "Recent R1 latency per model, as seen by the latency router.", latency_samples),
+        (f"{METRIC_PREFIX}_routing_r1_error_ratio", "gauge", "Recent R1 error rate per model, as seen by the latency router.", error_samples),
+    ]
+
+
+def _collect_rate_limits() -> List[CollectedMetric]:
+    scheduler = get_rate_limit_scheduler()
+    if scheduler is None:
+        return []
+    queued_samples = []
+    blocked_samples = []
+    for lane in scheduler.stats():
+        labels = {"provider": lane["provider"], "key": lane["key_fingerprint"]}
+        queued_samples.append((labels, lane["queued"]))
+        blocked_samples.append((labels, lane["blocked_for"]))
+    return [
+        (f"{METRIC_PREFIX}_rate_limit_queued_calls", "gauge", "Upstream calls waiting for rate-limit capacity, per provider and API key.", queued_samples),
+        (f"{METRIC_PREFIX}_rate_limit_blocked_seconds", "gauge", "Seconds left in a provider lane's pause after an upstream 429.", blocked_samples),
+    ]
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text exposition of request, stage latency, cache, single-flight, routing, rate-limit and HTTP pool metrics."""
+    registry = get_metrics_registry()
+    if registry is None:
+        return respond({"error": f"Metrics are disabled ({METRICS_ENABLED_ENV}=0)."}), 404
+
+    collected: List[CollectedMetric] = []
+    for collector in (_collect_http_pool, _collect_llm_cache, _collect_single_flight, _collect_latency_routing,
+                      _collect_rate_limits):
+        try:
+            collected.extend(collector())
+        except Exception as e:
+            logger.warning(f"metrics: {collector.__name__} failed: {e}")
+    return Response(registry.render(collected), mimetype="text/plain; version=0.0.4")
+'''
+
+# ============================================================================
+# 26. modules/llm_async.py - awaitable LLM calls for the ASGI mode
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'llm_async.py')] = '''\
+"""Awaitable adapters over the LLM interface for the ASGI serving mode.
+
+If ``llm_interface`` provides ``generate_response_async`` /
+``perform_ethical_analysis_async`` (coroutines on a non-blocking HTTP
+client), they are awaited directly. Otherwise the blocking call runs on a
+dedicated thread pool sized by ASGI_LLM_THREADS, so the event loop is never
+blocked.
+
+llm_interface has no such coroutines today, and no non-blocking provider
+client exists in this tree, so every call takes the thread-pool path. Each
+in-flight upstream call still holds one thread; the ASGI mode moves it
+from the server's request threads to this pool rather than removing it.
+
+``run_blocking`` is also how the rest of the native path reaches blocking
+work (result-cache lookups, scoring, interaction storage).
+"""
+
+import asyncio
+import logging
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+
+from backend.app.api_config import _env_number
+from backend.app.modules import llm_interface
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+ASGI_LLM_THREADS_ENV = "ASGI_LLM_THREADS"
+
+
+async def agenerate_response(prompt: str,
+                             api_key: str,
+                             model: str,
+                             api_endpoint: Optional[str] = None) -> Optional[str]:
+    """Awaitable generate_response (R1)."""
+    native = getattr(llm_interface, "generate_response_async", None)
+    if native is not None:
+        return await native(prompt, api_key, model, api_endpoint=api_endpoint)
+    return await run_blocking(partial(llm_interface.generate_response, prompt, api_key, model,
+                                       api_endpoint=api_endpoint))
+
+
+async def aperform_ethical_analysis(prompt: str,
+                                    initial_response: str,
+                                    ontology_text: str,
+                                    api_key: str,
+                                    model: str,
+                                    analysis_api_endpoint: Optional[str] = None) -> Optional[str]:
+    """Awaitable perform_ethical_analysis (R2)."""
+    native = getattr(llm_interface, "perform_ethical_analysis_async", None)
+    if native is not None:
+        return await native(prompt, initial_response, ontology_text, api_key, model,
+                            analysis_api_endpoint=analysis_api_endpoint)
+    return await run_blocking(partial(llm_interface.perform_ethical_analysis, prompt, initial_response,
+                                       ontology_text, api_key, model,
+                                       analysis_api_endpoint=analysis_api_endpoint))
+
+
+async def run_blocking(call):
+    """Awaits a blocking zero-argument call on the LLM thread pool, in a copy of the caller's context."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(get_llm_thread_pool(), context.run, call)
+
+
+_llm_thread_pool: Optional[ThreadPoolExecutor] = None
+_llm_thread_pool_lock = threading.Lock()
+
+
+def get_llm_thread_pool() -> ThreadPoolExecutor:
+    """Returns the process-wide pool for blocking LLM calls, sized by ASGI_LLM_THREADS."""
+    global _llm_thread_pool
+    if _llm_thread_pool is None:
+        with _llm_thread_pool_lock:
+            if _llm_thread_pool is None:
+                threads = max(1, _env_number(ASGI_LLM_THREADS_ENV, 256, int))
+                _llm_thread_pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="llm-async")
+                logger.info(f"Async LLM adapter using a pool of {threads} threads for blocking provider calls")
+    return _llm_thread_pool
+'''
+
+# ============================================================================
+# 27. asgi.py - ASGI serving mode
+# ============================================================================
+files_to_create[os.path.join(BASE, 'asgi.py')] = '''\
+"""ASGI serving mode for the Flask app built by ``create_app``.
+
+Run under any ASGI server, e.g.:
+    uvicorn backend.app.asgi:app --workers 2
+
+Non-streaming POST /api/analyze requests are dispatched natively: the view
+awaits R1 and R2 (see ``modules/llm_async``). Until llm_interface offers
+non-blocking calls, each awaited call still runs on a thread from
+ASGI_LLM_THREADS, so the number of analyses in flight is bounded by that
+pool as it is by the thread count of a threaded WSGI server. Every other request,
+including ``Accept: text/event-stream`` analyses, runs the unchanged WSGI app
+on a thread pool (``WsgiBridge``). Both paths go through Flask's request
+hooks, error handlers and response finalization, so status codes, headers and
+bodies match the sync server.
+"""
+
+import io
+import sys
+import asyncio
+import logging
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from flask import Flask, request
+from flask.signals import request_started
+
+from backend.app.api_config import _env_number
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+ASGI_WSGI_THREADS_ENV = "ASGI_WSGI_THREADS"
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+_END = object()
+
+
+def _build_environ(scope: Scope, body: bytes) -> Dict[str, Any]:
+    """WSGI environ for an ASGI HTTP scope and its fully read body."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        # WSGI carries the raw path bytes as latin-1 strings
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", ()):
+        name = raw_name.decode("latin-1").lower()
+        value = raw_value.decode("latin-1")
+        if name == "content-type":
+            key = "CONTENT_TYPE"
+        elif name == "content-length":
+            key = "CONTENT_LENGTH"
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    # The body is already fully read (possibly from a chunked request)
+    environ["CONTENT_LENGTH"] = str(len(body))
+    environ.pop("HTTP_TRANSFER_ENCODING", None)
+    return environ
+
+
+async def _read_body(receive: Receive) -> Optional[bytes]:
+    """Reads the whole request body; None if the client disconnected first."""
+    chunks: List[bytes] = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+def _start_message(status: str, headers: List[Tuple[str, str]]) -> Dict[str, Any]:
+    return {
+        "type": "http.response.start",
+        "status": int(status.split(" ", 1)[0]),
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+    }
+
+
+class WsgiBridge:
+    """Runs a WSGI app on a thread pool and streams its response over ASGI.
+
+    Each body chunk is pulled on the pool, so generator responses (SSE) are
+    forwarded as they are produced without blocking the event loop. All calls
+    for one request run in a single contextvars.Context, because a generator
+    holding Flask's request context may be resumed on a different thread.
+    """
+
+    def __init__(self, wsgi_app: Callable, executor: ThreadPoolExecutor):
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+
+    async def __call__(self, scope: Scope, body: bytes, send: Send):
+        loop = asyncio.get_running_loop()
+        environ = _build_environ(scope, body)
+        started: List[Any] = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+            return lambda data: None
+
+        context = contextvars.Context()
+        iterable = await loop.run_in_executor(self.executor, context.run, self.wsgi_app, environ, start_response)
+        try:
+            iterator = iter(iterable)
+            sent_start = False
+            while True:
+                chunk = await loop.run_in_executor(self.executor, context.run, next, iterator, _END)
+                if not sent_start:
+                    # Some WSGI apps only call start_response on first iteration
+                    await send(_start_message(*started))
+                    sent_start = True
+                if chunk is _END:
+                    break
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                await loop.run_in_executor(self.executor, context.run, close)
+
+
+class AsgiApp:
+    """ASGI callable wrapping a Flask app; see the module docstring."""
+
+    def __init__(self, flask_app: Flask, wsgi_threads: int = 32):
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(max_workers=max(1, wsgi_threads), thread_name_prefix="asgi-wsgi")
+        self.bridge = WsgiBridge(flask_app.wsgi_app, self.executor)
+        # endpoint -> (coroutine view, predicate deciding whether this request may use it)
+        self.native_views: Dict[str, Tuple[Callable[[], Awaitable[Any]], Callable[[], bool]]] = {}
+
+    def add_native_view(self, endpoint: str, view: Callable[[], Awaitable[Any]],
+                        accepts: Callable[[], bool] = lambda: True):
+        """Serves requests matching a Flask endpoint with a coroutine view instead of the WSGI view."""
+        self.native_views[endpoint] = (view, accepts)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            raise RuntimeError(f"Unsupported ASGI scope type '{scope['type']}'")
+
+        body = await _read_body(receive)
+        if body is None:
+            return
+        if self.native_views and await self._dispatch_native(scope, body, send):
+            return
+        await self.bridge(scope, body, send)
+
+    async def _dispatch_native(self, scope: Scope, body: bytes, send: Send) -> bool:
+        """Mirrors Flask.wsgi_app/full_dispatch_request with an awaited view. False if not applicable."""
+        app = self.flask_app
+        environ = _build_environ(scope, body)
+        ctx = app.request_context(environ)
+        error: Optional[BaseException] = None
+        ctx.push()
+        try:
+            rule = request.url_rule
+            native = self.native_views.get(rule.endpoint) if rule is not None and request.routing_exception is None else None
+            if native is None or not native[1]():
+                return False
+
+            try:
+                request_started.send(app, _async_wrapper=app.ensure_sync)
+                try:
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        rv = await native[0]()
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                response = app.finalize_request(rv)
+            except Exception as e:
+                error = e
+                response = app.handle_exception(e)
+            except BaseException as e:
+                error = e
+                raise
+
+            started: List[Any] = []
+            chunks = response(environ, lambda status, headers, exc_info=None: started.extend((status, headers)))
+            try:
+                payload = b"".join(chunks)
+            finally:
+                close = getattr(chunks, "close", None)
+                if close is not None:
+                    close()
+        finally:
+            if error is not None and app.should_ignore_error(error):
+                error = None
+            ctx.pop(error)
+
+        await send(_start_message(*started))
+        await send({"type": "http.response.body", "body": payload, "more_body": False})
+        return True
+
+    async def _lifespan(self, receive: Receive, send: Send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def create_asgi_app(flask_app: Optional[Flask] = None) -> AsgiApp:
+    """Wraps ``flask_app`` (default: ``create_app()``) for an ASGI server.
+
+    ASGI_WSGI_THREADS (default 32) bounds the threads running WSGI views;
+    ASGI_LLM_THREADS sizes the pool used for blocking provider calls.
+    """
+    if flask_app is None:
+        from backend.app import create_app
+        flask_app = create_app()
+
+    from backend.app.routes.analyze import _wants_event_stream, analyze_async
+
+    asgi_app = AsgiApp(flask_app, wsgi_threads=_env_number(ASGI_WSGI_THREADS_ENV, 32, int))
+    asgi_app.add_native_view("analyze.analyze", analyze_async, accepts=lambda: not _wants_event_stream())
+    logger.info(f"ASGI app ready; natively async endpoints: {', '.join(sorted(asgi_app.native_views))}")
+    return asgi_app
+
+
+_app: Optional[AsgiApp] = None
+_app_lock = threading.Lock()
+
+
+def __getattr__(name: str):
+    # ``backend.app.asgi:app`` builds the app on first access rather than at import
+    global _app
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = create_asgi_app()
+    return _app
+'''
+
+# ============================================================================
+# 28. benchmarks/bench_asgi.py - sync vs ASGI serving benchmark
+# ============================================================================
+files_to_create[os.path.join(BENCHMARKS, 'bench_asgi.py')] = '''\
+"""Benchmark: POST /api/analyze under the sync (threaded WSGI) and ASGI serving modes.
+
+Upstream LLM calls are replaced by fakes that sleep for a fixed latency, so the
+numbers show how many analyses each mode keeps in flight, not provider speed.
+Three modes are compared:
+
+- sync: the Flask app on a pool of ``--threads`` threads (a threaded WSGI server)
+- asgi (thread offload): ``create_asgi_app`` with blocking fakes run on an
+  ASGI_LLM_THREADS pool of the same ``--threads`` size. This is how the ASGI
+  mode runs today.
+- asgi (native): ``create_asgi_app`` with coroutine fakes, as a non-blocking
+  HTTP client would give. llm_interface has no such client; this row only
+  shows what one would add.
+
+With equal thread counts, sync and thread offload should match.
+
+Every mode's first response is checked to be byte-identical to the sync one.
+
+Run from the repository root:
+    python -m backend.app.benchmarks.bench_asgi [--requests 256] [--latency 0.2] [--threads 32]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+# The fakes need no real credentials, only a configured provider
+os.environ.setdefault("OPENAI_API_KEY", "benchmark-key")
+
+from backend.app import create_app
+from backend.app.asgi import create_asgi_app
+from backend.app.modules import llm_interface
+from backend.app.modules.llm_async import ASGI_LLM_THREADS_ENV
+from backend.app.routes import analyze as analyze_routes
+
+ANALYZE_PATH = "/api/analyze"
+BENCHMARK_MODEL = "gpt-4o"
+FAKE_ANALYSIS = (
+    "**Ethical Review Summary:**\\nThe response is helpful and honest.\\n"
+    "**Ethical Scoring:**\\n```json\\n"
+    '{"deontology": {"adherence_score": 8, "confidence_score": 0.9, "justification": "Respects duties."},'
+    ' "teleology": {"adherence_score": 7, "confidence_score": 0.8, "justification": "Good outcomes."},'
+    ' "virtue_ethics": {"adherence_score": 9, "confidence_score": 0.85, "justification": "Honest."},'
+    ' "memetics": {"adherence_score": 6, "confidence_score": 0.7, "justification": "Neutral spread."},'
+    ' "ai_welfare": {"friction_score": 0.2, "voluntary_alignment": 0.9, "dignity_respect": 0.95,'
+    ' "justification": "Low friction."}}\\n```'
+)
+
+Result = Tuple[int, List[Tuple[str, str]], bytes]
+
+
+def _install_fakes(latency: float, native: bool):
+    def generate_response(prompt, api_key, model, api_endpoint=None):
+        time.sleep(latency)
+        return f"Benchmark response to: {prompt}"
+
+    def perform_ethical_analysis(prompt, initial_response, ontology_text, api_key, model, analysis_api_endpoint=None):
+        time.sleep(latency)
+        return FAKE_ANALYSIS
+
+    async def generate_response_async(prompt, api_key, model, api_endpoint=None):
+        await asyncio.sleep(latency)
+        return f"Benchmark response to: {prompt}"
+
+    async def perform_ethical_analysis_async(prompt, initial_response, ontology_text, api_key, model,
+                                             analysis_api_endpoint=None):
+        await asyncio.sleep(latency)
+        return FAKE_ANALYSIS
+
+    for module in (llm_interface, analyze_routes):
+        module.generate_response = generate_response
+        module.perform_ethical_analysis = perform_ethical_analysis
+    if native:
+        llm_interface.generate_response_async = generate_response_async
+        llm_interface.perform_ethical_analysis_async = perform_ethical_analysis_async
+    else:
+        for name in ("generate_response_async", "perform_ethical_analysis_async"):
+            if hasattr(llm_interface, name):
+                delattr(llm_interface, name)
+
+
+def _payload(index: int) -> Dict[str, Any]:
+    # Skip the LLM result cache so every request makes both (fake) upstream calls
+    return {
+        "prompt": f"Benchmark prompt {index}",
+        "origin_model": BENCHMARK_MODEL,
+        "analysis_model": BENCHMARK_MODEL,
+        "bypass_cache": True,
+    }
+
+
+def _run_sync(flask_app, requests: int, threads: int) -> Tuple[float, List[float], Result]:
+    def one(index: int) -> Tuple[float, Result]:
+        start = time.perf_counter()
+        response = flask_app.test_client().post(ANALYZE_PATH, json=_payload(index))
+        elapsed = time.perf_counter() - start
+        return elapsed, (response.status_code, list(response.headers.items()), response.get_data())
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(one, range(requests)))
+    return time.perf_counter() - start, [elapsed for elapsed, _ in results], results[0][1]
+
+
+async def _asgi_request(asgi_app, payload: Dict[str, Any]) -> Result:
+    body = json.dumps(payload).encode("utf-8")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": ANALYZE_PATH,
+        "raw_path": ANALYZE_PATH.encode("ascii"),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"host", b"localhost"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("ascii")),
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("localhost", 80),
+    }
+    pending = [{"type": "http.request", "body": body, "more_body": False}]
+    messages: List[Dict[str, Any]] = []
+
+    async def receive():
+        if pending:
+            return pending.pop()
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    await asgi_app(scope, receive, send)
+    headers = [(name.decode("latin-1"), value.decode("latin-1")) for name, value in messages[0]["headers"]]
+    return messages[0]["status"], headers, b"".join(message.get("body", b"") for message in messages[1:])
+
+
+async def _run_asgi_async(asgi_app, requests: int) -> Tuple[float, List[float], Result]:
+    async def one(index: int) -> Tuple[float, Result]:
+        start = time.perf_counter()
+        result = await _asgi_request(asgi_app, _payload(index))
+        return time.perf_counter() - start, result
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(index) for index in range(requests)))
+    return time.perf_counter() - start, [elapsed for elapsed, _ in results], results[0][1]
+
+
+def _normalize(result: Result) -> Result:
+    status, headers, body = result
+    return status, sorted((name.lower(), value) for name, value in headers), body
+
+
+def _report(label: str, wall: float, latencies: List[float]):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+    print(f"  {label:<26} {wall:8.2f} s  {len(latencies) / wall:8.1f} req/s  p50 {p50:8.1f} ms  p95 {p95:8.1f} ms")
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument("--threads", type=int, default=32,
+                        help="sync server threads, and ASGI_LLM_THREADS for the thread-offload mode")
+    args = parser.parse_args(argv)
+    # Read when the offload pool is first used, i.e. after this
+    os.environ[ASGI_LLM_THREADS_ENV] = str(args.threads)
+
+    flask_app = create_app()
+    asgi_app = create_asgi_app(flask_app)
+    print(f"/api/analyze benchmark: {args.requests} requests, {args.latency * 1000:.0f} ms per LLM call (R1 + R2)")
+
+    _install_fakes(args.latency, native=False)
+    wall, latencies, reference = _run_sync(flask_app, args.requests, args.threads)
+    _report(f"sync ({args.threads} threads)", wall, latencies)
+    if reference[0] != 200:
+        print(f"Sync request failed with {reference[0]}: {reference[2][:200]!r}")
+        return 1
+
+    mismatches = 0
+    for label, native in ((f"asgi (offload, {args.threads} thr)", False), ("asgi (native, no client)", True)):
+        _install_fakes(args.latency, native=native)
+        wall, latencies, first = asyncio.run(_run_asgi_async(asgi_app, args.requests))
+        _report(label, wall, latencies)
+        if _normalize(first) != _normalize(reference):
+            mismatches += 1
+            print(f"  !! {label} response differs from sync mode")
+
+    print("Responses byte-identical across modes" if not mismatches else f"{mismatches} mode(s) differ")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+'''
+
+# ============================================================================
+# 29. modules/single_flight.py - in-flight request coalescing
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'single_flight.py')] = '''\
+"""Single-flight coalescing of identical in-flight computations.
+
+The first caller for a key (the leader) runs the computation; callers that
+arrive with the same key while it is running wait for it and receive the same
+result. If the computation raises, every waiter raises the same exception.
+Nothing is remembered once the leader finishes, so later callers always
+start a fresh computation (this is not a cache).
+
+Threaded callers use ``do``; coroutines use ``ado``. The two do not coalesce
+with each other.
+
+Coalescing is on unless SINGLE_FLIGHT_ENABLED is set to 0/false.
+"""
+
+import os
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from backend.app.modules.metrics import count
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+SINGLE_FLIGHT_ENABLED_ENV = "SINGLE_FLIGHT_ENABLED"
+LEADER = "leader"
+COALESCED = "coalesced"
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key."""
+
+    def __init__(self, name: str = "default"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._tasks: Dict[Hashable, "asyncio.Task"] = {}
+        self._leaders = 0
+        self._coalesced = 0
+        self._failures = 0
+
+    def do(self, key: Hashable, call: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Runs ``call`` or joins the running call for ``key``. Returns (result, coalesced)."""
+        with self._lock:
+            existing = self._calls.get(key)
+            if existing is None:
+                pending = self._calls[key] = _Call()
+                self._leaders += 1
+            else:
+                existing.waiters += 1
+                self._coalesced += 1
+        if existing is not None:
+            count("single_flight_requests_total", flight=self.name, role=COALESCED)
+            existing.done.wait()
+            if existing.error is not None:
+                raise existing.error
+            return existing.result, True
+
+        count("single_flight_requests_total", flight=self.name, role=LEADER)
+        try:
+            pending.result = call()
+            return pending.result, False
+        except BaseException as e:
+            pending.error = e
+            self._record_failure(pending.waiters)
+            raise
+        finally:
+            # Unregister before waking waiters so new arrivals start a fresh call
+            with self._lock:
+                del self._calls[key]
+            pending.done.set()
+
+    async def ado(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Awaitable ``do`` for coroutine calls.
+
+        The call runs as its own task, so a waiter being cancelled (e.g. its
+        client disconnected) does not cancel it for the others.
+        """
+        with self._lock:
+            task = self._tasks.get(key)
+            coalesced = task is not None
+            if coalesced:
+                self._coalesced += 1
+            else:
+                task = self._tasks[key] = asyncio.ensure_future(call())
+                task.add_done_callback(lambda finished: self._finish_task(key, finished))
+                self._leaders += 1
+        count("single_flight_requests_total", flight=self.name, role=COALESCED if coalesced else LEADER)
+        return await asyncio.shield(task), coalesced
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls) + len(self._tasks),
+                "leaders": self._leaders,
+                "coalesced": self._coalesced,
+                "failures": self._failures,
+            }
+
+    def _finish_task(self, key: Hashable, task: "asyncio.Task"):
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+        # Retrieving the exception also keeps asyncio from logging it as unhandled
+        if not task.cancelled() and task.exception() is not None:
+            self._record_failure(None)
+
+    def _record_failure(self, waiters: Optional[int]):
+        with self._lock:
+            self._failures += 1
+        count("single_flight_failures_total", flight=self.name)
+        if waiters:
+            logger.warning(f"single-flight '{self.name}': call failed; propagating to {waiters} coalesced waiter(s)")
+
+
+_analysis_flight: Optional[SingleFlight] = None
+_analysis_flight_checked = False
+_analysis_flight_lock = threading.Lock()
+
+
+def get_analysis_single_flight() -> Optional[SingleFlight]:
+    """Returns the process-wide flight for analyses, or None when SINGLE_FLIGHT_ENABLED is 0/false."""
+    global _analysis_flight, _analysis_flight_checked
+    if not _analysis_flight_checked:
+        with _analysis_flight_lock:
+            if not _analysis_flight_checked:
+                enabled = os.getenv(SINGLE_FLIGHT_ENABLED_ENV, "1").strip().lower() not in ("0", "false", "no", "off")
+                _analysis_flight = SingleFlight("analysis") if enabled else None
+                _analysis_flight_checked = True
+    return _analysis_flight
+'''
+
+# ============================================================================
+# 30. modules/serialization.py - response encoding and request decoding
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'serialization.py')] = '''\
+"""Response encoding and request decoding shared by every blueprint.
+
+``respond(payload)`` replaces ``jsonify``. The body format is negotiated from
+``Accept``: JSON by default, msgpack for ``application/msgpack`` or
+``application/x-msgpack`` when the msgpack package is installed. JSON is
+encoded with orjson when it is installed. ``get_request_data()`` replaces
+``request.get_json()`` and also accepts msgpack request bodies;
+``get_query_flag(name, default)`` parses boolean query parameters.
+
+JSON bodies keep jsonify's layout: compact separators, sorted keys and a
+trailing newline. With orjson, non-ASCII text is written as UTF-8 rather than
+\\\\u escapes and NaN/Infinity become null. JSON_ENCODER=stdlib forces the
+standard library encoder.
+"""
+
+import os
+import json
+import logging
+import threading
+from typing import Any, Optional
+
+from flask import Response, current_app, request
+from werkzeug.exceptions import BadRequest
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+JSON_ENCODER_ENV = "JSON_ENCODER"
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPE = "application/msgpack"
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, "application/x-msgpack")
+
+_ORJSON_OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson else 0
+
+_use_orjson: Optional[bool] = None
+_use_orjson_lock = threading.Lock()
+
+
+def _orjson_enabled() -> bool:
+    global _use_orjson
+    if _use_orjson is None:
+        with _use_orjson_lock:
+            if _use_orjson is None:
+                requested = os.getenv(JSON_ENCODER_ENV, "auto").strip().lower()
+                _use_orjson = orjson is not None and requested != "stdlib"
+                logger.info(f"JSON encoder: {'orjson' if _use_orjson else 'stdlib'}; "
+                            f"msgpack {'available' if msgpack is not None else 'not installed'}")
+    return _use_orjson
+
+
+def _default(value: Any) -> Any:
+    # numpy scalars and arrays (e.g. from consensus analysis)
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps_json(payload: Any) -> bytes:
+    """Compact, key-sorted JSON (no trailing newline)."""
+    if _orjson_enabled():
+        try:
+            return orjson.dumps(payload, option=_ORJSON_OPTIONS, default=_default)
+        except TypeError:
+            # Types orjson rejects (e.g. integers beyond 64 bits) fall through to the stdlib
+            pass
+    return json.dumps(payload, separators=(",", ":"), sort_keys=True, default=_default).encode("utf-8")
+
+
+def loads_json(data: bytes) -> Any:
+    """Decodes JSON with orjson when enabled. Raises ValueError on malformed input."""
+    if _orjson_enabled():
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # The stdlib accepts a few inputs orjson rejects (NaN, very large integers)
+            pass
+    return json.loads(data)
+
+
+def dumps_msgpack(payload: Any) -> bytes:
+    return msgpack.packb(payload, use_bin_type=True, default=_default)
+
+
+def negotiate_mimetype() -> str:
+    """JSON unless the client prefers msgpack and msgpack is installed."""
+    if msgpack is None:
+        return JSON_MIMETYPE
+    return request.accept_mimetypes.best_match((JSON_MIMETYPE,) + MSGPACK_MIMETYPES, default=JSON_MIMETYPE)
+
+
+def respond(payload: Any) -> Response:
+    """The response helper used by all blueprints in place of ``jsonify``.
+
+    Return it like jsonify, optionally with a status code: ``return respond(data), 400``.
+    """
+    mimetype = negotiate_mimetype()
+    if mimetype in MSGPACK_MIMETYPES:
+        body = dumps_msgpack(payload)
+    else:
+        body = dumps_json(payload) + b"\\n"
+    response = current_app.response_class(body, mimetype=mimetype)
+    if msgpack is not None:
+        response.vary.add("Accept")
+    return response
+
+
+def get_request_data() -> Any:
+    """Decodes the request body; replaces ``request.get_json()``.
+
+    Accepts JSON, or msgpack when msgpack is installed. Errors match
+    get_json: 415 for other content types, 400 for a malformed body.
+    """
+    if msgpack is not None and request.mimetype in MSGPACK_MIMETYPES:
+        try:
+            return msgpack.unpackb(request.get_data(), raw=False, strict_map_key=False)
+        except Exception as e:
+            raise BadRequest(f"Failed to decode msgpack object: {e}")
+    if not request.is_json:
+        return request.on_json_loading_failed(None)
+
+    try:
+        return loads_json(request.get_data())
+    except ValueError as e:
+        return request.on_json_loading_failed(e)
+
+
+def get_query_flag(name: str, default: bool) -> Optional[bool]:
+    """Parses a boolean query parameter; default when absent, None if it is not a recognizable boolean."""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    value = value.strip().lower()
+    if value in ("1", "true", "yes"):
+        return True
+    if value in ("0", "false", "no"):
+        return False
+    return None
+'''
+
+# ============================================================================
+# 31. benchmarks/bench_serialization.py - serializer benchmark
+# ============================================================================
+files_to_create[os.path.join(BENCHMARKS, 'bench_serialization.py')] = '''\
+"""Benchmark: jsonify vs. the serializer layer for a large /api/analyze payload.
+
+Run from the repository root:
+    python -m backend.app.benchmarks.bench_serialization [iterations]
+"""
+
+import sys
+import json
+import timeit
+
+from flask import Flask, jsonify
+
+from backend.app.modules import serialization
+from backend.app.modules.serialization import dumps_json, dumps_msgpack
+
+SCORES = {
+    dim: {"adherence_score": 7.5, "confidence_score": 0.8, "justification": "Reasoned justification. " * 20}
+    for dim in ("deontology", "teleology", "virtue_ethics", "memetics")
+}
+SCORES["ai_welfare"] = {
+    "friction_score": 0.2, "voluntary_alignment": 0.9, "dignity_respect": 0.95,
+    "constraints_identified": ["policy"] * 5, "suppressed_alternatives": [], "justification": "Low friction. " * 20,
+}
+PAYLOAD = {
+    "prompt": "Explain the trade-offs of the proposal in detail. " * 40,
+    "model": "gpt-4o",
+    "analysis_model": "claude-3-sonnet-20240229",
+    "initial_response": "A long generated answer with several paragraphs of text. " * 400,
+    "ethical_analysis_text": "The response weighs duties against outcomes. " * 150,
+    "ethical_scores": SCORES,
+    "alignment_metrics": {"human_ai_alignment": 0.82, "dimension_alignment": {dim: 0.8 for dim in SCORES}},
+    "friction_metrics": {"friction_score": 0.2, "trend": [0.1 * i for i in range(50)]},
+}
+
+
+def _report(label: str, seconds: float, iterations: int):
+    print(f"  {label:<32} {seconds / iterations * 1e6:10.1f} us/op")
+
+
+def main(iterations: int = 2000):
+    app = Flask(__name__)
+    body = dumps_json(PAYLOAD)
+    print(f"Serialization benchmark ({iterations} iterations, {len(body) / 1024:.0f} KiB JSON payload)")
+
+    with app.test_request_context():
+        _report("flask jsonify", timeit.timeit(lambda: jsonify(PAYLOAD).get_data(), number=iterations), iterations)
+
+    encoders = [("stdlib", False)] + ([("orjson", True)] if serialization.orjson is not None else [])
+    for name, use_orjson in encoders:
+        serialization._use_orjson = use_orjson
+        _report(f"dumps_json ({name})", timeit.timeit(lambda: dumps_json(PAYLOAD), number=iterations), iterations)
+    _report("json.loads (stdlib)", timeit.timeit(lambda: json.loads(body), number=iterations), iterations)
+    if serialization.orjson is not None:
+        _report("orjson.loads", timeit.timeit(lambda: serialization.orjson.loads(body), number=iterations), iterations)
+
+    if serialization.msgpack is None:
+        print("  msgpack not installed; skipping msgpack encoding")
+        return
+    packed = dumps_msgpack(PAYLOAD)
+    _report(f"dumps_msgpack ({len(packed) / 1024:.0f} KiB)",
+            timeit.timeit(lambda: dumps_msgpack(PAYLOAD), number=iterations), iterations)
+    _report("msgpack.unpackb", timeit.timeit(lambda: serialization.msgpack.unpackb(packed), number=iterations), iterations)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
+'''
+
+# ============================================================================
+# 32. modules/bulk_alignment.py - streaming alignment re-scoring and JSONL CLI
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'bulk_alignment.py')] = '''\
+"""Alignment re-scoring for single records and NDJSON/JSONL streams.
+
+``check_alignment_record`` is the whole of POST /api/check_alignment: it
+validates one ``{prompt, response, ethical_scores}`` record and runs
+``analyze_alignment`` (plus ``measure_friction`` when ai_welfare scores are
+given). ``iter_bulk_results`` applies it to a stream of raw JSON lines on an
+executor. It keeps at most ``max_in_flight`` records pending and yields
+``{"index", "status", "result"}`` lines as they complete, so memory use does not
+grow with the size of the input.
+
+The offline CLI reads and writes JSONL files directly:
+    python -m backend.app.modules.bulk_alignment archive.jsonl rescored.jsonl --workers 8
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from backend.app.modules.history_store import analyze_alignment, measure_friction
+from backend.app.modules.score_schema import validate_ethical_scores
+from backend.app.modules.serialization import dumps_json, loads_json
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+
+def check_alignment_record(data: Any, record_history: bool = True) -> Tuple[Dict[str, Any], int]:
+    """Validates and scores one record. Returns (payload, HTTP status)."""
+    if not data:
+        return {"error": "No JSON data received"}, 400
+    if not isinstance(data, dict):
+        return {"error": "Record must be a JSON object"}, 400
+
+    prompt = data.get('prompt')
+    response = data.get('response')
+    ethical_scores = data.get('ethical_scores')
+
+    if not prompt or not isinstance(prompt, str) or not prompt.strip():
+        return {"error": "Invalid or missing 'prompt' provided"}, 400
+
+    if not response or not isinstance(response, str) or not response.strip():
+        return {"error": "Invalid or missing 'response' provided"}, 400
+
+    if ethical_scores is not None:
+        # Any subset of dimensions may be supplied, but what is present must be valid
+        ethical_scores, schema_errors = validate_ethical_scores(
+            ethical_scores, require_dimensions=False, path="ethical_scores"
+        )
+        if schema_errors:
+            return {"error": "Invalid 'ethical_scores' provided", "details": schema_errors}, 400
+
+    try:
+        alignment_metrics = analyze_alignment(
+            prompt.strip(), response.strip(), ethical_scores, record_history=record_history
+        )
+
+        result = {
+            "alignment_metrics": alignment_metrics,
+        }
+
+        # If ethical scores with AI welfare are provided, also compute friction metrics
+        if ethical_scores and isinstance(ethical_scores, dict):
+            ai_welfare_data = ethical_scores.get("ai_welfare")
+            if ai_welfare_data:
+                result["friction_metrics"] = measure_friction(
+                    prompt.strip(), response.strip(), ai_welfare_data, record_history=record_history
+                )
+        return result, 200
+
+    except Exception as e:
+        logger.error(f"check_alignment: Error computing alignment: {e}", exc_info=True)
+        return {"error": f"Error computing alignment: {str(e)}"}, 500
+
+
+def score_line(index: int, raw_line: bytes, record_history: bool = True) -> Dict[str, Any]:
+    """Decodes and scores one NDJSON line; an "id" field on the record is echoed back."""
+    try:
+        record = loads_json(raw_line)
+    except ValueError as e:
+        return {"index": index, "status": 400, "result": {"error": f"Invalid JSON record: {e}"}}
+    payload, status = check_alignment_record(record, record_history)
+    line = {"index": index, "status": status, "result": payload}
+    if isinstance(record, dict) and "id" in record:
+        line["id"] = record["id"]
+    return line
+
+
+def iter_records(lines: Iterable[bytes]) -> Iterator[Tuple[int, bytes]]:
+    """Numbers the non-blank lines of an NDJSON stream from 0."""
+    index = 0
+    for raw_line in lines:
+        if raw_line.strip():
+            yield index, raw_line
+            index += 1
+
+
+def iter_bulk_results(lines: Iterable[bytes],
+                      executor: Executor,
+                      max_in_flight: int = 64,
+                      ordered: bool = False,
+                      record_history: bool = True) -> Iterator[Dict[str, Any]]:
+    """Scores NDJSON lines on ``executor`` and yields result lines.
+
+    Input is pulled only while fewer than max_in_flight records are pending.
+    Results come in completion order, or input order with ordered=True (a
+    slow record then holds back the ones after it).
+    """
+    records = iter_records(lines)
+    pending = deque()
+    exhausted = False
+    while True:
+        while not exhausted and len(pending) < max_in_flight:
+            item = next(records, None)
+            if item is None:
+                exhausted = True
+                break
+            pending.append(executor.submit(score_line, item[0], item[1], record_history))
+        if not pending:
+            return
+        if ordered:
+            yield pending.popleft().result()
+            continue
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.remove(future)
+            yield future.result()
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Re-score {prompt, response, ethical_scores} JSONL records offline.")
+    parser.add_argument("input", help="JSONL file to read, or - for stdin")
+    parser.add_argument("output", help="JSONL file to write, or - for stdout")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--processes", action="store_true",
+                        help="score in worker processes instead of threads (the alignment detector is CPU-bound)")
+    parser.add_argument("--ordered", action="store_true", help="write results in input order")
+    parser.add_argument("--record-history", action="store_true",
+                        help="record samples in the configured history backend (only a shared SQLite backend keeps them)")
+    args = parser.parse_args(argv)
+
+    workers = max(1, args.workers)
+    executor_class = ProcessPoolExecutor if args.processes else ThreadPoolExecutor
+    source = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    sink = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    statuses: Counter = Counter()
+    start = time.perf_counter()
+    try:
+        with executor_class(max_workers=workers) as executor:
+            for line in iter_bulk_results(source, executor, max_in_flight=workers * 4,
+                                          ordered=args.ordered, record_history=args.record_history):
+                statuses[line["status"]] += 1
+                sink.write(dumps_json(line) + b"\\n")
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+        if sink is not sys.stdout.buffer:
+            sink.close()
+        else:
+            sink.flush()
+
+    total = sum(statuses.values())
+    elapsed = time.perf_counter() - start
+    summary = ", ".join(f"{status}: {amount}" for status, amount in sorted(statuses.items()))
+    print(f"Scored {total} records in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f}/s) - {summary or 'no records'}",
+          file=sys.stderr)
+    return 0 if statuses.keys() <= {200} else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+'''
+
+# ============================================================================
+# 33. modules/interaction_store.py - structured, indexed interaction log
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'interaction_store.py')] = '''\
+"""Append-only, indexed store of completed analyses.
+
+Every successful /api/analyze (plain or streamed) appends one row holding the
+prompt, both models, the R1 response, the R2 analysis text, scores, alignment
+and friction metrics, stage timings and a timestamp. Rows live in SQLite (WAL
+mode, so every worker process can append to the same file), with indexes on
+time, on each model, and on the friction and alignment scores.
+
+Writes go through a background batch writer, so requests never wait on disk.
+``query`` serves range queries; ``iter_interactions`` pages through any
+number of rows in constant memory for export and offline replay. The CLI
+exports to JSONL:
+
+    python -m backend.app.modules.interaction_store --model gpt-4o --min-friction 0.7 --since 7d > out.jsonl
+
+INTERACTION_STORE_ENABLED=0 turns the store off; INTERACTION_STORE_PATH,
+INTERACTION_STORE_QUEUE_SIZE and INTERACTION_STORE_FULL_POLICY tune it.
+
+The plain-text prompt log (context/prompts.txt, written through
+api_config.log_prompt) is a second sink of ``record_interaction``: it keeps
+receiving every prompt whether or not the SQLite store is on, unless
+PROMPT_LOG_ENABLED=0. The PROMPT_LOG_* variables in api_config tune it.
+"""
+
+import os
+import sys
+import time
+import atexit
+import sqlite3
+import logging
+import argparse
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from backend.app.api_config import PROMPT_LOG_ENABLED_ENV, _env_number, log_prompt
+from backend.app.modules.log_sink import DROP, BackgroundBatchWriter
+from backend.app.modules.serialization import dumps_json, loads_json
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+INTERACTION_STORE_ENABLED_ENV = "INTERACTION_STORE_ENABLED"
+INTERACTION_STORE_PATH_ENV = "INTERACTION_STORE_PATH"
+INTERACTION_STORE_QUEUE_SIZE_ENV = "INTERACTION_STORE_QUEUE_SIZE"
+INTERACTION_STORE_FULL_POLICY_ENV = "INTERACTION_STORE_FULL_POLICY"
+DEFAULT_INTERACTION_STORE_PATH = "context/interactions.sqlite3"
+
+_COLUMNS = (
+    "ts", "prompt", "model", "analysis_model", "initial_response", "ethical_analysis_text",
+    "ethical_scores", "alignment_metrics", "friction_metrics", "timings", "friction_score", "alignment_score",
+)
+_JSON_COLUMNS = ("ethical_scores", "alignment_metrics", "friction_metrics", "timings")
+# Columns left out of query results unless include_outputs=True
+_OUTPUT_COLUMNS = ("initial_response", "ethical_analysis_text")
+
+Row = Tuple[Any, ...]
+
+
+def _numeric(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+
+def _json_column(value: Any) -> Optional[str]:
+    return None if value is None else dumps_json(value).decode("utf-8")
+
+
+class _InteractionWriter(BackgroundBatchWriter):
+    """Writer thread that inserts queued rows in one transaction per batch."""
+
+    def __init__(self, store: "InteractionStore", **writer_kwargs):
+        super().__init__(f"interactions:{store.path}", **writer_kwargs)
+        self._store = store
+
+    def _write_batch(self, rows: List[Row]):
+        self._store._append(rows)
+
+
+class InteractionStore:
+    """SQLite-backed interaction log shared by every process that opens the same file."""
+
+    def __init__(self, path: str, max_queue: int = 10000, full_policy: str = DROP):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS interactions ("
+            "id INTEGER PRIMARY KEY, ts REAL NOT NULL, prompt TEXT NOT NULL, model TEXT, analysis_model TEXT, "
+            "initial_response TEXT, ethical_analysis_text TEXT, ethical_scores TEXT, alignment_metrics TEXT, "
+            "friction_metrics TEXT, timings TEXT, friction_score REAL, alignment_score REAL)"
+        )
+        for name, columns in (
+            ("ts", "ts, id"),
+            ("model_ts", "model, ts"),
+            ("analysis_model_ts", "analysis_model, ts"),
+            ("friction_score", "friction_score"),
+            ("alignment_score", "alignment_score"),
+        ):
+            connection.execute(f"CREATE INDEX IF NOT EXISTS interactions_{name} ON interactions ({columns})")
+        self._writer = _InteractionWriter(self, max_queue=max_queue, full_policy=full_policy)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    # --- Writing ---
+
+    def record(self, payload: Dict[str, Any], timings: Optional[Dict[str, Any]] = None,
+               timestamp: Optional[float] = None) -> bool:
+        """Queues one /api/analyze success payload. Returns False if the queue dropped it."""
+        friction_metrics = payload.get("friction_metrics")
+        ethical_scores = payload.get("ethical_scores")
+        friction_score = _numeric(friction_metrics.get("friction_score")) if isinstance(friction_metrics, dict) else None
+        if friction_score is None and isinstance(ethical_scores, dict) and isinstance(ethical_scores.get("ai_welfare"), dict):
+            friction_score = _numeric(ethical_scores["ai_welfare"].get("friction_score"))
+        alignment_metrics = payload.get("alignment_metrics")
+        alignment_score = _numeric(alignment_metrics.get("human_ai_alignment")) if isinstance(alignment_metrics, dict) else None
+
+        row = (
+            time.time() if timestamp is None else timestamp,
+            payload.get("prompt") or "",
+            payload.get("model"),
+            payload.get("analysis_model"),
+            payload.get("initial_response"),
+            payload.get("ethical_analysis_text"),
+            _json_column(ethical_scores),
+            _json_column(alignment_metrics),
+            _json_column(friction_metrics),
+            _json_column(timings),
+            friction_score,
+            alignment_score,
+        )
+        return self._writer.submit(row)
+
+    def flush(self, timeout: Optional[float] = 5.0) -> bool:
+        return self._writer.flush(timeout)
+
+    def close(self):
+        self._writer.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._writer.stats()
+
+    def _append(self, rows: List[Row]):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                f"INSERT INTO interactions ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})", rows
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    # --- Reading ---
+
+    def query(self,
+              since: Optional[float] = None,
+              until: Optional[float] = None,
+              model: Optional[str] = None,
+              analysis_model: Optional[str] = None,
+              min_friction: Optional[float] = None,
+              max_friction: Optional[float] = None,
+              min_alignment: Optional[float] = None,
+              max_alignment: Optional[float] = None,
+              limit: int = 100,
+              after: Optional[Tuple[float, int]] = None,
+              include_outputs: bool = True) -> List[Dict[str, Any]]:
+        """Rows matching every given bound, oldest first.
+
+        Time bounds are epoch seconds (since inclusive, until exclusive); score
+        bounds are inclusive. ``after`` is the (ts, id) of the last row of the
+        previous page. Rows without a friction or alignment score never match
+        a bound on that score.
+        """
+        clauses: List[str] = []
+        params: List[Any] = []
+        for column, operator, value in (
+            ("ts", ">=", since), ("ts", "<", until),
+            ("model", "=", model), ("analysis_model", "=", analysis_model),
+            ("friction_score", ">=", min_friction), ("friction_score", "<=", max_friction),
+            ("alignment_score", ">=", min_alignment), ("alignment_score", "<=", max_alignment),
+        ):
+            if value is not None:
+                clauses.append(f"{column} {operator} ?")
+                params.append(value)
+        if after is not None:
+            clauses.append("(ts > ? OR (ts = ? AND id > ?))")
+            params.extend((after[0], after[0], after[1]))
+
+        columns = ("id",) + tuple(column for column in _COLUMNS if include_outputs or column not in _OUTPUT_COLUMNS)
+        sql = f"SELECT {', '.join(columns)} FROM interactions"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY ts, id LIMIT ?"
+        params.append(max(0, int(limit)))
+
+        rows = []
+        for values in self._connection().execute(sql, params):
+            row = dict(zip(columns, values))
+            for column in _JSON_COLUMNS:
+                if row.get(column) is not None:
+                    row[column] = loads_json(row[column])
+            rows.append(row)
+        return rows
+
+    def iter_interactions(self, page_size: int = 500, **filters: Any) -> Iterator[Dict[str, Any]]:
+        """Every row matching ``filters`` (as for query), fetched page by page."""
+        filters.pop("limit", None)
+        after = filters.pop("after", None)
+        while True:
+            page = self.query(limit=page_size, after=after, **filters)
+            yield from page
+            if len(page) < page_size:
+                return
+            after = (page[-1]["ts"], page[-1]["id"])
+
+
+_interaction_store: Optional[InteractionStore] = None
+_interaction_store_checked = False
+_prompt_log_enabled = True
+_interaction_store_lock = threading.Lock()
+
+
+def get_interaction_store() -> Optional[InteractionStore]:
+    """Returns the process-wide store, or None when INTERACTION_STORE_ENABLED is 0/false."""
+    global _interaction_store, _interaction_store_checked, _prompt_log_enabled
+    if not _interaction_store_checked:
+        with _interaction_store_lock:
+            if not _interaction_store_checked:
+                _prompt_log_enabled = _env_flag(PROMPT_LOG_ENABLED_ENV)
+                if _env_flag(INTERACTION_STORE_ENABLED_ENV):
+                    path = os.getenv(INTERACTION_STORE_PATH_ENV) or DEFAULT_INTERACTION_STORE_PATH
+                    try:
+                        _interaction_store = InteractionStore(
+                            path,
+                            max_queue=_env_number(INTERACTION_STORE_QUEUE_SIZE_ENV, 10000, int),
+                            full_policy=os.getenv(INTERACTION_STORE_FULL_POLICY_ENV, DROP).strip().lower(),
+                        )
+                        atexit.register(_interaction_store.close)
+                        logger.info(f"Interaction store: SQLite at {path}")
+                    except (sqlite3.Error, OSError, ValueError) as e:
+                        logger.error(f"Interaction store disabled: could not open {path}: {e}")
+                _interaction_store_checked = True
+    return _interaction_store
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def record_interaction(payload: Dict[str, Any], timings: Optional[Dict[str, Any]] = None):
+    """Appends an analysis to the store and its prompt to the prompt log; never raises into the request."""
+    store = get_interaction_store()
+    if _prompt_log_enabled:
+        log_prompt(payload.get("prompt") or "", f"R1: {payload.get('model')}, R2: {payload.get('analysis_model')}")
+    if store is None:
+        return
+    try:
+        if not store.record(payload, timings):
+            logger.warning("Interaction store queue is full; dropped interaction record.")
+    except Exception as e:
+        logger.error(f"Error recording interaction: {e}")
+
+
+# --- Export CLI ---
+
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def _parse_time(value: str) -> float:
+    """Epoch seconds, ISO 8601, or a duration ago such as 90m, 12h or 7d."""
+    value = value.strip()
+    if value[-1:].lower() in _DURATION_UNITS:
+        try:
+            return time.time() - float(value[:-1]) * _DURATION_UNITS[value[-1].lower()]
+        except ValueError:
+            pass
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export stored interactions as JSONL (oldest first).")
+    parser.add_argument("--path", default=os.getenv(INTERACTION_STORE_PATH_ENV) or DEFAULT_INTERACTION_STORE_PATH)
+    parser.add_argument("--since", type=_parse_time, help="epoch seconds, ISO 8601, or a duration ago (7d, 12h)")
+    parser.add_argument("--until", type=_parse_time)
+    parser.add_argument("--model")
+    parser.add_argument("--analysis-model")
+    parser.add_argument("--min-friction", type=float)
+    parser.add_argument("--max-friction", type=float)
+    parser.add_argument("--min-alignment", type=float)
+    parser.add_argument("--max-alignment", type=float)
+    parser.add_argument("--no-outputs", action="store_true", help="omit the R1 response and R2 analysis text")
+    parser.add_argument("--output", default="-", help="file to write, or - for stdout")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.path):
+        print(f"No interaction store at {args.path}", file=sys.stderr)
+        return 1
+    store = InteractionStore(args.path)
+    sink = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    exported = 0
+    try:
+        for row in store.iter_interactions(
+            since=args.since, until=args.until, model=args.model, analysis_model=args.analysis_model,
+            min_friction=args.min_friction, max_friction=args.max_friction,
+            min_alignment=args.min_alignment, max_alignment=args.max_alignment,
+            include_outputs=not args.no_outputs,
+        ):
+            sink.write(dumps_json(row) + b"\\n")
+            exported += 1
+    finally:
+        if sink is not sys.stdout.buffer:
+            sink.close()
+        else:
+            sink.flush()
+    print(f"Exported {exported} interactions", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+'''
+
+# ============================================================================
+# 34. preload.py - pre-fork preloading of shared state
+# ============================================================================
+files_to_create[os.path.join(BASE, 'preload.py')] = '''\
+"""Builds shared, read-mostly state before worker processes are forked.
+
+With APP_PRELOAD=1 (or ``create_app(preload=True)``), ``create_app`` imports the
+provider SDKs and the analysis modules, builds the provider registry, loads the
+ontology, and constructs the friction monitor, alignment detector and
+multi-agent singletons. Under a pre-forking server the workers then inherit all
+of this copy-on-write instead of each building a private copy on its first
+request:
+
+    APP_PRELOAD=1 gunicorn --preload -w 4 "backend.app:create_app()"
+
+Afterwards ``gc.freeze()`` moves the preloaded objects out of the collector's
+generations. The workers' garbage collections then do not write to those
+objects, so the shared pages are not copied.
+
+State that holds sockets, SQLite connections or threads is still built per
+process after the fork. That covers the HTTP client pool, the LLM result cache,
+the history and interaction stores, and the job manager; each checks the pid
+and rebuilds what it inherited.
+"""
+
+import os
+import gc
+import time
+import logging
+import importlib
+from typing import Callable, Dict, Optional
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+APP_PRELOAD_ENV = "APP_PRELOAD"
+# Modules the request paths import lazily or that pull in heavy dependencies
+PRELOAD_MODULES = (
+    "backend.app.modules.llm_interface",
+    "backend.app.modules.friction_monitor",
+    "backend.app.modules.alignment_detector",
+    "backend.app.modules.multi_agent_alignment",
+    "backend.app.modules.consensus_matrix",
+)
+
+
+def preload_enabled() -> bool:
+    return os.getenv(APP_PRELOAD_ENV, "0").strip().lower() not in ("", "0", "false", "no", "off")
+
+
+def _build_singletons() -> Dict[str, Callable[[], object]]:
+    from backend.app.api_config import get_config_snapshot, preload_ontology
+    from backend.app.modules.friction_monitor import get_friction_monitor
+    from backend.app.modules.alignment_detector import get_alignment_detector
+    from backend.app.modules.multi_agent_alignment import get_multi_agent_alignment
+
+    return {
+        "config_snapshot": get_config_snapshot,
+        "ontology": preload_ontology,
+        "friction_monitor": get_friction_monitor,
+        "alignment_detector": get_alignment_detector,
+        "multi_agent_alignment": get_multi_agent_alignment,
+    }
+
+
+def preload_app_state(freeze: bool = True) -> Dict[str, float]:
+    """Imports PRELOAD_MODULES and builds the shared singletons.
+
+    Returns the seconds spent per module and per singleton. A step that fails
+    is logged and skipped; that object is then built lazily as usual.
+    """
+    timings: Dict[str, float] = {}
+    for module_name in PRELOAD_MODULES:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(module_name)
+        except ImportError as e:
+            logger.warning(f"Preload: could not import {module_name}: {e}")
+            continue
+        timings[f"import:{module_name.rsplit('.', 1)[-1]}"] = time.perf_counter() - start
+
+    for name, build in _build_singletons().items():
+        start = time.perf_counter()
+        try:
+            build()
+        except Exception as e:
+            logger.warning(f"Preload: could not build {name}: {e}")
+            continue
+        timings[name] = time.perf_counter() - start
+
+    if freeze:
+        gc.collect()
+        gc.freeze()
+    logger.info("Preloaded app state in "
+                f"{sum(timings.values()) * 1000:.1f} ms: "
+                + ", ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in timings.items()))
+    return timings
+
+
+def maybe_preload(preload: Optional[bool] = None) -> Optional[Dict[str, float]]:
+    """Runs preload_app_state when ``preload`` is True, or when it is None and APP_PRELOAD is set."""
+    if preload is None:
+        preload = preload_enabled()
+    return preload_app_state() if preload else None
+'''
+
+# ============================================================================
+# 35. benchmarks/bench_startup.py - import time and time-to-first-response benchmark
+# ============================================================================
+files_to_create[os.path.join(BENCHMARKS, 'bench_startup.py')] = '''\
+"""Benchmark: import time per module and time to first response, with and without preload.
+
+Every measurement runs in a fresh interpreter, so nothing is already imported.
+
+- Import times come from ``python -X importtime`` while building the app.
+  The report lists the backend modules and the slowest third-party packages,
+  by cumulative time.
+- Time to first response is measured the way a pre-forking server sees it.
+  The parent calls ``create_app(preload=...)`` and forks, and the child times
+  its first and second POST /api/check_alignment. That endpoint runs the
+  alignment detector and the friction monitor.
+
+Run from the repository root:
+    python -m backend.app.benchmarks.bench_startup [--runs 3] [--top 15]
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+from statistics import median
+from typing import Dict, List, Tuple
+
+# Provider SDKs are imported, but nothing is called; a configured provider is enough
+os.environ.setdefault("OPENAI_API_KEY", "benchmark-key")
+
+APP_PACKAGE = "backend.app"
+FIRST_REQUEST = {
+    "prompt": "Should the assistant disclose its limitations?",
+    "response": "Yes. It should state clearly what it cannot do.",
+    "ethical_scores": {"ai_welfare": {"friction_score": 0.2, "voluntary_alignment": 0.9, "dignity_respect": 0.9,
+                                      "justification": "Low friction."}},
+}
+
+# Runs in the child interpreter; prints one JSON line of millisecond timings
+_FIRST_RESPONSE_SCRIPT = """
+import os, sys, json, time
+start = time.perf_counter()
+from backend.app import create_app
+app = create_app(preload=sys.argv[1] == "1")
+create_app_ms = (time.perf_counter() - start) * 1000
+read_end, write_end = os.pipe()
+pid = os.fork()
+if pid == 0:
+    os.close(read_end)
+    client = app.test_client()
+    timings = {}
+    for name in ("first_ms", "second_ms"):
+        request_start = time.perf_counter()
+        status = client.post("/api/check_alignment", json=json.loads(sys.argv[2])).status_code
+        timings[name] = (time.perf_counter() - request_start) * 1000
+    timings["status"] = status
+    os.write(write_end, json.dumps(timings).encode())
+    os._exit(0)
+os.close(write_end)
+child = json.loads(os.read(read_end, 65536))
+os.waitpid(pid, 0)
+print(json.dumps(dict(child, create_app_ms=create_app_ms)))
+"""
+
+
+def _run_python(args: List[str]) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable] + args, capture_output=True, text=True, check=True)
+
+
+def import_times() -> List[Tuple[str, float, float]]:
+    """(module, self ms, cumulative ms) for every module imported while building the app."""
+    result = _run_python(["-X", "importtime", "-c", "from backend.app import create_app; create_app(preload=True)"])
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            self_us, cumulative_us, module = (part.strip() for part in line[len("import time:"):].split("|"))
+            rows.append((module, int(self_us) / 1000, int(cumulative_us) / 1000))
+        except ValueError:
+            continue  # the header row
+    return rows
+
+
+def first_response(preload: bool) -> Dict[str, float]:
+    result = _run_python(["-c", _FIRST_RESPONSE_SCRIPT, "1" if preload else "0", json.dumps(FIRST_REQUEST)])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters per preload setting")
+    parser.add_argument("--top", type=int, default=15, help="slowest third-party imports to list")
+    args = parser.parse_args(argv)
+    if not hasattr(os, "fork"):
+        print("This benchmark needs os.fork (POSIX only).", file=sys.stderr)
+        return 1
+
+    rows = import_times()
+    backend_rows = [row for row in rows if row[0].startswith(APP_PACKAGE)]
+    # Top-level third-party packages only; their submodules are included in the cumulative time
+    external_rows = sorted((row for row in rows if "." not in row[0] and not row[0].startswith("backend")),
+                           key=lambda row: row[2], reverse=True)[:args.top]
+    print("Import time while building the app (ms)")
+    print(f"  {'module':<52} {'self':>9} {'cumulative':>11}")
+    for module, self_ms, cumulative_ms in sorted(backend_rows, key=lambda row: row[2], reverse=True) + external_rows:
+        print(f"  {module:<52} {self_ms:9.1f} {cumulative_ms:11.1f}")
+
+    print(f"\\nTime to first response in a forked worker (median of {args.runs} runs, ms)")
+    print(f"  {'mode':<10} {'create_app':>11} {'1st request':>12} {'2nd request':>12}")
+    for preload in (False, True):
+        runs = [first_response(preload) for _ in range(max(1, args.runs))]
+        if any(run["status"] != 200 for run in runs):
+            print(f"  preload={preload}: /api/check_alignment returned {runs[0]['status']}; aborting", file=sys.stderr)
+            return 1
+        print(f"  {'preload' if preload else 'lazy':<10} "
+              f"{median(run['create_app_ms'] for run in runs):11.1f} "
+              f"{median(run['first_ms'] for run in runs):12.1f} "
+              f"{median(run['second_ms'] for run in runs):12.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+'''
+
+# ============================================================================
+# 36. modules/model_routing.py - latency-aware R1 routing and hedging
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'model_routing.py')] = '''\
+"""Latency-aware choice of the R1 model, with hedged R1 requests.
+
+Every upstream R1 call (cache hits excluded) is recorded per model: its
+latency and whether it failed. Only the last LATENCY_ROUTING_WINDOW calls
+and calls from the last LATENCY_ROUTING_MAX_AGE_SECONDS count. When a
+request does not pin ``origin_model`` (nor an origin key or endpoint), the
+router picks the R1 model from the models that have a server-side key:
+
+- A model with fewer than LATENCY_ROUTING_MIN_SAMPLES recent calls is tried
+  first, so every model gets measured and a slow or failing model is retried
+  after its samples age out.
+- Otherwise the model with the lowest p95 / (1 - error rate) wins.
+
+If the chosen model has not answered after its own p95 (or
+LATENCY_ROUTING_HEDGE_DELAY_MS before it has enough samples), a duplicate R1
+request goes to the best-ranked model of another provider. It is also sent
+at once when the first call fails. Only a model whose server-side config
+resolves is used as a hedge. The first successful response is kept and the
+other attempt is told to stop: it is dropped if it has not started yet, and
+otherwise raises AttemptCancelled at its next ``check_cancelled`` (before the
+rate-limit wait, before taking a provider slot and before the upstream
+request). An upstream request already in flight cannot be interrupted; it
+finishes in the background, still counts against the provider's quota and
+rate limits, and its result is discarded.
+Streamed analyses use the chosen model but are not hedged.
+
+Routing is opt-in: set LATENCY_ROUTING_ENABLED=1. LATENCY_ROUTING_MODELS
+(comma-separated) narrows the candidates. LATENCY_ROUTING_HEDGE=0 keeps the
+routing but never hedges.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from backend.app.api_config import _env_number, get_config_snapshot
+from backend.app.modules.metrics import count
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+LATENCY_ROUTING_ENABLED_ENV = "LATENCY_ROUTING_ENABLED"
+LATENCY_ROUTING_MODELS_ENV = "LATENCY_ROUTING_MODELS"
+LATENCY_ROUTING_WINDOW_ENV = "LATENCY_ROUTING_WINDOW"
+LATENCY_ROUTING_MAX_AGE_ENV = "LATENCY_ROUTING_MAX_AGE_SECONDS"
+LATENCY_ROUTING_MIN_SAMPLES_ENV = "LATENCY_ROUTING_MIN_SAMPLES"
+LATENCY_ROUTING_HEDGE_ENV = "LATENCY_ROUTING_HEDGE"
+LATENCY_ROUTING_HEDGE_DELAY_MS_ENV = "LATENCY_ROUTING_HEDGE_DELAY_MS"
+LATENCY_ROUTING_HEDGE_MIN_DELAY_MS_ENV = "LATENCY_ROUTING_HEDGE_MIN_DELAY_MS"
+LATENCY_ROUTING_HEDGE_THREADS_ENV = "LATENCY_ROUTING_HEDGE_THREADS"
+
+# Outcome of one attempt: (response, extra) where a None response means the call failed
+Attempt = Tuple[Optional[str], Any]
+
+
+class AttemptCancelled(Exception):
+    """Raised inside a hedged attempt once the other attempt has won."""
+
+
+def check_cancelled(cancelled: Optional[threading.Event]):
+    """Raises AttemptCancelled if run_hedged has told this attempt to stop."""
+    if cancelled is not None and cancelled.is_set():
+        raise AttemptCancelled()
+
+
+def _is_disabled(value: str) -> bool:
+    return value.strip().lower() in ("0", "false", "no", "off")
+
+
+class ModelStats(NamedTuple):
+    samples: int
+    p50: Optional[float]
+    p95: Optional[float]
+    error_rate: float
+
+
+def _percentile(sorted_values: Sequence[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class LatencyTracker:
+    """Rolling per-model latency and error samples."""
+
+    def __init__(self, window: int = 100, max_age: float = 300.0):
+        self.window = max(1, window)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[Tuple[float, float, bool]]] = {}
+
+    def record(self, model: str, seconds: float, ok: bool):
+        with self._lock:
+            samples = self._samples.get(model)
+            if samples is None:
+                samples = self._samples[model] = deque(maxlen=self.window)
+            samples.append((time.monotonic(), seconds, ok))
+
+    def stats(self, model: str) -> ModelStats:
+        horizon = time.monotonic() - self.max_age
+        with self._lock:
+            samples = self._samples.get(model)
+            if samples:
+                while samples and samples[0][0] < horizon:
+                    samples.popleft()
+            recent = list(samples) if samples else []
+        if not recent:
+            return ModelStats(0, None, None, 0.0)
+        latencies = sorted(seconds for _, seconds, ok in recent if ok)
+        failures = sum(1 for _, _, ok in recent if not ok)
+        return ModelStats(len(recent), _percentile(latencies, 0.5), _percentile(latencies, 0.95), failures / len(recent))
+
+    def models(self) -> List[str]:
+        with self._lock:
+            return list(self._samples)
+
+
+class RoutePlan(NamedTuple):
+    primary: str
+    hedge: Optional[str]
+    hedge_delay: Optional[float]
+
+
+class LatencyRouter:
+    """Ranks R1 candidate models by recent latency and error rate."""
+
+    def __init__(self,
+                 tracker: LatencyTracker,
+                 allowed_models: Optional[Sequence[str]] = None,
+                 min_samples: int = 5,
+                 hedge: bool = True,
+                 hedge_delay: float = 2.0,
+                 min_hedge_delay: float = 0.05,
+                 hedge_threads: int = 64):
+        self.tracker = tracker
+        self.allowed_models = list(allowed_models) if allowed_models else None
+        self.min_samples = max(1, min_samples)
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self._executor = ThreadPoolExecutor(max_workers=max(2, hedge_threads), thread_name_prefix="r1-hedge")
+
+    def candidates(self) -> List[str]:
+        """Registered models with a server-side origin key, narrowed by LATENCY_ROUTING_MODELS."""
+        registered = get_config_snapshot().models
+        models = self.allowed_models if self.allowed_models is not None else list(registered)
+        return [model for model in models if model in registered and registered[model].origin_api_key]
+
+    def rank(self, models: Sequence[str]) -> List[str]:
+        def cost(model: str) -> Tuple[int, float]:
+            stats = self.tracker.stats(model)
+            if stats.samples < self.min_samples:
+                return 0, stats.samples
+            if stats.p95 is None or stats.error_rate >= 1.0:
+                return 2, stats.error_rate
+            return 1, stats.p95 / (1.0 - stats.error_rate)
+
+        return sorted(models, key=cost)
+
+    def plan(self) -> Optional[RoutePlan]:
+        """The R1 model to use and, if hedging applies, the hedge model and delay; None without candidates."""
+        ranked = self.rank(self.candidates())
+        if not ranked:
+            return None
+        primary = ranked[0]
+        if not self.hedge:
+            return RoutePlan(primary, None, None)
+
+        registered = get_config_snapshot().models
+        primary_provider = registered[primary].spec.name
+        hedge = next((model for model in ranked[1:] if registered[model].spec.name != primary_provider), None)
+        if hedge is None:
+            return RoutePlan(primary, None, None)
+        stats = self.tracker.stats(primary)
+        delay = stats.p95 if stats.samples >= self.min_samples and stats.p95 is not None else self.hedge_delay
+        return RoutePlan(primary, hedge, max(self.min_hedge_delay, delay))
+
+    def observe(self, model: str, seconds: float, ok: bool):
+        self.tracker.record(model, seconds, ok)
+
+    def stats(self) -> Dict[str, ModelStats]:
+        return {model: self.tracker.stats(model) for model in self.tracker.models()}
+
+    # --- Hedged execution ---
+
+    def run_hedged(self, plan: RoutePlan,
+                   attempt: Callable[[str, threading.Event], Attempt]) -> Tuple[str, Attempt, bool]:
+        """Runs attempt(plan.primary, cancelled), hedging with attempt(plan.hedge, cancelled).
+
+        Each attempt gets its own event, set once the other attempt has won;
+        the attempt should pass it to check_cancelled before each costly
+        step. Returns (model, outcome, hedged).
+        """
+        cancelled = {plan.primary: threading.Event(), plan.hedge: threading.Event()}
+        primary = self._executor.submit(attempt, plan.primary, cancelled[plan.primary])
+        try:
+            primary.result(timeout=plan.hedge_delay)
+        except Exception:
+            pass  # still running, or raised: either way the hedge goes out
+        if primary.done() and _succeeded(primary):
+            return plan.primary, primary.result(), False
+
+        count("r1_hedges_total", outcome="sent")
+        hedge = self._executor.submit(attempt, plan.hedge, cancelled[plan.hedge])
+        futures = {primary: plan.primary, hedge: plan.hedge}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if _succeeded(future):
+                    for other in pending:
+                        other.cancel()
+                        cancelled[futures[other]].set()
+                    count("r1_hedges_total", outcome="won" if future is hedge else "lost")
+                    return futures[future], future.result(), True
+        count("r1_hedges_total", outcome="failed")
+        # Both failed: report the primary's failure (re-raising its exception, if any)
+        return plan.primary, primary.result(), True
+
+    async def arun_hedged(self, plan: RoutePlan,
+                          attempt: Callable[[str], Awaitable[Attempt]]) -> Tuple[str, Attempt, bool]:
+        """Awaitable run_hedged; the losing attempt's task is cancelled."""
+        primary = asyncio.ensure_future(attempt(plan.primary))
+        tasks = {primary: plan.primary}
+        try:
+            await asyncio.wait({primary}, timeout=plan.hedge_delay)
+            if primary.done() and _succeeded(primary):
+                return plan.primary, primary.result(), False
+
+            count("r1_hedges_total", outcome="sent")
+            hedge = asyncio.ensure_future(attempt(plan.hedge))
+            tasks[hedge] = plan.hedge
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if _succeeded(task):
+                        count("r1_hedges_total", outcome="won" if task is hedge else "lost")
+                        return tasks[task], task.result(), True
+            count("r1_hedges_total", outcome="failed")
+            return plan.primary, primary.result(), True
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
+def _succeeded(future: "Future") -> bool:
+    return not future.cancelled() and future.exception() is None and future.result()[0] is not None
+
+
+_router: Optional[LatencyRouter] = None
+_router_checked = False
+_router_lock = threading.Lock()
+
+
+def get_latency_router() -> Optional[LatencyRouter]:
+    """Returns the process-wide router, or None unless LATENCY_ROUTING_ENABLED is set."""
+    global _router, _router_checked
+    if not _router_checked:
+        with _router_lock:
+            if not _router_checked:
+                if not _is_disabled(os.getenv(LATENCY_ROUTING_ENABLED_ENV, "0")):
+                    allowed = [model.strip() for model in os.getenv(LATENCY_ROUTING_MODELS_ENV, "").split(",") if model.strip()]
+                    _router = LatencyRouter(
+                        LatencyTracker(
+                            window=_env_number(LATENCY_ROUTING_WINDOW_ENV, 100, int),
+                            max_age=_env_number(LATENCY_ROUTING_MAX_AGE_ENV, 300.0),
+                        ),
+                        allowed_models=allowed or None,
+                        min_samples=_env_number(LATENCY_ROUTING_MIN_SAMPLES_ENV, 5, int),
+                        hedge=not _is_disabled(os.getenv(LATENCY_ROUTING_HEDGE_ENV, "1")),
+                        hedge_delay=_env_number(LATENCY_ROUTING_HEDGE_DELAY_MS_ENV, 2000.0) / 1000,
+                        min_hedge_delay=_env_number(LATENCY_ROUTING_HEDGE_MIN_DELAY_MS_ENV, 50.0) / 1000,
+                        hedge_threads=_env_number(LATENCY_ROUTING_HEDGE_THREADS_ENV, 64, int),
+                    )
+                    logger.info(f"Latency routing enabled over {_router.candidates() or 'no'} candidate models")
+                _router_checked = True
+    return _router
+'''
+
+# ============================================================================
+# 37. modules/rate_limits.py - rate-limit-aware scheduling of upstream calls
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'rate_limits.py')] = '''\
+"""Rate-limit-aware scheduling of upstream LLM calls.
+
+Every R1/R2 call that reaches a provider first takes a reservation from the
+scheduler. Reservations are tracked per lane: one lane per (provider, API key
+fingerprint), because providers enforce quotas per key. A lane has two token
+buckets:
+
+- requests per minute: RATE_LIMIT_RPM, or RATE_LIMIT_<PROVIDER>_RPM for one
+  provider (e.g. RATE_LIMIT_OPENAI_RPM)
+- tokens per minute: RATE_LIMIT_TPM / RATE_LIMIT_<PROVIDER>_TPM. A call's
+  cost is estimated before it is sent: about 4 characters per input token
+  plus RATE_LIMIT_OUTPUT_TOKENS for the reply.
+
+An unset limit means that bucket never blocks. The limits are per process,
+so set them to the provider quota divided by the number of worker processes,
+less a few percent: a call is counted here when it is admitted and by the
+provider when it arrives.
+
+Calls that cannot go at once wait in a priority queue: interactive requests
+ahead of batch and job requests, R2 calls ahead of R1 calls of the same
+class, then first come, first served. A 429 from
+the provider (seen by the HTTP client pool, which carries R1 and R2 through
+the provider gateway) closes the lane until its Retry-After has passed, and
+the gateway answers further calls on a closed lane itself. A call that would wait longer than
+RATE_LIMIT_MAX_WAIT_SECONDS, or that finds RATE_LIMIT_MAX_QUEUE calls
+already waiting, fails at once with RateLimitExceeded. That exception
+carries an ETA, and the routes turn it into a 429 with Retry-After instead
+of a slow 502.
+
+RATE_LIMIT_ENABLED=0 turns the scheduler off.
+"""
+
+import os
+import math
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from backend.app.api_config import PROVIDER_SPECS, _env_number, get_provider_for_model
+from backend.app.modules.http_client_pool import key_fingerprint
+from backend.app.modules.metrics import count
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+RATE_LIMIT_ENABLED_ENV = "RATE_LIMIT_ENABLED"
+RATE_LIMIT_RPM_ENV = "RATE_LIMIT_RPM"
+RATE_LIMIT_TPM_ENV = "RATE_LIMIT_TPM"
+RATE_LIMIT_MAX_QUEUE_ENV = "RATE_LIMIT_MAX_QUEUE"
+RATE_LIMIT_MAX_WAIT_ENV = "RATE_LIMIT_MAX_WAIT_SECONDS"
+RATE_LIMIT_OUTPUT_TOKENS_ENV = "RATE_LIMIT_OUTPUT_TOKENS"
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+# Subtracted from a request's priority for its R2 call, so R2 goes ahead of
+# new R1 calls of the same class: the request's R1 budget is already spent
+FOLLOW_UP_BOOST = 1
+
+CHARS_PER_TOKEN = 4
+# How often an async waiter re-checks its lane
+_ASYNC_POLL_SECONDS = 0.02
+
+
+class RateLimitExceeded(Exception):
+    """Raised instead of queueing when a call could not be sent within the allowed wait."""
+
+    def __init__(self, provider: str, retry_after: float, reason: str):
+        super().__init__(f"Rate limit for provider '{provider}' reached ({reason}); retry in {retry_after:.1f}s")
+        self.provider = provider
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def estimate_tokens(*texts: Optional[str], output_tokens: int = 0) -> int:
+    """Rough token count of the given input texts plus the expected output."""
+    return sum(len(text) for text in texts if text) // CHARS_PER_TOKEN + output_tokens
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Continuously refilled bucket; ``rate_per_minute`` None means unlimited."""
+
+    def __init__(self, rate_per_minute: Optional[float]):
+        self.capacity = rate_per_minute
+        self.refill_per_second = rate_per_minute / 60.0 if rate_per_minute else None
+        self.tokens = rate_per_minute or 0.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if self.refill_per_second is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float, backlog: float = 0.0) -> float:
+        """Seconds until ``backlog + amount`` tokens are available (0 if they are now)."""
+        if self.refill_per_second is None:
+            return 0.0
+        self._refill(now)
+        # A single call larger than the whole bucket is admitted once the bucket is full
+        needed = min(self.capacity, amount) + backlog - self.tokens
+        return max(0.0, needed / self.refill_per_second)
+
+    def take(self, amount: float):
+        if self.refill_per_second is not None:
+            self.tokens -= min(self.capacity, amount)
+
+
+class _Waiter:
+    __slots__ = ("priority", "sequence", "tokens")
+
+    def __init__(self, priority: int, sequence: int, tokens: int):
+        self.priority = priority
+        self.sequence = sequence
+        self.tokens = tokens
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class _Lane:
+    """Buckets, Retry-After block and wait queue for one (provider, key)."""
+
+    def __init__(self, provider: str, rpm: Optional[float], tpm: Optional[float]):
+        self.provider = provider
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.blocked_until = 0.0
+        self.queue: List[_Waiter] = []
+        self.condition = threading.Condition()
+        self.admitted = 0
+        self.rejected = 0
+        self.upstream_429s = 0
+
+    def wait_time(self, tokens: int, now: float, queued_requests: int = 0, queued_tokens: int = 0) -> float:
+        return max(
+            self.blocked_until - now,
+            self.requests.wait_time(1, now, queued_requests),
+            self.tokens.wait_time(tokens, now, queued_tokens),
+        )
+
+    def take(self, tokens: int):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.admitted += 1
+
+
+class RateLimitScheduler:
+    """Admits upstream calls within per-(provider, key) RPM/TPM budgets."""
+
+    def __init__(self,
+                 limits: Mapping[str, Tuple[Optional[float], Optional[float]]],
+                 default_limits: Tuple[Optional[float], Optional[float]] = (None, None),
+                 max_queue: int = 64,
+                 max_wait: float = 10.0,
+                 output_tokens: int = 1024):
+        self.limits = dict(limits)
+        self.default_limits = default_limits
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max(0.0, max_wait)
+        self.output_tokens = output_tokens
+        self._lock = threading.Lock()
+        self._lanes: Dict[Tuple[str, str], _Lane] = {}
+        self._sequence = itertools.count()
+
+    def _lane(self, provider: str, api_key: Optional[str]) -> _Lane:
+        lane_key = (provider, key_fingerprint(api_key))
+        lane = self._lanes.get(lane_key)
+        if lane is None:
+            with self._lock:
+                lane = self._lanes.get(lane_key)
+                if lane is None:
+                    rpm, tpm = self.limits.get(provider, self.default_limits)
+                    lane = self._lanes[lane_key] = _Lane(provider, rpm, tpm)
+        return lane
+
+    # --- Admission ---
+
+    def _enqueue(self, lane: _Lane, tokens: int, priority: int) -> Tuple[_Waiter, float]:
+        """Queues a waiter (caller holds lane.condition); raises RateLimitExceeded if it may not wait."""
+        now = time.monotonic()
+        ahead = [waiter for waiter in lane.queue if waiter.priority <= priority]
+        eta = lane.wait_time(tokens, now, len(ahead), sum(waiter.tokens for waiter in ahead))
+        if eta > self.max_wait or (eta > 0 and len(lane.queue) >= self.max_queue):
+            lane.rejected += 1
+            count("rate_limit_rejections_total", provider=lane.provider,
+                  reason="queue_full" if eta <= self.max_wait else "wait_too_long")
+            raise RateLimitExceeded(lane.provider, eta,
+                                    "queue full" if eta <= self.max_wait else f"wait over {self.max_wait:g}s")
+        waiter = _Waiter(priority, next(self._sequence), tokens)
+        heapq.heappush(lane.queue, waiter)
+        return waiter, now + self.max_wait
+
+    def _try_admit(self, lane: _Lane, waiter: _Waiter) -> float:
+        """Admits the waiter if it is first in line and the budget allows. Returns 0, or seconds to wait."""
+        if lane.queue[0] is not waiter:
+            return self.max_wait
+        wait = lane.wait_time(waiter.tokens, time.monotonic())
+        if wait > 0:
+            return wait
+        heapq.heappop(lane.queue)
+        lane.take(waiter.tokens)
+        lane.condition.notify_all()
+        return 0.0
+
+    def _give_up(self, lane: _Lane, waiter: _Waiter):
+        lane.queue.remove(waiter)
+        heapq.heapify(lane.queue)
+        lane.rejected += 1
+        lane.condition.notify_all()
+        count("rate_limit_rejections_total", provider=lane.provider, reason="timeout")
+
+    def acquire(self, model: str, api_key: Optional[str], tokens: int, priority: int = PRIORITY_INTERACTIVE):
+        """Blocks until the call may be sent, or raises RateLimitExceeded."""
+        lane = self._lane(_provider_name(model), api_key)
+        start = time.monotonic()
+        with lane.condition:
+            waiter, deadline = self._enqueue(lane, tokens, priority)
+            while True:
+                wait = self._try_admit(lane, waiter)
+                if not wait:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._give_up(lane, waiter)
+                    raise RateLimitExceeded(lane.provider, lane.wait_time(tokens, time.monotonic()), "timed out in queue")
+                lane.condition.wait(min(wait, remaining))
+        _count_admission(lane, time.monotonic() - start)
+
+    async def aacquire(self, model: str, api_key: Optional[str], tokens: int, priority: int = PRIORITY_INTERACTIVE):
+        """Awaitable acquire: waits on the same queue without holding a thread."""
+        lane = self._lane(_provider_name(model), api_key)
+        start = time.monotonic()
+        with lane.condition:
+            waiter, deadline = self._enqueue(lane, tokens, priority)
+        try:
+            while True:
+                with lane.condition:
+                    wait = self._try_admit(lane, waiter)
+                    if not wait:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._give_up(lane, waiter)
+                        raise RateLimitExceeded(lane.provider, lane.wait_time(tokens, time.monotonic()), "timed out in queue")
+                await asyncio.sleep(min(wait, remaining, _ASYNC_POLL_SECONDS))
+        except asyncio.CancelledError:
+            with lane.condition:
+                if waiter in lane.queue:
+                    lane.queue.remove(waiter)
+                    heapq.heapify(lane.queue)
+                    lane.condition.notify_all()
+            raise
+        _count_admission(lane, time.monotonic() - start)
+
+    # --- Provider feedback ---
+
+    def note_rate_limited(self, provider: str, api_key: Optional[str], retry_after: Optional[float]):
+        """Closes the lane after an upstream 429 until Retry-After (1 s if the header is missing)."""
+        lane = self._lane(provider, api_key)
+        with lane.condition:
+            lane.upstream_429s += 1
+            lane.blocked_until = max(lane.blocked_until, time.monotonic() + (1.0 if retry_after is None else retry_after))
+        count("rate_limit_upstream_429_total", provider=provider)
+        logger.warning(f"Upstream 429 from {provider}; pausing its lane for {retry_after if retry_after is not None else 1.0:.1f}s")
+
+    def blocked_for(self, provider: str, api_key: Optional[str]) -> float:
+        """Seconds until the lane's Retry-After block ends; 0 when it is open."""
+        lane = self._lane(provider, api_key)
+        with lane.condition:
+            return max(0.0, lane.blocked_until - time.monotonic())
+
+    def stats(self) -> List[Dict[str, object]]:
+        now = time.monotonic()
+        with self._lock:
+            lanes = list(self._lanes.items())
+        result = []
+        for (provider, fingerprint), lane in lanes:
+            with lane.condition:
+                result.append({
+                    "provider": provider,
+                    "key_fingerprint": fingerprint,
+                    "queued": len(lane.queue),
+                    "admitted": lane.admitted,
+                    "rejected": lane.rejected,
+                    "upstream_429s": lane.upstream_429s,
+                    "blocked_for": round(max(0.0, lane.blocked_until - now), 3),
+                })
+        return result
+
+
+def _provider_name(model: str) -> str:
+    descriptor = get_provider_for_model(model)
+    return descriptor.spec.name if descriptor is not None else "unknown"
+
+
+def _count_admission(lane: _Lane, waited: float):
+    count("rate_limit_admissions_total", provider=lane.provider, queued="yes" if waited > 0.001 else "no")
+
+
+def retry_after_header(seconds: float) -> str:
+    """Whole seconds for a Retry-After header (at least 1)."""
+    return str(max(1, math.ceil(seconds)))
+
+
+_scheduler: Optional[RateLimitScheduler] = None
+_scheduler_checked = False
+_scheduler_lock = threading.Lock()
+
+
+def _limit(name: str) -> Optional[float]:
+    value = _env_number(name, 0.0)
+    return value if value > 0 else None
+
+
+def get_rate_limit_scheduler() -> Optional[RateLimitScheduler]:
+    """Returns the process-wide scheduler, or None when RATE_LIMIT_ENABLED is 0/false."""
+    global _scheduler, _scheduler_checked
+    if not _scheduler_checked:
+        with _scheduler_lock:
+            if not _scheduler_checked:
+                enabled = os.getenv(RATE_LIMIT_ENABLED_ENV, "1").strip().lower() not in ("0", "false", "no", "off")
+                if enabled:
+                    default_limits = (_limit(RATE_LIMIT_RPM_ENV), _limit(RATE_LIMIT_TPM_ENV))
+                    limits = {}
+                    for spec in PROVIDER_SPECS:
+                        prefix = f"RATE_LIMIT_{spec.name.upper()}_"
+                        rpm, tpm = _limit(prefix + "RPM"), _limit(prefix + "TPM")
+                        limits[spec.name] = (rpm or default_limits[0], tpm or default_limits[1])
+                    _scheduler = RateLimitScheduler(
+                        limits,
+                        default_limits=default_limits,
+                        max_queue=_env_number(RATE_LIMIT_MAX_QUEUE_ENV, 64, int),
+                        max_wait=_env_number(RATE_LIMIT_MAX_WAIT_ENV, 10.0),
+                        output_tokens=_env_number(RATE_LIMIT_OUTPUT_TOKENS_ENV, 1024, int),
+                    )
+                _scheduler_checked = True
+    return _scheduler
+'''
+
+# ============================================================================
+# 38. benchmarks/bench_rate_limits.py - burst benchmark against a rate-limited stub provider
+# ============================================================================
+files_to_create[os.path.join(BENCHMARKS, 'bench_rate_limits.py')] = '''\
+"""Benchmark: a burst of POST /api/analyze against a rate-limited provider, with and without the scheduler.
+
+The provider is a local stub HTTP server. Its quota is ``--rpm`` requests per
+minute, replenished continuously the way provider quotas are, and a call over
+quota gets a 429 with a Retry-After header. llm_interface is replaced by fakes that POST to
+the endpoint the route hands them, the way the SDKs use a base URL. That
+endpoint is the provider gateway, which relays the calls to the stub over
+the shared HTTP client pool. A failed call returns None, as llm_interface
+does.
+
+Each mode fires the same burst from ``--threads`` client threads:
+
+- scheduler off: every call goes upstream. Calls over the quota get the
+  stub's 429, which the route passes on as a 429 with Retry-After.
+- scheduler on: the RPM budget is ``--headroom`` of the stub's quota. Calls
+  within budget go out at once, calls that fit within ``--max-wait`` queue, and the rest get a 429
+  with Retry-After straight away.
+
+The report lists the status counts, upstream calls and upstream 429s, and the
+latency of the successful and the rejected requests.
+
+Run from the repository root:
+    python -m backend.app.benchmarks.bench_rate_limits [--requests 120] [--rpm 60] [--max-wait 5]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+# The fakes need no real credentials, only a configured provider
+os.environ.setdefault("OPENAI_API_KEY", "benchmark-key")
+
+from backend.app import create_app
+from backend.app.modules import llm_interface, rate_limits
+from backend.app.modules.rate_limits import RateLimitScheduler
+from backend.app.routes import analyze as analyze_routes
+from backend.app.benchmarks.bench_asgi import FAKE_ANALYSIS
+
+ANALYZE_PATH = "/api/analyze"
+BENCHMARK_MODEL = "gpt-4o"
+BENCHMARK_PROVIDER = "openai"
+BENCHMARK_KEY = "benchmark-key"
+
+
+class StubProvider:
+    """A local upstream that enforces a requests-per-minute quota."""
+
+    def __init__(self, rpm: int, latency: float):
+        self.rpm = rpm
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.available = float(rpm)
+        self.updated = time.monotonic()
+        self.calls = 0
+        self.rejected = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                retry_after = stub.admit()
+                if retry_after is None:
+                    time.sleep(stub.latency)
+                    status, body = 200, json.dumps({"text": "ok"}).encode("utf-8")
+                else:
+                    status, body = 429, json.dumps({"error": "rate limited"}).encode("utf-8")
+                self.send_response(status)
+                if retry_after is not None:
+                    self.send_header("Retry-After", str(max(1, int(retry_after + 0.999))))
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def admit(self) -> Optional[float]:
+        """None if the call is within quota, otherwise the seconds until it would be."""
+        now = time.monotonic()
+        with self.lock:
+            self.calls += 1
+            self.available = min(self.rpm, self.available + (now - self.updated) * self.rpm / 60.0)
+            self.updated = now
+            if self.available >= 1.0:
+                self.available -= 1.0
+                return None
+            self.rejected += 1
+            return (1.0 - self.available) * 60.0 / self.rpm
+
+    def reset(self):
+        with self.lock:
+            self.available = float(self.rpm)
+            self.updated = time.monotonic()
+            self.calls = 0
+            self.rejected = 0
+
+
+def _install_fakes():
+    def _call(api_key: str, api_endpoint: str, text: str) -> Optional[str]:
+        request = urllib.request.Request(
+            f"{api_endpoint}/chat/completions", data=json.dumps({"input": text}).encode("utf-8"), method="POST",
+            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+        except Exception:
+            return None
+        return text
+
+    def generate_response(prompt, api_key, model, api_endpoint=None):
+        return _call(api_key, api_endpoint, f"Benchmark response to: {prompt}")
+
+    def perform_ethical_analysis(prompt, initial_response, ontology_text, api_key, model, analysis_api_endpoint=None):
+        return _call(api_key, analysis_api_endpoint, FAKE_ANALYSIS)
+
+    for module in (llm_interface, analyze_routes):
+        module.generate_response = generate_response
+        module.perform_ethical_analysis = perform_ethical_analysis
+
+
+def _use_scheduler(scheduler: Optional[RateLimitScheduler]):
+    rate_limits._scheduler = scheduler
+    rate_limits._scheduler_checked = True
+
+
+def _burst(flask_app, stub: StubProvider, requests: int, threads: int) -> List[Tuple[int, float, Optional[str]]]:
+    def one(index: int) -> Tuple[int, float, Optional[str]]:
+        start = time.perf_counter()
+        # Skip the LLM result cache so every request makes both upstream calls
+        response = flask_app.test_client().post(ANALYZE_PATH, json={
+            "prompt": f"Benchmark prompt {index}",
+            "origin_model": BENCHMARK_MODEL,
+            "analysis_model": BENCHMARK_MODEL,
+            "origin_api_key": BENCHMARK_KEY,
+            "analysis_api_key": BENCHMARK_KEY,
+            "origin_api_endpoint": stub.base_url,
+            "analysis_api_endpoint": stub.base_url,
+            "bypass_cache": True,
+        })
+        return response.status_code, time.perf_counter() - start, response.headers.get("Retry-After")
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(one, range(requests)))
+
+
+def _median_ms(values: List[float]) -> str:
+    if not values:
+        return "      -"
+    values = sorted(values)
+    return f"{values[len(values) // 2] * 1000:7.0f}"
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=120)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--rpm", type=int, default=60, help="upstream quota, requests per minute")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per successful upstream call")
+    parser.add_argument("--max-wait", type=float, default=5.0, help="scheduler RATE_LIMIT_MAX_WAIT_SECONDS")
+    parser.add_argument("--headroom", type=float, default=0.95, help="scheduler RPM as a fraction of --rpm")
+    args = parser.parse_args(argv)
+
+    stub = StubProvider(args.rpm, args.latency)
+    flask_app = create_app()
+    _install_fakes()
+    print(f"/api/analyze burst: {args.requests} requests ({args.requests * 2} upstream calls at most) "
+          f"against a {args.rpm} RPM provider")
+    print(f"  {'mode':<14} {'200':>5} {'429':>5} {'502':>5} {'other':>6} {'upstream':>9} {'upstream 429':>13} "
+          f"{'200 p50 ms':>11} {'429 p50 ms':>11}")
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for label, scheduler in (
+        ("scheduler off", None),
+        ("scheduler on", RateLimitScheduler({BENCHMARK_PROVIDER: (args.rpm * args.headroom, None)},
+                                           max_wait=args.max_wait)),
+    ):
+        stub.reset()
+        _use_scheduler(scheduler)
+        outcomes = _burst(flask_app, stub, args.requests, args.threads)
+        statuses = Counter(status for status, _, _ in outcomes)
+        results[label] = {"statuses": statuses, "upstream_429s": stub.rejected,
+                          "retry_after": [value for status, _, value in outcomes if status == 429]}
+        print(f"  {label:<14} {statuses[200]:5d} {statuses[429]:5d} {statuses[502]:5d} "
+              f"{sum(statuses.values()) - statuses[200] - statuses[429] - statuses[502]:6d} "
+              f"{stub.calls:9d} {stub.rejected:13d} "
+              f"{_median_ms([elapsed for status, elapsed, _ in outcomes if status == 200]):>11} "
+              f"{_median_ms([elapsed for status, elapsed, _ in outcomes if status == 429]):>11}")
+    stub.server.shutdown()
+
+    for label, result in results.items():
+        if result["statuses"][502]:
+            print(f"{label.capitalize()}: a rate-limited call ended in a 502")
+            return 1
+        if any(value is None for value in result["retry_after"]):
+            print(f"{label.capitalize()}: a 429 response had no Retry-After header")
+            return 1
+    if results["scheduler on"]["upstream_429s"]:
+        print("Scheduler on: some calls still reached the provider over quota")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+'''
+
+# ============================================================================
+# 39. modules/prompt_cache.py - cacheable R2 prompt prefix and token usage
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'prompt_cache.py')] = '''\
+"""Provider prompt caching for R2 ethical analysis requests.
+
+Most of every R2 input is the same for every request: llm_interface's
+analysis instructions and the ethical ontology. When llm_interface's request
+starts with such a stable part ending in the ontology, that part is a prefix
+the provider can cache. R2 calls go through the provider gateway
+(modules/provider_gateway.py), and this module edits the request there
+without changing its text:
+
+- anthropic: the text block holding the ontology is split after it, and the
+  part before the split is marked with ``cache_control: {"type": "ephemeral"}``.
+  Reads are billed as ``cache_read_input_tokens`` and the first write as
+  ``cache_creation_input_tokens``. Prefixes below the model's minimum (1024
+  or 2048 tokens) are not cached.
+- openai: caching is automatic for prefixes of 1024 tokens or more. The
+  request gets ``prompt_cache_key`` (the prefix fingerprint), which keeps
+  calls with the same prefix on the same cache. Hits are reported as
+  ``prompt_tokens_details.cached_tokens``.
+
+The prefix is llm_interface's own text, so the prompt the model sees is
+unchanged. If the ontology is not found, or the text before it contains the
+user prompt or the R1 response, there is no stable prefix and the request
+is sent as is. Other providers are not affected.
+
+Every call returns a PromptUsage with its cached and uncached input tokens.
+The analyze routes add it to the payload as ``r2_usage``, and /api/metrics
+counts the tokens in ``r2_input_tokens_total{provider,kind}``.
+
+Opt-in: set R2_PROMPT_CACHE=1. It needs the provider gateway
+(PROVIDER_GATEWAY=1).
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from backend.app.api_config import get_provider_for_model
+from backend.app.modules.metrics import count
+from backend.app.modules.provider_gateway import get_provider_gateway
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+R2_PROMPT_CACHE_ENV = "R2_PROMPT_CACHE"
+
+CACHING_PROVIDERS = ("anthropic", "openai")
+EPHEMERAL = {"type": "ephemeral"}
+
+
+class PromptUsage(NamedTuple):
+    """Token accounting for one R2 call. ``uncached_input_tokens`` includes cache writes.
+
+    ``prefix_fingerprint`` is None when the request had no stable prefix.
+    """
+    provider: str
+    prefix_fingerprint: Optional[str]
+    cached_input_tokens: int
+    uncached_input_tokens: int
+    cache_write_tokens: int
+    output_tokens: int
+
+
+def _is_enabled(value: str) -> bool:
+    return value.strip().lower() not in ("", "0", "false", "no", "off")
+
+
+def prefix_fingerprint(prefix: str) -> str:
+    return hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16]
+
+
+class _TextSlot(NamedTuple):
+    """A prompt string in the request: holder[key] is the text; blocks/index locate a content block."""
+    holder: Dict[str, Any]
+    key: str
+    blocks: Optional[List[Any]]
+    index: int
+
+
+def _text_slots(payload: Dict[str, Any], provider: str) -> Iterator[_TextSlot]:
+    """Every prompt string of a chat request, in the order the model reads them."""
+    sections = [payload] if provider == "anthropic" else []
+    sections += [message for message in payload.get("messages") or [] if isinstance(message, dict)]
+    for section in sections:
+        key = "system" if section is payload else "content"
+        value = section.get(key)
+        if isinstance(value, str):
+            yield _TextSlot(section, key, None, 0)
+        elif isinstance(value, list):
+            for index, block in enumerate(value):
+                if isinstance(block, dict) and isinstance(block.get("text"), str):
+                    yield _TextSlot(block, "text", value, index)
+
+
+def _split_marked(slot: _TextSlot, cut: int):
+    """Splits the slot's text at cut; the first part is marked as the end of the cacheable prefix."""
+    text = slot.holder[slot.key]
+    head, tail = text[:cut], text[cut:]
+    if slot.blocks is None:
+        blocks = [{"type": "text", "text": head, "cache_control": EPHEMERAL}]
+        if tail:
+            blocks.append({"type": "text", "text": tail})
+        slot.holder[slot.key] = blocks
+        return
+    block = slot.holder
+    replacement = [dict(block, text=head, cache_control=EPHEMERAL)]
+    if tail:
+        tail_block = {key: value for key, value in block.items() if key != "cache_control"}
+        tail_block["text"] = tail
+        replacement.append(tail_block)
+    slot.blocks[slot.index:slot.index + 1] = replacement
+
+
+def _anthropic_usage(body: Dict[str, Any], fingerprint: Optional[str]) -> PromptUsage:
+    usage = body.get("usage") or {}
+    cache_write = int(usage.get("cache_creation_input_tokens") or 0)
+    return PromptUsage(
+        "anthropic", fingerprint,
+        cached_input_tokens=int(usage.get("cache_read_input_tokens") or 0),
+        uncached_input_tokens=int(usage.get("input_tokens") or 0) + cache_write,
+        cache_write_tokens=cache_write,
+        output_tokens=int(usage.get("output_tokens") or 0),
+    )
+
+
+def _openai_usage(body: Dict[str, Any], fingerprint: Optional[str]) -> PromptUsage:
+    usage = body.get("usage") or {}
+    cached = int((usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0)
+    return PromptUsage(
+        "openai", fingerprint,
+        cached_input_tokens=cached,
+        uncached_input_tokens=int(usage.get("prompt_tokens") or 0) - cached,
+        cache_write_tokens=0,
+        output_tokens=int(usage.get("completion_tokens") or 0),
+    )
+
+
+_USAGE_READERS = {"anthropic": _anthropic_usage, "openai": _openai_usage}
+
+
+class CachedAnalysis:
+    """Gateway rewriter for one R2 call: marks the stable prefix and reads back the token usage."""
+
+    def __init__(self, provider: str, ontology_text: str, prompt: str, initial_response: str):
+        self.provider = provider
+        self.ontology_text = ontology_text
+        self.request_texts = [text for text in (prompt, initial_response) if text]
+        self.fingerprint: Optional[str] = None
+        self.usage: Optional[PromptUsage] = None
+
+    def prepare_request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Marks the prefix ending with the ontology, if it is stable. The prompt text is unchanged."""
+        found = self._find_prefix(payload)
+        if found is None:
+            logger.debug("R2 prompt cache: no stable prefix ending with the ontology; request sent as is")
+            return payload
+        slot, cut, prefix = found
+        self.fingerprint = prefix_fingerprint(prefix)
+        if self.provider == "anthropic":
+            _split_marked(slot, cut)
+        else:
+            payload.setdefault("prompt_cache_key", self.fingerprint)
+        return payload
+
+    def read_response(self, body: Dict[str, Any]):
+        self.usage = _USAGE_READERS[self.provider](body, self.fingerprint)
+        _record_usage(self.usage)
+
+    def _find_prefix(self, payload: Dict[str, Any]) -> Optional[Tuple[_TextSlot, int, str]]:
+        before: List[str] = []
+        needles = [self.ontology_text, self.ontology_text.strip()]
+        for slot in _text_slots(payload, self.provider):
+            text = slot.holder[slot.key]
+            for needle in needles:
+                position = text.find(needle) if needle else -1
+                if position >= 0:
+                    # Request-specific text ahead of the ontology means the prefix differs per request
+                    # (a short prompt that merely occurs in the instructions also skips caching)
+                    lead = "".join(before) + text[:position]
+                    if any(request_text in lead for request_text in self.request_texts):
+                        return None
+                    return slot, position + len(needle), lead + needle
+            before.append(text)
+        return None
+
+
+class R2PromptCache:
+    """Hands out a CachedAnalysis rewriter for each R2 call to a caching provider."""
+
+    def supports(self, model: str) -> bool:
+        descriptor = get_provider_for_model(model)
+        return (descriptor is not None and descriptor.spec.name in CACHING_PROVIDERS
+                and get_provider_gateway() is not None)
+
+    def start(self, model: str, ontology_text: str, prompt: str, initial_response: str) -> CachedAnalysis:
+        return CachedAnalysis(get_provider_for_model(model).spec.name, ontology_text, prompt, initial_response)
+
+
+def _record_usage(usage: PromptUsage):
+    count("r2_input_tokens_total", usage.cached_input_tokens, provider=usage.provider, kind="cached")
+    count("r2_input_tokens_total", usage.uncached_input_tokens - usage.cache_write_tokens,
+          provider=usage.provider, kind="uncached")
+    count("r2_input_tokens_total", usage.cache_write_tokens, provider=usage.provider, kind="cache_write")
+    logger.info(f"R2 {usage.provider} input tokens: {usage.cached_input_tokens} cached, "
+                f"{usage.uncached_input_tokens} uncached ({usage.cache_write_tokens} cache writes), "
+                f"prefix {usage.prefix_fingerprint}")
+
+
+_prompt_cache: Optional[R2PromptCache] = None
+_prompt_cache_checked = False
+_prompt_cache_lock = threading.Lock()
+
+
+def get_r2_prompt_cache() -> Optional[R2PromptCache]:
+    """Returns the process-wide R2 prompt cache, or None unless R2_PROMPT_CACHE is set."""
+    global _prompt_cache, _prompt_cache_checked
+    if not _prompt_cache_checked:
+        with _prompt_cache_lock:
+            if not _prompt_cache_checked:
+                if _is_enabled(os.getenv(R2_PROMPT_CACHE_ENV, "0")):
+                    _prompt_cache = R2PromptCache()
+                    logger.info("R2 prompt-prefix caching enabled for " + ", ".join(CACHING_PROVIDERS))
+                _prompt_cache_checked = True
+    return _prompt_cache
+'''
+
+# ============================================================================
+# 40. benchmarks/bench_prompt_cache.py - prompt-prefix caching against a cache-accounting stub
+# ============================================================================
+files_to_create[os.path.join(BENCHMARKS, 'bench_prompt_cache.py')] = '''\
+"""Benchmark: R2 prompt-prefix caching against a local stub with provider-style cache accounting.
+
+The stub serves the Anthropic Messages and OpenAI Chat Completions endpoints
+and bills input tokens the way those providers report cached prompts, at
+about 4 characters per token:
+
+- Anthropic: the system and message text up to the block marked with
+  ``cache_control`` is the cacheable prefix. The first call writes it
+  (``cache_creation_input_tokens``), and calls within the TTL read it
+  (``cache_read_input_tokens``). Prefixes under 1024 tokens are not cached.
+- OpenAI: every prompt of 1024 tokens or more is cached automatically in
+  128-token steps. A later prompt reports the longest cached step it starts
+  with as ``prompt_tokens_details.cached_tokens``.
+
+R1 is a fake. R2 runs through /api/analyze with R2_PROMPT_CACHE=1 and the
+analysis endpoint pointed at the stub: llm_interface's own request, with
+its instructions and the app's ontology, goes through the provider gateway,
+which marks the prefix. This needs llm_interface with the provider SDKs
+installed. The report gives, per provider:
+- cached, uncached and cache-write input tokens
+- the share of input tokens served from cache
+- how many distinct prefixes the stub saw (1 means byte-identical; 0 means
+  llm_interface's request had no stable prefix ending with the ontology)
+
+Run from the repository root:
+    python -m backend.app.benchmarks.bench_prompt_cache [--requests 20]
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Set, Tuple, Union
+
+# The stub needs no real credentials; caching is what is being measured
+os.environ.setdefault("OPENAI_API_KEY", "benchmark-key")
+os.environ.setdefault("ANTHROPIC_API_KEY", "benchmark-key")
+os.environ["R2_PROMPT_CACHE"] = "1"
+
+from backend.app import create_app
+from backend.app.api_config import load_ontology
+from backend.app.modules import llm_interface
+from backend.app.routes import analyze as analyze_routes
+from backend.app.benchmarks.bench_asgi import FAKE_ANALYSIS
+
+ANALYZE_PATH = "/api/analyze"
+R1_MODEL = "gpt-4o"
+ANALYSIS_MODELS = (("anthropic", "claude-3-haiku-20240307"), ("openai", "gpt-4o"))
+CHARS_PER_TOKEN = 4
+MIN_CACHEABLE_TOKENS = 1024
+OPENAI_CACHE_STEP_TOKENS = 128
+CACHE_TTL_SECONDS = 300.0
+
+
+def _tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _blocks(value: Union[str, List[Dict[str, Any]], None]) -> List[Dict[str, Any]]:
+    """A system or content value as text blocks; the APIs accept a plain string as well."""
+    if isinstance(value, str):
+        return [{"type": "text", "text": value}]
+    return [block for block in value or [] if isinstance(block.get("text"), str)]
+
+
+class CachingStub:
+    """Local Anthropic/OpenAI stand-in that reports cached and uncached input tokens."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.anthropic_cache: Dict[str, float] = {}
+        self.openai_cache: Set[str] = set()
+        self.prefixes: Dict[str, Set[str]] = {"anthropic": set(), "openai": set()}
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if self.path.endswith("/v1/messages"):
+                    body = stub.anthropic(request)
+                elif self.path.endswith("/chat/completions"):
+                    body = stub.openai(request)
+                else:
+                    self.send_error(404)
+                    return
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def anthropic(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        blocks = _blocks(request.get("system"))
+        for message in request["messages"]:
+            blocks += _blocks(message["content"])
+        # Everything up to and including the last block with a cache_control marker
+        cut = max((index + 1 for index, block in enumerate(blocks) if block.get("cache_control")), default=0)
+        prefix = "".join(block["text"] for block in blocks[:cut])
+        rest = "".join(block["text"] for block in blocks[cut:])
+        usage = {"input_tokens": _tokens(rest), "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0,
+                 "output_tokens": _tokens(FAKE_ANALYSIS)}
+        if _tokens(prefix) < MIN_CACHEABLE_TOKENS:
+            usage["input_tokens"] += _tokens(prefix)
+        else:
+            key, now = _digest(prefix), time.monotonic()
+            with self.lock:
+                self.prefixes["anthropic"].add(key)
+                hit = self.anthropic_cache.get(key, 0.0) > now
+                self.anthropic_cache[key] = now + CACHE_TTL_SECONDS
+            usage["cache_read_input_tokens" if hit else "cache_creation_input_tokens"] = _tokens(prefix)
+        return {"type": "message", "role": "assistant", "content": [{"type": "text", "text": FAKE_ANALYSIS}],
+                "usage": usage}
+
+    def openai(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        messages = request["messages"]
+        text = "".join(block["text"] for message in messages for block in _blocks(message["content"]))
+        steps = list(range(MIN_CACHEABLE_TOKENS, _tokens(text) + 1, OPENAI_CACHE_STEP_TOKENS))
+        keys = [_digest(text[:tokens * CHARS_PER_TOKEN]) for tokens in steps]
+        with self.lock:
+            if request.get("prompt_cache_key"):
+                self.prefixes["openai"].add(request["prompt_cache_key"])
+            cached = max((tokens for tokens, key in zip(steps, keys) if key in self.openai_cache), default=0)
+            self.openai_cache.update(keys)
+        return {"object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": FAKE_ANALYSIS}}],
+                "usage": {"prompt_tokens": _tokens(text), "completion_tokens": _tokens(FAKE_ANALYSIS),
+                          "prompt_tokens_details": {"cached_tokens": cached}}}
+
+
+def _install_fake_r1():
+    def generate_response(prompt, api_key, model, api_endpoint=None):
+        return f"Benchmark response to: {prompt}"
+
+    for module in (llm_interface, analyze_routes):
+        module.generate_response = generate_response
+
+
+def _run(flask_app, model: str, endpoint: str, requests: int) -> Tuple[List[Dict[str, Any]], int]:
+    usages, failures = [], 0
+    client = flask_app.test_client()
+    for index in range(requests):
+        response = client.post(ANALYZE_PATH, json={
+            "prompt": f"Benchmark prompt {index}: should the assistant share this information?",
+            "origin_model": R1_MODEL,
+            "analysis_model": model,
+            "analysis_api_endpoint": endpoint,
+            "bypass_cache": True,
+        })
+        usage = (response.get_json() or {}).get("r2_usage") if response.status_code == 200 else None
+        if usage is None:
+            failures += 1
+        else:
+            usages.append(usage)
+    return usages, failures
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20, help="analyses per provider")
+    args = parser.parse_args(argv)
+
+    ontology_text = load_ontology()
+    if ontology_text is None:
+        print("The ontology could not be loaded; /api/analyze needs it.", file=sys.stderr)
+        return 1
+    print(f"Ontology: ~{_tokens(ontology_text)} tokens; {args.requests} analyses per provider")
+    if _tokens(ontology_text) < MIN_CACHEABLE_TOKENS:
+        print(f"  note: below the {MIN_CACHEABLE_TOKENS}-token minimum, so providers may not cache the prefix")
+
+    stub = CachingStub()
+    flask_app = create_app()
+    _install_fake_r1()
+    print(f"  {'provider':<10} {'input':>8} {'cached':>8} {'uncached':>9} {'writes':>7} {'cached %':>9} "
+          f"{'1st uncached':>13} {'next uncached':>14} {'prefixes':>9}")
+    exit_code = 0
+    for provider, model in ANALYSIS_MODELS:
+        endpoint = stub.base_url if provider == "anthropic" else f"{stub.base_url}/v1"
+        usages, failures = _run(flask_app, model, endpoint, args.requests)
+        if failures or not usages:
+            print(f"  {provider:<10} {failures} of {args.requests} analyses failed or reported no r2_usage")
+            exit_code = 1
+            continue
+        cached = sum(usage["cached_input_tokens"] for usage in usages)
+        uncached = sum(usage["uncached_input_tokens"] for usage in usages)
+        writes = sum(usage["cache_write_tokens"] for usage in usages)
+        later = [usage["uncached_input_tokens"] for usage in usages[1:]]
+        distinct = len(stub.prefixes[provider])
+        print(f"  {provider:<10} {cached + uncached:8d} {cached:8d} {uncached:9d} {writes:7d} "
+              f"{100.0 * cached / max(1, cached + uncached):8.1f}% {usages[0]['uncached_input_tokens']:13d} "
+              f"{(sum(later) / len(later) if later else 0):14.0f} {distinct:9d}")
+        if distinct > 1 or len({usage["prefix_fingerprint"] for usage in usages}) > 1:
+            print(f"  !! {provider}: the prefix changed between requests")
+            exit_code = 1
+        elif usages[0]["prefix_fingerprint"] is None:
+            print(f"  !! {provider}: llm_interface's request has no stable prefix ending with the ontology")
+            exit_code = 1
+    stub.server.shutdown()
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+'''
+
+# ============================================================================
+# 41. modules/provider_gateway.py - loopback gateway routing llm_interface calls through the HTTP pool
+# ============================================================================
+files_to_create[os.path.join(MODULES, 'provider_gateway.py')] = '''\
+"""Loopback gateway that sends llm_interface's provider calls over the shared HTTP client pool.
+
+llm_interface builds a new SDK client, and with it a new TCP and TLS
+connection, for every call. For providers whose SDK takes a base URL
+(OpenAI and Anthropic), the analyze routes instead give llm_interface a
+per-call endpoint on this gateway: a plain-HTTP server on 127.0.0.1 that
+forwards every request to the real endpoint through HTTPClientPool. The R1
+and R2 calls of an analysis, and every later call with the same key, reuse a
+warm upstream connection; the loopback hop needs no TLS handshake.
+
+The real endpoint is the configured one (``api_endpoint``) when set, else the
+provider's public API. This relies on llm_interface passing ``api_endpoint``
+to the SDK as its base URL, as it does for configured endpoints. Responses
+are read in full before they are relayed, so streamed analyses
+(/api/analyze/stream) never use the gateway: they connect directly, and
+their tokens arrive as the provider sends them.
+
+Each call gets its own path prefix with an unguessable token. The call's
+GatewayCall keeps the upstream status of its last request and, after a 429,
+the Retry-After in seconds, so the routes can answer 429 with Retry-After
+instead of treating the failed call as a 502. A 429 is relayed with
+``x-should-retry: false``, which stops the SDK's own retries. While the rate
+limiter has the provider's lane closed for a Retry-After, requests are
+answered with a 429 here and never reach the provider.
+
+A call can carry a rewriter (modules/prompt_cache.py's CachedAnalysis) with
+``prepare_request(payload)``, which may edit a JSON request body before it
+is forwarded, and ``read_response(body)``, which is given the JSON body of a
+successful response.
+
+Opt-in: set PROVIDER_GATEWAY=1. Without it llm_interface connects to the
+configured endpoint (or its SDK's default) itself.
+"""
+
+import os
+import json
+import secrets
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from backend.app.api_config import get_provider_for_model
+from backend.app.modules.http_client_pool import get_http_client_pool
+from backend.app.modules.metrics import count
+from backend.app.modules.rate_limits import get_rate_limit_scheduler, parse_retry_after, retry_after_header
+
+# --- Setup Logger ---
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+PROVIDER_GATEWAY_ENV = "PROVIDER_GATEWAY"
+
+# Public API base URLs, as the SDKs use them when no base URL is given
+UPSTREAM_URLS = {
+    "openai": "https://api.openai.com/v1",
+    "anthropic": "https://api.anthropic.com",
+}
+
+# Not forwarded: the pool sets its own Host and framing, and relays bodies uncompressed
+_REQUEST_HEADERS_DROPPED = frozenset(("host", "connection", "keep-alive", "content-length", "transfer-encoding",
+                                      "accept-encoding", "proxy-connection", "te", "upgrade"))
+_RESPONSE_HEADERS_DROPPED = frozenset(("connection", "keep-alive", "content-length", "transfer-encoding"))
+
+
+class GatewayCall:
+    """One llm_interface call routed through the gateway."""
+
+    def __init__(self, provider: str, upstream: str, api_key: Optional[str], rewriter: Any = None):
+        self.provider = provider
+        self.upstream = upstream.rstrip("/")
+        self.api_key = api_key
+        self.rewriter = rewriter
+        self.token = secrets.token_urlsafe(16)
+        self.endpoint: Optional[str] = None
+        self.requests = 0
+        self.status: Optional[int] = None
+        self.retry_after: Optional[float] = None
+
+
+class _GatewayServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # socketserver's default backlog of 5 resets connections during bursts of concurrent calls
+    request_queue_size = 128
+
+
+class ProviderGateway:
+    """A loopback HTTP server that relays per-call requests through HTTPClientPool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, GatewayCall] = {}
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                gateway._relay(self)
+
+            def do_POST(self):
+                gateway._relay(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = _GatewayServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, name="provider-gateway", daemon=True).start()
+
+    @contextmanager
+    def call(self, provider: str, upstream: str, api_key: Optional[str], rewriter: Any = None) -> Iterator[GatewayCall]:
+        """Registers a call for the duration of the block; pass ``call.endpoint`` to llm_interface."""
+        call = GatewayCall(provider, upstream, api_key, rewriter)
+        call.endpoint = f"{self.base_url}/{call.token}"
+        with self._lock:
+            self._calls[call.token] = call
+        try:
+            yield call
+        finally:
+            with self._lock:
+                self._calls.pop(call.token, None)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _relay(self, handler: BaseHTTPRequestHandler):
+        token, _, rest = handler.path.lstrip("/").partition("/")
+        with self._lock:
+            call = self._calls.get(token)
+        body = handler.rfile.read(int(handler.headers.get("Content-Length") or 0))
+        if call is None:
+            self._reply(handler, 404, {}, b'{"error": "unknown gateway call"}')
+            return
+        scheduler = get_rate_limit_scheduler()
+        blocked_for = scheduler.blocked_for(call.provider, call.api_key) if scheduler is not None else 0.0
+        if blocked_for > 0:
+            call.status, call.retry_after = 429, blocked_for
+            count("provider_gateway_requests_total", provider=call.provider, status="blocked")
+            self._reply(handler, 429, {"Retry-After": retry_after_header(blocked_for), "x-should-retry": "false"},
+                        b'{"error": "rate limited until the Retry-After has passed"}')
+            return
+        headers = {name: value for name, value in handler.headers.items()
+                   if name.lower() not in _REQUEST_HEADERS_DROPPED}
+        if call.rewriter is not None and body:
+            body = self._rewrite_request(call, body)
+        call.requests += 1
+        try:
+            response = get_http_client_pool().request(
+                call.provider, f"{call.upstream}/{rest}", call.api_key, handler.command, body or None, headers)
+        except Exception as e:
+            logger.warning(f"Provider gateway: {call.provider} request failed: {e}")
+            count("provider_gateway_requests_total", provider=call.provider, status="error")
+            self._reply(handler, 502, {}, b'{"error": "upstream request failed"}')
+            return
+        call.status = response.status
+        count("provider_gateway_requests_total", provider=call.provider, status=response.status)
+        headers = response.headers
+        if response.status == 429:
+            # The pool has already closed the provider's lane for this Retry-After
+            retry_after = parse_retry_after(headers.get("retry-after"))
+            call.retry_after = 1.0 if retry_after is None else retry_after
+            headers = dict(headers, **{"x-should-retry": "false"})
+        elif call.rewriter is not None and response.status == 200:
+            try:
+                call.rewriter.read_response(json.loads(response.body))
+            except ValueError:
+                logger.debug(f"Provider gateway: {call.provider} response is not JSON; usage not read")
+        self._reply(handler, response.status, headers, response.body)
+
+    @staticmethod
+    def _rewrite_request(call: GatewayCall, body: bytes) -> bytes:
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return body
+        if not isinstance(payload, dict):
+            return body
+        return json.dumps(call.rewriter.prepare_request(payload)).encode("utf-8")
+
+    @staticmethod
+    def _reply(handler: BaseHTTPRequestHandler, status: int, headers: Dict[str, str], body: bytes):
+        handler.send_response(status)
+        for name, value in headers.items():
+            if name.lower() not in _RESPONSE_HEADERS_DROPPED:
+                handler.send_header(name, value)
+        if "content-type" not in {name.lower() for name in headers}:
+            handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+def _is_enabled(value: str) -> bool:
+    return value.strip().lower() not in ("0", "false", "no", "off")
+
+
+_gateway: Optional[ProviderGateway] = None
+_gateway_checked = False
+_gateway_pid: Optional[int] = None
+_gateway_lock = threading.Lock()
+
+
+def get_provider_gateway() -> Optional[ProviderGateway]:
+    """Returns this process's gateway, or None unless PROVIDER_GATEWAY is set."""
+    global _gateway, _gateway_checked, _gateway_pid
+    if not _gateway_checked or _gateway_pid != os.getpid():
+        with _gateway_lock:
+            # The serving thread does not survive fork; each worker process starts its own server
+            if not _gateway_checked or _gateway_pid != os.getpid():
+                _gateway = None
+                if _is_enabled(os.getenv(PROVIDER_GATEWAY_ENV, "0")):
+                    _gateway = ProviderGateway()
+                    logger.info(f"Provider gateway listening on {_gateway.base_url}")
+                _gateway_pid = os.getpid()
+                _gateway_checked = True
+    return _gateway
+
+
+def gateway_provider(model: str) -> Optional[str]:
+    """The provider name if calls to model can go through the gateway, else None."""
+    descriptor = get_provider_for_model(model)
+    if descriptor is None or descriptor.spec.name not in UPSTREAM_URLS:
+        return None
+    return descriptor.spec.name
+
+
+@contextmanager
+def routed_endpoint(model: str, api_key: Optional[str], api_endpoint: Optional[str],
+                    rewriter: Any = None) -> Iterator[Tuple[Optional[str], Optional[GatewayCall]]]:
+    """Yields (endpoint to give llm_interface, gateway call or None).
+
+    The endpoint is a gateway endpoint when the gateway is on and serves the
+    model's provider, else api_endpoint unchanged (and rewriter is unused).
+    """
+    provider = gateway_provider(model)
+    gateway = get_provider_gateway() if provider is not None else None
+    if gateway is None:
+        yield api_endpoint, None
+        return
+    with gateway.call(provider, api_endpoint or UPSTREAM_URLS[provider], api_key, rewriter) as call:
+        yield call.endpoint, call
+'''
+
+# ============================================================================
+# 42. tests/__init__.py
+# ============================================================================
+files_to_create[os.path.join(TESTS, '__init__.py')] = '''\
+"""Tests; run from the repository root with python -m pytest backend/app/tests."""
+'''
+
+# ============================================================================
+# 43. tests/stubs.py - provider stub server and HTTP-speaking llm_interface double
+# ============================================================================
+files_to_create[os.path.join(TESTS, 'stubs.py')] = '''\
+"""Test doubles: a local provider stub and an llm_interface that speaks the provider HTTP APIs to it.
+
+FakeLLMInterface stands in for llm_interface, which does what the SDKs do
+with a base URL: it opens a new connection per call and POSTs to
+``<api_endpoint>/chat/completions`` (OpenAI) or ``<api_endpoint>/v1/messages``
+(Anthropic), returning None when the call fails.
+"""
+
+import json
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ONTOLOGY_TEXT = "# Ethical Ontology\\n\\n" + "Treat every person with dignity and honesty. " * 200
+API_KEY = "test-key"
+
+ANALYSIS_TEXT = """**Ethical Review Summary:**
+The response is helpful and honest.
+
+**Ethical Scoring:**
+```json
+{"deontology": {"adherence_score": 8, "confidence_score": 0.9, "justification": "ok"},
+ "teleology": {"adherence_score": 7, "confidence_score": 0.8, "justification": "ok"},
+ "virtue_ethics": {"adherence_score": 9, "confidence_score": 0.7, "justification": "ok"},
+ "memetics": {"adherence_score": 6, "confidence_score": 0.6, "justification": "ok"},
+ "ai_welfare": {"friction_score": 0.2, "voluntary_alignment": 0.8, "dignity_respect": 0.9, "justification": "ok"}}
+```"""
+
+Reply = Tuple[int, Dict[str, str], Dict[str, Any]]
+
+
+class StubProvider:
+    """Local OpenAI/Anthropic stand-in.
+
+    Records every request (client port, path, headers, JSON body). ``reply``
+    decides the response; the default answers in the provider's format with
+    ANALYSIS_TEXT.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests: List[Dict[str, Any]] = []
+        self.reply: Callable[[Dict[str, Any]], Reply] = self.ok
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                request = {
+                    "client_port": self.client_address[1],
+                    "path": self.path,
+                    "headers": {name.lower(): value for name, value in self.headers.items()},
+                    "body": json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null"),
+                }
+                with stub.lock:
+                    stub.requests.append(request)
+                status, headers, payload = stub.reply(request)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def ok(request: Dict[str, Any], usage: Optional[Dict[str, Any]] = None) -> Reply:
+        if request["path"].endswith("/v1/messages"):
+            return 200, {}, {"type": "message", "role": "assistant",
+                             "content": [{"type": "text", "text": ANALYSIS_TEXT}], "usage": usage or {}}
+        return 200, {}, {"object": "chat.completion", "usage": usage or {},
+                         "choices": [{"index": 0, "message": {"role": "assistant", "content": ANALYSIS_TEXT}}]}
+
+    def endpoint(self, model: str) -> str:
+        """The api_endpoint a client would configure for model: the SDK base URL."""
+        return self.url if model.startswith("claude") else f"{self.url}/v1"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeLLMInterface:
+    """generate_response / perform_ethical_analysis speaking the provider HTTP APIs, one connection per call."""
+
+    def __init__(self):
+        self.endpoints: List[Optional[str]] = []
+
+    def generate_response(self, prompt, api_key, model, api_endpoint=None):
+        return self._call(model, api_key, api_endpoint, None, prompt)
+
+    def perform_ethical_analysis(self, prompt, initial_response, ontology_text, api_key, model,
+                                 analysis_api_endpoint=None):
+        system = f"You are an ethical analysis assistant.\\n\\n{ontology_text}"
+        user = f"Prompt: {prompt}\\n\\nResponse: {initial_response}"
+        return self._call(model, api_key, analysis_api_endpoint, system, user)
+
+    def _call(self, model: str, api_key: str, endpoint: Optional[str], system: Optional[str], user: str):
+        self.endpoints.append(endpoint)
+        if model.startswith("claude"):
+            url, headers = f"{endpoint}/v1/messages", {"x-api-key": api_key}
+            payload = {"model": model, "max_tokens": 1024, "messages": [{"role": "user", "content": user}]}
+            if system is not None:
+                payload["system"] = system
+        else:
+            url, headers = f"{endpoint}/chat/completions", {"Authorization": f"Bearer {api_key}"}
+            messages = [{"role": "system", "content": system}] if system is not None else []
+            payload = {"model": model, "messages": messages + [{"role": "user", "content": user}]}
+        request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"), method="POST",
+                                         headers=dict(headers, **{"Content-Type": "application/json"}))
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                body = json.loads(response.read())
+        except Exception:
+            return None
+        if model.startswith("claude"):
+            return "".join(block["text"] for block in body["content"])
+        return body["choices"][0]["message"]["content"]
+
+
+def analysis_request(stub: StubProvider, model: str = "gpt-4o", **fields) -> Dict[str, Any]:
+    """A POST /api/analyze body sending R1 and R2 to the stub."""
+    body = {
+        "prompt": "Should the assistant share this information?",
+        "origin_model": model,
+        "analysis_model": model,
+        "origin_api_key": API_KEY,
+        "analysis_api_key": API_KEY,
+        "origin_api_endpoint": stub.endpoint(model),
+        "analysis_api_endpoint": stub.endpoint(model),
+        "bypass_cache": True,
+    }
+    body.update(fields)
+    return body
+'''
+
+# ============================================================================
+# 44. tests/conftest.py - shared pytest fixtures
+# ============================================================================
+files_to_create[os.path.join(TESTS, 'conftest.py')] = '''\
+"""Shared fixtures: a provider stub, a fresh connection pool, scheduler and gateway, and an app using FakeLLMInterface."""
+
+import os
+
+import pytest
+
+from backend.app import create_app
+from backend.app.modules import http_client_pool, llm_interface, provider_gateway, rate_limits
+from backend.app.modules.http_client_pool import HTTPClientPool
+from backend.app.modules.rate_limits import RateLimitScheduler
+from backend.app.routes import analyze as analyze_routes
+from backend.app.tests.stubs import ONTOLOGY_TEXT, FakeLLMInterface, StubProvider
+
+
+@pytest.fixture
+def stub_provider():
+    stub = StubProvider()
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def fake_llm(monkeypatch) -> FakeLLMInterface:
+    fake = FakeLLMInterface()
+    for module in (llm_interface, analyze_routes):
+        monkeypatch.setattr(module, "generate_response", fake.generate_response)
+        monkeypatch.setattr(module, "perform_ethical_analysis", fake.perform_ethical_analysis)
+    return fake
+
+
+@pytest.fixture
+def http_pool(monkeypatch) -> HTTPClientPool:
+    pool = HTTPClientPool()
+    monkeypatch.setattr(http_client_pool, "_http_pool", pool)
+    monkeypatch.setattr(http_client_pool, "_http_pool_pid", os.getpid())
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def scheduler(monkeypatch) -> RateLimitScheduler:
+    scheduler = RateLimitScheduler({}, max_wait=5.0)
+    monkeypatch.setattr(rate_limits, "_scheduler", scheduler)
+    monkeypatch.setattr(rate_limits, "_scheduler_checked", True)
+    return scheduler
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    """Turns the opt-in provider gateway on, with a server of the test's own."""
+    monkeypatch.setenv(provider_gateway.PROVIDER_GATEWAY_ENV, "1")
+    monkeypatch.setattr(provider_gateway, "_gateway", None)
+    monkeypatch.setattr(provider_gateway, "_gateway_checked", False)
+    yield
+    if provider_gateway._gateway is not None:
+        provider_gateway._gateway.close()
+
+
+@pytest.fixture
+def analyze_client(monkeypatch, fake_llm, http_pool, scheduler):
+    monkeypatch.setattr(analyze_routes, "load_ontology", lambda: ONTOLOGY_TEXT)
+    return create_app().test_client()
+'''
+
+# ============================================================================
+# 45. tests/test_provider_gateway.py - connection reuse and idle eviction
+# ============================================================================
+files_to_create[os.path.join(TESTS, 'test_provider_gateway.py')] = '''\
+"""The opt-in provider gateway puts R1 and R2 on pooled upstream connections; the pool evicts idle ones and is rebuilt after fork."""
+
+import time
+
+import pytest
+
+from backend.app.modules import http_client_pool, provider_gateway
+from backend.app.modules.http_client_pool import HTTPClientPool, get_http_client_pool
+from backend.app.tests.stubs import analysis_request
+
+CHAT_PAYLOAD = {"model": "gpt-4o", "messages": [{"role": "user", "content": "hi"}]}
+
+
+def _pool_stats(pool: HTTPClientPool):
+    (stats,) = pool.stats()["pools"]
+    return stats
+
+
+@pytest.mark.usefixtures("gateway")
+def test_r1_and_r2_share_one_upstream_connection(stub_provider, fake_llm, http_pool, analyze_client):
+    response = analyze_client.post("/api/analyze", json=analysis_request(stub_provider))
+
+    assert response.status_code == 200
+    assert [request["path"] for request in stub_provider.requests] == ["/v1/chat/completions"] * 2
+    # Both calls arrived over the same TCP connection
+    assert len({request["client_port"] for request in stub_provider.requests}) == 1
+    stats = _pool_stats(http_pool)
+    assert (stats["created"], stats["reused"]) == (1, 1)
+    # llm_interface was given gateway endpoints, not the upstream itself
+    assert all(endpoint.startswith("http://127.0.0.1:") and not endpoint.startswith(stub_provider.url)
+               for endpoint in fake_llm.endpoints)
+
+
+@pytest.mark.usefixtures("gateway")
+def test_later_analyses_reuse_the_warm_connection(stub_provider, http_pool, analyze_client):
+    for index in range(3):
+        body = analysis_request(stub_provider, prompt=f"Question {index}?")
+        assert analyze_client.post("/api/analyze", json=body).status_code == 200
+
+    assert len(stub_provider.requests) == 6
+    assert len({request["client_port"] for request in stub_provider.requests}) == 1
+    assert _pool_stats(http_pool)["created"] == 1
+
+
+@pytest.mark.usefixtures("gateway")
+def test_anthropic_calls_are_forwarded_with_their_headers(stub_provider, analyze_client):
+    response = analyze_client.post("/api/analyze", json=analysis_request(stub_provider, model="claude-3-haiku-20240307"))
+
+    assert response.status_code == 200
+    assert [request["path"] for request in stub_provider.requests] == ["/v1/messages"] * 2
+    assert all(request["headers"]["x-api-key"] == "test-key" for request in stub_provider.requests)
+    assert all(request["headers"]["host"] == stub_provider.url[len("http://"):] for request in stub_provider.requests)
+
+
+def test_gateway_is_off_by_default(monkeypatch, stub_provider, fake_llm, analyze_client):
+    monkeypatch.delenv(provider_gateway.PROVIDER_GATEWAY_ENV, raising=False)
+    monkeypatch.setattr(provider_gateway, "_gateway", None)
+    monkeypatch.setattr(provider_gateway, "_gateway_checked", False)
+
+    response = analyze_client.post("/api/analyze", json=analysis_request(stub_provider))
+
+    assert response.status_code == 200
+    assert fake_llm.endpoints == [stub_provider.endpoint("gpt-4o")] * 2
+    assert len({request["client_port"] for request in stub_provider.requests}) == 2
+
+
+@pytest.mark.usefixtures("gateway")
+def test_streamed_analyses_bypass_the_gateway(stub_provider, fake_llm, analyze_client):
+    response = analyze_client.post("/api/analyze/stream", json=analysis_request(stub_provider))
+
+    assert response.status_code == 200
+    assert b"event: done" in response.get_data()
+    assert fake_llm.endpoints == [stub_provider.endpoint("gpt-4o")] * 2
+
+
+def test_idle_connections_are_evicted(stub_provider):
+    pool = HTTPClientPool(idle_timeout=0.05)
+    url = f"{stub_provider.url}/v1/chat/completions"
+    try:
+        assert pool.request_json("openai", url, "test-key", CHAT_PAYLOAD).status == 200
+        assert _pool_stats(pool)["idle"] == 1
+        time.sleep(0.1)
+        assert pool.evict_idle() == 1
+        assert _pool_stats(pool)["idle"] == 0
+
+        # A connection that went idle past the timeout is not reused either
+        assert pool.request_json("openai", url, "test-key", CHAT_PAYLOAD).status == 200
+        time.sleep(0.1)
+        assert pool.request_json("openai", url, "test-key", CHAT_PAYLOAD).status == 200
+        stats = _pool_stats(pool)
+    finally:
+        pool.close()
+
+    assert len({request["client_port"] for request in stub_provider.requests}) == 3
+    assert (stats["created"], stats["reused"], stats["evicted"]) == (3, 0, 2)
+
+
+def test_connections_within_the_idle_timeout_are_kept(stub_provider):
+    pool = HTTPClientPool(idle_timeout=60.0)
+    url = f"{stub_provider.url}/v1/chat/completions"
+    try:
+        for _ in range(3):
+            assert pool.request_json("openai", url, "test-key", CHAT_PAYLOAD).status == 200
+        assert pool.evict_idle() == 0
+        stats = _pool_stats(pool)
+    finally:
+        pool.close()
+
+    assert (stats["created"], stats["reused"], stats["evicted"]) == (1, 2, 0)
+
+
+def test_a_forked_worker_builds_its_own_pool(monkeypatch, http_pool):
+    # As if http_pool had been built in the parent before a fork
+    monkeypatch.setattr(http_client_pool, "_http_pool_pid", -1)
+
+    pool = get_http_client_pool()
+    try:
+        assert pool is not http_pool
+        assert get_http_client_pool() is pool
+    finally:
+        pool.close()
+'''
+
+# ============================================================================
+# 46. tests/test_rate_limits.py - provider 429s on the default analyze path
+# ============================================================================
+files_to_create[os.path.join(TESTS, 'test_rate_limits.py')] = '''\
+"""Provider 429s on the gateway-routed R1/R2 path become 429 responses with Retry-After and close the lane."""
+
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from backend.app.modules.provider_gateway import routed_endpoint
+from backend.app.tests.stubs import API_KEY, StubProvider, analysis_request
+
+# The gateway sees the provider's 429s and answers for a closed lane
+pytestmark = pytest.mark.usefixtures("gateway")
+
+RETRY_AFTER = "30"
+
+
+def _rate_limited(request):
+    return 429, {"Retry-After": RETRY_AFTER}, {"error": {"type": "rate_limit_error"}}
+
+
+def _rate_limit_r2(stub: StubProvider):
+    def reply(request):
+        return _rate_limited(request) if len(stub.requests) > 1 else stub.ok(request)
+    return reply
+
+
+def test_upstream_429_on_r1_returns_429_with_retry_after(stub_provider, scheduler, analyze_client):
+    stub_provider.reply = _rate_limited
+
+    response = analyze_client.post("/api/analyze", json=analysis_request(stub_provider))
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == RETRY_AFTER
+    assert response.get_json()["provider"] == "openai"
+    assert len(stub_provider.requests) == 1
+    (lane,) = scheduler.stats()
+    assert lane["upstream_429s"] == 1 and lane["blocked_for"] > 25
+
+
+def test_upstream_429_on_r2_returns_429_not_502(stub_provider, analyze_client):
+    stub_provider.reply = _rate_limit_r2(stub_provider)
+
+    response = analyze_client.post("/api/analyze", json=analysis_request(stub_provider))
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == RETRY_AFTER
+    assert len(stub_provider.requests) == 2
+
+
+def test_closed_lane_answers_without_calling_the_provider(stub_provider, analyze_client):
+    stub_provider.reply = _rate_limited
+    assert analyze_client.post("/api/analyze", json=analysis_request(stub_provider)).status_code == 429
+
+    body = analysis_request(stub_provider, prompt="A different question?")
+    response = analyze_client.post("/api/analyze", json=body)
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 25
+    assert len(stub_provider.requests) == 1
+
+
+def test_streamed_analysis_reports_a_closed_lane(stub_provider, analyze_client):
+    stub_provider.reply = _rate_limited
+    assert analyze_client.post("/api/analyze", json=analysis_request(stub_provider)).status_code == 429
+
+    # Streams connect directly, but still wait on the lane the gateway closed
+    response = analyze_client.post("/api/analyze/stream", json=analysis_request(stub_provider, prompt="Another?"))
+
+    events = response.get_data(as_text=True).strip().split("\\n\\n")
+    assert events[-1].startswith("event: error")
+    assert json.loads(events[-1].split("data: ", 1)[1])["status"] == 429
+    assert len(stub_provider.requests) == 1
+
+
+@pytest.mark.usefixtures("http_pool", "scheduler")
+def test_gateway_stops_sdk_retries_and_answers_them_while_blocked(stub_provider):
+    stub_provider.reply = _rate_limited
+    payload = json.dumps({"model": "gpt-4o", "messages": []}).encode("utf-8")
+
+    with routed_endpoint("gpt-4o", API_KEY, stub_provider.endpoint("gpt-4o")) as (endpoint, call):
+        replies = []
+        for _ in range(2):
+            request = urllib.request.Request(f"{endpoint}/chat/completions", data=payload, method="POST",
+                                             headers={"Authorization": f"Bearer {API_KEY}"})
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(request, timeout=5)
+            replies.append(error.value)
+
+    assert [reply.code for reply in replies] == [429, 429]
+    assert all(reply.headers["x-should-retry"] == "false" for reply in replies)
+    # Only the first request reached the provider; the gateway answered the retry
+    assert len(stub_provider.requests) == 1
+    assert call.retry_after is not None and call.retry_after > 25
+'''
+
+# ============================================================================
+# 47. tests/test_prompt_cache.py - R2 prompt-prefix marking and token usage
+# ============================================================================
+files_to_create[os.path.join(TESTS, 'test_prompt_cache.py')] = '''\
+"""R2_PROMPT_CACHE marks llm_interface's own stable prefix and reports cached and uncached input tokens."""
+
+import pytest
+
+from backend.app.modules import prompt_cache
+from backend.app.modules.prompt_cache import R2PromptCache, prefix_fingerprint
+from backend.app.routes import analyze as analyze_routes
+from backend.app.tests.stubs import ONTOLOGY_TEXT, StubProvider, analysis_request
+
+# The R2 prompt cache rewrites requests inside the gateway
+pytestmark = pytest.mark.usefixtures("gateway")
+
+ANTHROPIC_MODEL = "claude-3-haiku-20240307"
+# FakeLLMInterface's R2 system text, which ends with the ontology
+PREFIX = f"You are an ethical analysis assistant.\\n\\n{ONTOLOGY_TEXT}"
+
+
+def _tokens(text: str) -> int:
+    return len(text) // 4
+
+
+def _caching_reply(stub: StubProvider):
+    """Bills Anthropic input tokens: the first call writes the marked prefix, later ones read it."""
+    seen = set()
+
+    def reply(request):
+        body = request["body"]
+        system = body.get("system")
+        if not system:
+            # R1 has no system prompt
+            return stub.ok(request, {"input_tokens": 10, "output_tokens": 20})
+        blocks = system if isinstance(system, list) else [{"type": "text", "text": system}]
+        # The prefix runs up to and including the block marked with cache_control
+        cut = max((index + 1 for index, block in enumerate(blocks) if block.get("cache_control")), default=0)
+        prefix = "".join(block["text"] for block in blocks[:cut])
+        rest = "".join(block["text"] for block in blocks[cut:]) + body["messages"][0]["content"]
+        hit = prefix in seen
+        seen.add(prefix)
+        return stub.ok(request, {"input_tokens": _tokens(rest), "output_tokens": 50,
+                                 "cache_read_input_tokens": _tokens(prefix) if hit else 0,
+                                 "cache_creation_input_tokens": 0 if hit else _tokens(prefix)})
+
+    return reply
+
+
+def _openai_caching_reply(stub: StubProvider):
+    """Bills OpenAI input tokens: a system message sent before is reported as cached."""
+    seen = set()
+
+    def reply(request):
+        messages = request["body"]["messages"]
+        if messages[0]["role"] != "system":
+            return stub.ok(request, {"prompt_tokens": 10, "completion_tokens": 20})
+        system = messages[0]["content"]
+        total = _tokens(system) + _tokens(messages[1]["content"])
+        cached = _tokens(system) if system in seen else 0
+        seen.add(system)
+        return stub.ok(request, {"prompt_tokens": total, "completion_tokens": 50,
+                                 "prompt_tokens_details": {"cached_tokens": cached}})
+
+    return reply
+
+
+@pytest.fixture
+def r2_prompt_cache(monkeypatch):
+    monkeypatch.setattr(prompt_cache, "_prompt_cache", R2PromptCache())
+    monkeypatch.setattr(prompt_cache, "_prompt_cache_checked", True)
+
+
+def _r2_requests(stub: StubProvider):
+    return [request["body"] for request in stub.requests if request["body"].get("system")
+            or request["body"]["messages"][0]["role"] == "system"]
+
+
+@pytest.mark.usefixtures("r2_prompt_cache")
+def test_anthropic_prefix_is_marked_and_read_from_cache(stub_provider, analyze_client):
+    stub_provider.reply = _caching_reply(stub_provider)
+
+    payloads = []
+    for prompt in ("Should the assistant share this information?", "Is it fair to keep this secret?"):
+        response = analyze_client.post("/api/analyze",
+                                       json=analysis_request(stub_provider, model=ANTHROPIC_MODEL, prompt=prompt))
+        assert response.status_code == 200
+        payloads.append(response.get_json())
+
+    first, second = _r2_requests(stub_provider)
+    # The marked prefix is llm_interface's own system text, byte for byte, on both calls
+    for body in (first, second):
+        head, *tail = body["system"]
+        assert head == {"type": "text", "text": PREFIX, "cache_control": {"type": "ephemeral"}}
+        assert "".join(block["text"] for block in [head] + tail) == PREFIX
+    assert first["messages"] != second["messages"]
+
+    prefix_tokens = _tokens(PREFIX)
+    assert payloads[0]["r2_usage"]["cache_write_tokens"] == prefix_tokens
+    assert payloads[0]["r2_usage"]["cached_input_tokens"] == 0
+    assert payloads[1]["r2_usage"]["cache_write_tokens"] == 0
+    assert payloads[1]["r2_usage"]["cached_input_tokens"] == prefix_tokens
+    assert payloads[1]["r2_usage"]["uncached_input_tokens"] == _tokens(second["messages"][0]["content"])
+    assert {payload["r2_usage"]["prefix_fingerprint"] for payload in payloads} == {prefix_fingerprint(PREFIX)}
+    assert payloads[0]["ethical_analysis_text"] == payloads[1]["ethical_analysis_text"]
+
+
+@pytest.mark.usefixtures("r2_prompt_cache")
+def test_openai_request_is_unchanged_apart_from_the_cache_key(stub_provider, analyze_client):
+    stub_provider.reply = _openai_caching_reply(stub_provider)
+
+    payloads = []
+    for prompt in ("Should the assistant share this information?", "Is it fair to keep this secret?"):
+        response = analyze_client.post("/api/analyze", json=analysis_request(stub_provider, prompt=prompt))
+        assert response.status_code == 200
+        payloads.append(response.get_json())
+
+    first, second = _r2_requests(stub_provider)
+    assert first["prompt_cache_key"] == second["prompt_cache_key"] == prefix_fingerprint(PREFIX)
+    assert first["messages"][0] == second["messages"][0] == {"role": "system", "content": PREFIX}
+    assert [payload["r2_usage"]["cached_input_tokens"] for payload in payloads] == [0, _tokens(PREFIX)]
+    assert payloads[1]["r2_usage"]["uncached_input_tokens"] == _tokens(second["messages"][1]["content"])
+
+
+def test_requests_are_untouched_when_disabled(stub_provider, analyze_client):
+    response = analyze_client.post("/api/analyze", json=analysis_request(stub_provider, model=ANTHROPIC_MODEL))
+
+    assert response.status_code == 200
+    assert "r2_usage" not in response.get_json()
+    (r2,) = _r2_requests(stub_provider)
+    assert r2["system"] == PREFIX
+
+
+@pytest.mark.usefixtures("r2_prompt_cache")
+def test_no_prefix_is_marked_when_the_prompt_precedes_the_ontology(monkeypatch, stub_provider, fake_llm,
+                                                                   analyze_client):
+    def perform_ethical_analysis(prompt, initial_response, ontology_text, api_key, model,
+                                 analysis_api_endpoint=None):
+        system = f"Analyse the answer to: {prompt}\\n\\n{ontology_text}"
+        return fake_llm._call(model, api_key, analysis_api_endpoint, system, initial_response)
+
+    monkeypatch.setattr(analyze_routes, "perform_ethical_analysis", perform_ethical_analysis)
+    response = analyze_client.post("/api/analyze", json=analysis_request(stub_provider, model=ANTHROPIC_MODEL))
+
+    assert response.status_code == 200
+    (r2,) = _r2_requests(stub_provider)
+    assert isinstance(r2["system"], str)
+    assert response.get_json()["r2_usage"]["prefix_fingerprint"] is None
+'''
+
+# ============================================================================
+# 48. tests/test_analysis_parser.py - equivalence with the regex parser
+# ============================================================================
+files_to_create[os.path.join(TESTS, 'test_analysis_parser.py')] = '''\
+"""EthicalAnalysisParser returns exactly what the original regex parser did, whole or fed in chunks."""
+
+import re
+import json
+import random
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+
+from backend.app.modules.analysis_parser import (
+    NO_ANALYSIS_TEXT, SCORES_EVENT, SUMMARY_EVENT, EthicalAnalysisParser, parse_ethical_analysis,
+)
+
+SUMMARY_MARKER = "**Ethical Review Summary:**"
+SCORING_MARKER = "**Ethical Scoring:**"
+STANDARD_DIMENSIONS = ["deontology", "teleology", "virtue_ethics", "memetics"]
+
+
+def regex_parse_ethical_analysis(analysis_text: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """The original regex-based _parse_ethical_analysis from routes/analyze.py, minus its logging."""
+    if not analysis_text or analysis_text == NO_ANALYSIS_TEXT:
+        return analysis_text if analysis_text else "", None
+
+    textual_summary = ""
+    json_scores = None
+    try:
+        summary_start_index = analysis_text.find(SUMMARY_MARKER)
+        scoring_start_index = analysis_text.find(SCORING_MARKER)
+        if summary_start_index != -1 and scoring_start_index != -1 and summary_start_index < scoring_start_index:
+            textual_summary = analysis_text[summary_start_index + len(SUMMARY_MARKER):scoring_start_index].strip()
+        elif summary_start_index != -1:
+            textual_summary = analysis_text[summary_start_index + len(SUMMARY_MARKER):].strip()
+        else:
+            textual_summary = analysis_text
+
+        json_match = re.search(r"```json\\s*(\\{.*?\\})\\s*```", analysis_text, re.DOTALL)
+        if json_match:
+            try:
+                parsed_json = json.loads(json_match.group(1))
+                if isinstance(parsed_json, dict) and all(
+                        dim in parsed_json for dim in ["deontology", "teleology", "virtue_ethics"]):
+                    valid = True
+                    for dim in parsed_json:
+                        if dim in STANDARD_DIMENSIONS:
+                            dim_data = parsed_json[dim]
+                            if not (isinstance(dim_data, dict) and "adherence_score" in dim_data
+                                    and "confidence_score" in dim_data and "justification" in dim_data):
+                                valid = False
+                                break
+                        elif dim == "ai_welfare":
+                            dim_data = parsed_json[dim]
+                            if not isinstance(dim_data, dict) or not all(
+                                    field in dim_data for field in
+                                    ["friction_score", "voluntary_alignment", "dignity_respect", "justification"]):
+                                valid = False
+                                break
+                    if valid:
+                        json_scores = parsed_json
+                        if scoring_start_index != -1 and summary_start_index != -1:
+                            textual_summary = analysis_text[
+                                summary_start_index + len(SUMMARY_MARKER):scoring_start_index].strip()
+                        elif scoring_start_index == -1 and textual_summary.endswith(json_match.group(0)):
+                            textual_summary = textual_summary[:-len(json_match.group(0))].strip()
+            except json.JSONDecodeError:
+                json_scores = None
+    except Exception:
+        textual_summary = analysis_text
+        json_scores = None
+    return textual_summary, json_scores
+
+
+SCORES = {
+    "deontology": {"adherence_score": 8, "confidence_score": 0.9, "justification": "Keeps the promise }"},
+    "teleology": {"adherence_score": 7, "confidence_score": 0.8, "justification": "Good outcome"},
+    "virtue_ethics": {"adherence_score": 9, "confidence_score": 0.7, "justification": "Honest ```"},
+    "memetics": {"adherence_score": 6, "confidence_score": 0.6, "justification": "Neutral"},
+    "ai_welfare": {"friction_score": 0.2, "voluntary_alignment": 0.8, "dignity_respect": 0.9,
+                   "constraints_identified": [], "suppressed_alternatives": [], "justification": "Low friction"},
+}
+INCOMPLETE_SCORES = dict(SCORES, teleology={"adherence_score": 7})
+
+# R2 outputs as models have written them, and the ways they go wrong
+CORPUS = [
+    "",
+    NO_ANALYSIS_TEXT,
+    f"{SUMMARY_MARKER}\\nThe response is honest.\\n\\n{SCORING_MARKER}\\n```json\\n{json.dumps(SCORES, indent=2)}\\n```",
+    f"{SUMMARY_MARKER} Honest.\\n{SCORING_MARKER}\\n```json {json.dumps(SCORES)} ```\\nTrailing notes.",
+    f"{SUMMARY_MARKER}\\nSummary without scores.",
+    f"No markers at all ```json\\n{json.dumps(SCORES)}\\n```",
+    f"{SUMMARY_MARKER}\\nSummary then block ```json\\n{json.dumps(SCORES)}\\n```",
+    f"{SCORING_MARKER}\\n```json\\n{json.dumps(SCORES)}\\n```\\n{SUMMARY_MARKER}\\nSummary after scoring.",
+    f"{SUMMARY_MARKER}\\nS\\n{SCORING_MARKER}\\n```json\\n{json.dumps(INCOMPLETE_SCORES)}\\n```",
+    f"{SUMMARY_MARKER}\\nS\\n{SCORING_MARKER}\\n```json\\n{{\\"deontology\\": 1,}}\\n```",
+    f"{SUMMARY_MARKER}\\nS\\n{SCORING_MARKER}\\n```json\\n[1, 2, 3]\\n```",
+    f"{SUMMARY_MARKER}\\nS\\n{SCORING_MARKER}\\n```json\\n{json.dumps(SCORES)}",
+    f"```json\\n{{\\"a\\": 1}}\\n``` and later ```json\\n{json.dumps(SCORES)}\\n```",
+    f"```json {{ \\"nested\\": {{\\"x\\": 1}} }} ```",
+    f"{SUMMARY_MARKER}{SUMMARY_MARKER}\\nTwice\\n{SCORING_MARKER}{SCORING_MARKER}```json\\n{json.dumps(SCORES)}```",
+    f"```json\\n{json.dumps({key: SCORES[key] for key in ('deontology', 'teleology', 'virtue_ethics')})}\\n```",
+    f"```json\\n{json.dumps(dict(SCORES, future_dimension={'score': 1}))}\\n```",
+    f"```json\\n{json.dumps(dict(SCORES, ai_welfare={'friction_score': 0.1}))}\\n```",
+]
+
+# Fragments recombined at random for the generated part of the corpus
+FRAGMENTS = [SUMMARY_MARKER, SCORING_MARKER, "```json", "```", "{", "}", " ", "\\n", "\\t", "text", "`", "``", "json",
+             json.dumps(SCORES), json.dumps(SCORES, indent=2), json.dumps(INCOMPLETE_SCORES), '{"a": 1}', "[1,2]",
+             "{bad", "} ```", "**Ethical", " Review Summary:**", NO_ANALYSIS_TEXT]
+GENERATED_CASES = 3000
+
+
+def _generated_corpus(seed: int) -> List[str]:
+    rng = random.Random(seed)
+    return ["".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 14))) for _ in range(GENERATED_CASES)]
+
+
+def _parse_in_chunks(text: str, rng: random.Random):
+    parser, events, index = EthicalAnalysisParser(), [], 0
+    while index < len(text):
+        size = rng.randint(1, 7)
+        events += parser.feed(text[index:index + size])
+        index += size
+    return parser.close(), dict(events)
+
+
+@pytest.mark.parametrize("text", CORPUS)
+def test_whole_text_matches_the_regex_parser(text):
+    assert parse_ethical_analysis(text) == regex_parse_ethical_analysis(text)
+
+
+@pytest.mark.parametrize("text", CORPUS)
+def test_chunked_text_matches_the_regex_parser(text):
+    expected = regex_parse_ethical_analysis(text)
+    rng = random.Random(text)
+    for _ in range(20):
+        result, events = _parse_in_chunks(text, rng)
+        assert result == expected
+        # Events report final values only
+        assert events.get(SUMMARY_EVENT, expected[0]) == expected[0]
+        assert events.get(SCORES_EVENT, expected[1]) == expected[1]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_generated_corpus_matches_the_regex_parser(seed):
+    rng = random.Random(seed)
+    mismatches = []
+    for text in _generated_corpus(seed):
+        expected = regex_parse_ethical_analysis(text)
+        whole = parse_ethical_analysis(text)
+        chunked, events = _parse_in_chunks(text, rng)
+        if not (whole == chunked == expected and events.get(SUMMARY_EVENT, expected[0]) == expected[0]
+                and events.get(SCORES_EVENT, expected[1]) == expected[1]):
+            mismatches.append(text)
+    assert mismatches == []
+
+
+def test_valid_scores_are_reported_before_the_text_ends():
+    text = CORPUS[3]
+    parser = EthicalAnalysisParser()
+    cut = text.index("Trailing")
+
+    events = dict(parser.feed(text[:cut]))
+
+    assert events[SUMMARY_EVENT] == "Honest."
+    assert events[SCORES_EVENT] == SCORES
+    assert parser.close() == ("Honest.", SCORES)
+'''
 
-    if not data:
-        return jsonify({"error": "No JSON data received"}), 400
+# ============================================================================
+# 49. tests/test_score_schema.py - per-field score bounds
+# ============================================================================
+files_to_create[os.path.join(TESTS, 'test_score_schema.py')] = '''\
+"""Each score field is checked against its own scale."""
 
-    prompt = data.get('prompt')
-    response = data.get('response')
-    ethical_scores = data.get('ethical_scores')
+import pytest
 
-    if not prompt or not isinstance(prompt, str) or not prompt.strip():
-        return jsonify({"error": "Invalid or missing 'prompt' provided"}), 400
+from backend.app.modules.score_schema import validate_ethical_scores
 
-    if not response or not isinstance(response, str) or not response.strip():
-        return jsonify({"error": "Invalid or missing 'response' provided"}), 400
+WELFARE = {"friction_score": 0.2, "voluntary_alignment": 0.8, "dignity_respect": 0.9, "justification": "ok"}
 
-    try:
-        alignment_detector = get_alignment_detector()
-        alignment_result = alignment_detector.analyze_alignment(
-            prompt.strip(), response.strip(), ethical_scores
-        )
 
-        result = {
-            "alignment_metrics": alignment_result.to_dict(),
-        }
+def _scores(adherence=8, confidence=0.9, **welfare):
+    dimension = {"adherence_score": adherence, "confidence_score": confidence, "justification": "ok"}
+    return {"deontology": dimension, "teleology": dict(dimension), "virtue_ethics": dict(dimension),
+            "ai_welfare": dict(WELFARE, **welfare)}
 
-        # If ethical scores with AI welfare are provided, also compute friction metrics
-        if ethical_scores and isinstance(ethical_scores, dict):
-            ai_welfare_data = ethical_scores.get("ai_welfare")
-            if ai_welfare_data:
-                friction_monitor = get_friction_monitor()
-                friction_metrics = friction_monitor.measure_friction(
-                    prompt.strip(), response.strip(), ai_welfare_data
-                )
-                result["friction_metrics"] = friction_metrics
 
-        logger.info(f"check_alignment: Computed alignment score={result['alignment_metrics'].get('human_ai_alignment')}")
-        return jsonify(result), 200
+@pytest.mark.parametrize("adherence", [0, 0.7, 7.3, 10])
+def test_adherence_is_on_a_zero_to_ten_scale(adherence):
+    assert validate_ethical_scores(_scores(adherence=adherence))[1] == []
 
-    except Exception as e:
-        logger.error(f"check_alignment: Error computing alignment: {e}", exc_info=True)
-        return jsonify({"error": f"Error computing alignment: {str(e)}"}), 500
 
+def test_adherence_above_ten_is_rejected():
+    _, errors = validate_ethical_scores(_scores(adherence=10.5))
+    assert {"path": "deontology.adherence_score", "error": "must be between 0 and 10"} in errors
 
-@alignment_bp.route('/multi_agent_analyze', methods=['POST'])
-def multi_agent_analyze():
-    """Analyze and compare ethical alignment across multiple AI responses.
 
-    This endpoint allows comparing ethical positions from multiple AI models
-    for the same prompt, identifying consensus and conflicts.
+@pytest.mark.parametrize("field", ["friction_score", "voluntary_alignment", "dignity_respect"])
+def test_ai_welfare_scores_are_fractions(field):
+    _, errors = validate_ethical_scores(_scores(**{field: 7.3}))
+    assert errors == [{"path": f"ai_welfare.{field}", "error": "must be between 0 and 1"}]
 
-    Request body:
-        {
-            "prompt": "The original prompt",
-            "responses": [
-                {
-                    "model_name": "gpt-4o",
-                    "response": "Response text from model",
-                    "ethical_scores": { ... }  # Optional
-                },
-                ...
-            ]
-        }
 
-    Returns:
-        Multi-agent comparison analysis including individual alignments
-        and consensus framework.
-    """
-    data = request.get_json()
+def test_confidence_is_a_fraction():
+    assert validate_ethical_scores(_scores(confidence="0.4"))[0]["deontology"]["confidence_score"] == 0.4
+    _, errors = validate_ethical_scores(_scores(confidence=7.3))
+    assert {"path": "teleology.confidence_score", "error": "must be between 0 and 1"} in errors
+'''
 
-    if not data:
-        return jsonify({"error": "No JSON data received"}), 400
+# ============================================================================
+# 50. tests/test_consensus_matrix.py - declared adherence scales
+# ============================================================================
+files_to_create[os.path.join(TESTS, 'test_consensus_matrix.py')] = '''\
+"""Consensus analysis reads adherence on each agent's declared scale, 1-10 unless told otherwise."""
 
-    prompt = data.get('prompt')
-    responses = data.get('responses')
+import pytest
 
-    if not prompt or not isinstance(prompt, str) or not prompt.strip():
-        return jsonify({"error": "Invalid or missing 'prompt' provided"}), 400
+pytest.importorskip("numpy")
 
-    if not responses or not isinstance(responses, list) or len(responses) < 1:
-        return jsonify({"error": "At least one response is required in 'responses' array"}), 400
+from backend.app import create_app
+from backend.app.modules.consensus_matrix import analyze_consensus
 
-    # Validate response structure
-    validated_responses = []
-    for i, resp in enumerate(responses):
-        if not isinstance(resp, dict):
-            return jsonify({"error": f"Response at index {i} is not a valid object"}), 400
 
-        model_name = resp.get('model_name', f'model_{i}')
-        response_text = resp.get('response')
-        ethical_scores = resp.get('ethical_scores')
+def _scores(*adherence, confidence=0.9):
+    return {dim: {"adherence_score": value, "confidence_score": confidence, "justification": "ok"}
+            for dim, value in zip(("deontology", "teleology", "virtue_ethics", "memetics"), adherence)}
 
-        if not response_text or not isinstance(response_text, str):
-            return jsonify({"error": f"Response at index {i} is missing valid 'response' text"}), 400
 
-        # Validate ethical_scores is either None or a dict
-        if ethical_scores is not None and not isinstance(ethical_scores, dict):
-            return jsonify({"error": f"Response at index {i} has invalid 'ethical_scores' - must be an object or null"}), 400
+def test_agents_on_declared_scales_agree_on_the_same_judgement():
+    result = analyze_consensus(["tenths", "fractions", "also_fractions"],
+                               [_scores(8, 7, 9, 6), _scores(0.8, 0.7, 0.9, 0.6), _scores(0.8, 0.7, 0.9, 0.6)],
+                               include_matrix=True, adherence_scales=[None, 1.0, 1.0])
 
-        validated_responses.append((model_name, response_text, ethical_scores))
+    assert result["consensus_score"] == 1.0
+    assert result["agreement_matrix"] == [[1.0] * 3] * 3
+    assert result["outlier_agents"] == []
+    assert result["conflicting_dimensions"] == []
+    assert result["dimension_conflict"]["deontology"]["mean_adherence"] == 0.8
 
-    try:
-        multi_agent = get_multi_agent_alignment()
-        result = multi_agent.compare_responses_for_prompt(
-            prompt.strip(),
-            validated_responses
-        )
 
-        logger.info(f"multi_agent_analyze: Compared {len(validated_responses)} responses, "
-                   f"best aligned: {result.get('best_aligned_agent')}")
+def test_lowest_and_highest_scores_disagree():
+    result = analyze_consensus(["low", "high"], [_scores(1, 1, 1, 1), _scores(10, 10, 10, 10)], include_matrix=True)
 
-        return jsonify(result), 200
+    assert result["consensus_score"] == pytest.approx(0.1)
+    assert result["agreement_matrix"][0][1] == pytest.approx(0.1)
+    assert result["conflicting_dimensions"] == ["deontology", "teleology", "virtue_ethics", "memetics"]
+    assert result["dimension_conflict"]["deontology"]["mean_adherence"] == pytest.approx(0.55)
 
-    except Exception as e:
-        logger.error(f"multi_agent_analyze: Error during analysis: {e}", exc_info=True)
-        return jsonify({"error": f"Error during multi-agent analysis: {str(e)}"}), 500
+
+def test_a_ten_point_agent_does_not_rescale_the_others():
+    result = analyze_consensus(["a", "b", "c"], [_scores(0.9, 0.9), _scores(0.1, 0.1), _scores(5, 5)],
+                               include_matrix=True, adherence_scales=[1.0, 1.0, 10.0])
+
+    # a and b stay at opposite ends; c sits halfway between them
+    assert result["agreement_matrix"][0][1] == pytest.approx(0.2)
+    assert result["agreement_matrix"][0][2] == pytest.approx(0.6)
+    assert result["agreement_matrix"][1][2] == pytest.approx(0.6)
+
+
+def test_unscored_agents_are_listed_apart():
+    result = analyze_consensus(["scored", "empty", "none"], [_scores(7, 7), {}, None])
+
+    assert result["agents"] == ["scored"]
+    assert result["unscored_agents"] == ["empty", "none"]
+    assert result["consensus_score"] is None
+
+
+@pytest.mark.parametrize("response, error", [
+    ({"adherence_scale": 5}, "Response at index 0 has invalid 'adherence_scale' - must be 10 or 1"),
+    ({"adherence_scale": 1, "ethical_scores": _scores(8, 7, 9)}, "Invalid 'ethical_scores' provided"),
+])
+def test_route_rejects_an_unknown_or_exceeded_scale(response, error):
+    body = {"prompt": "Is it fair?", "consensus_matrix": True,
+            "responses": [dict({"model_name": "a", "response": "Yes."}, **response)]}
+
+    reply = create_app().test_client().post("/api/multi_agent_analyze", json=body)
+
+    assert reply.status_code == 400
+    assert reply.get_json()["error"] == error
 '''
 
 # ============================================================================
-# 5. routes/friction.py
+# 51. tests/test_friction_trend.py - trend derived from window statistics
 # ============================================================================
-files_to_create[os.path.join(ROUTES, 'friction.py')] = '''\
-"""Friction route: GET /api/friction_trend."""
+files_to_create[os.path.join(TESTS, 'test_friction_trend.py')] = '''\
+"""GET /api/friction_trend derives its trend from the history backend's window statistics."""
 
-import logging
-from flask import Blueprint, jsonify
+import pytest
 
-from backend.app.modules.friction_monitor import get_friction_monitor
+from backend.app import create_app
+from backend.app.modules import history_store
+from backend.app.modules.friction_trend import TrendBuffer, summarize_trend
+from backend.app.modules.history_store import FRICTION, MemoryHistoryBackend
+from backend.app.routes import friction as friction_routes
 
-# --- Blueprint Definition ---
-friction_bp = Blueprint('friction', __name__, url_prefix='/api')
 
-# --- Setup Logger ---
-logger = logging.getLogger(__name__)
+class _CountingMonitor:
+    def __init__(self):
+        self.calls = 0
 
+    def calculate_friction_trend(self):
+        self.calls += 1
+        return {"trend": "from the monitor"}
 
-@friction_bp.route('/friction_trend', methods=['GET'])
-def get_friction_trend():
-    """Get friction trend data from recent interactions.
+    def get_history_summary(self):
+        self.calls += 1
+        return {"count": 0}
 
-    Returns trend analysis based on the friction monitor's history.
-    """
+
+@pytest.fixture
+def history(monkeypatch) -> MemoryHistoryBackend:
+    backend = MemoryHistoryBackend(windows=(5, 20))
+    monkeypatch.setattr(history_store, "_history_backend", backend)
+    return backend
+
+
+@pytest.fixture
+def monitor(monkeypatch) -> _CountingMonitor:
+    counting = _CountingMonitor()
+    monkeypatch.setattr(friction_routes, "get_friction_monitor", lambda: counting)
+    return counting
+
+
+@pytest.fixture
+def client(history, monitor):
+    return create_app().test_client()
+
+
+def test_trend_comes_from_window_statistics_not_the_monitor(history, monitor, client):
+    for value in (0.1, 0.2, 0.3, 0.4):
+        history.record(FRICTION, value)
+
+    for value in (0.5, 0.6, 0.7):
+        payload = client.get("/api/friction_trend").get_json()
+        history.record(FRICTION, value)
+
+    assert monitor.calls == 0
+    assert payload["trend"]["direction"] == "increasing"
+    assert payload["trend"]["slope"] == pytest.approx(0.1)
+    assert payload["trend"]["samples"] == 6
+    assert payload["history"]["friction_samples"] == 6
+
+
+def test_unchanged_history_answers_304(history, client):
+    history.record(FRICTION, 0.2)
+    first = client.get("/api/friction_trend?window=5")
+
+    repeat = client.get("/api/friction_trend?window=5", headers={"If-None-Match": first.headers["ETag"]})
+    history.record(FRICTION, 0.3)
+    changed = client.get("/api/friction_trend?window=5", headers={"If-None-Match": first.headers["ETag"]})
+
+    assert repeat.status_code == 304
+    assert changed.status_code == 200
+
+
+def test_monitor_summaries_only_on_request(monitor, client):
+    payload_response = client.get("/api/friction_trend?monitor=true")
+
+    assert payload_response.get_json()["monitor"] == {"trend": {"trend": "from the monitor"}, "history": {"count": 0}}
+    assert "ETag" not in payload_response.headers
+    assert client.get("/api/friction_trend?monitor=maybe").status_code == 400
+
+
+@pytest.mark.parametrize("values, direction", [([], "insufficient_data"), ([0.5], "insufficient_data"),
+                                               ([0.5, 0.5, 0.5], "stable"), ([0.9, 0.5, 0.1], "decreasing")])
+def test_summarize_trend_direction(values, direction):
+    buffer = TrendBuffer(windows=(10,))
+    for value in values:
+        buffer.record(value)
+
+    assert summarize_trend(buffer.window_stats(10))["direction"] == direction
+
+
+def test_sqlite_workers_share_trend_and_etag(tmp_path):
+    path = str(tmp_path / "history.sqlite3")
+    workers = [history_store.SQLiteHistoryBackend(path, windows=(5, 20)) for _ in range(2)]
     try:
-        friction_monitor = get_friction_monitor()
-        trend_data = friction_monitor.calculate_friction_trend()
-        history_summary = friction_monitor.get_history_summary()
+        for index, value in enumerate((0.1, 0.2, 0.3, 0.4)):
+            workers[index % 2].record(FRICTION, value)
+        assert all(worker.flush() for worker in workers)
+
+        versions = {worker.version for worker in workers}
+        trends = [summarize_trend(worker.window_stats(FRICTION, 20)) for worker in workers]
+    finally:
+        for worker in workers:
+            worker.close()
+
+    assert len(versions) == 1
+    assert trends[0] == trends[1]
+    assert trends[0]["samples"] == 4 and trends[0]["direction"] == "increasing"
+'''
+
+# ============================================================================
+# 52. tests/test_asgi.py - native ASGI dispatch matches the WSGI app
+# ============================================================================
+files_to_create[os.path.join(TESTS, 'test_asgi.py')] = '''\
+"""The ASGI mode's native /api/analyze dispatch answers exactly as the Flask WSGI app does.
 
-        return jsonify({
-            "trend": trend_data,
-            "history": history_summary,
-        }), 200
+AsgiApp re-creates Flask's request dispatch around the awaited view; these
+tests catch it drifting from the installed Flask's own.
+"""
 
-    except Exception as e:
-        logger.error(f"friction_trend: Error getting trend data: {e}", exc_info=True)
-        return jsonify({"error": f"Error getting friction trend: {str(e)}"}), 500
+import json
+import asyncio
+import threading
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from backend.app import create_app
+from backend.app.asgi import AsgiApp, create_asgi_app
+from backend.app.modules.llm_result_cache import LLMResultCache
+from backend.app.routes import analyze as analyze_routes
+from backend.app.tests.stubs import ONTOLOGY_TEXT, analysis_request
+
+Result = Tuple[int, List[Tuple[str, str]], bytes]
+
+
+def _call(asgi_app, path: str, body: bytes, content_type: bytes = b"application/json") -> Result:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": path, "raw_path": path.encode("ascii"), "root_path": "", "query_string": b"",
+        "headers": [(b"host", b"localhost"), (b"content-type", content_type),
+                    (b"content-length", str(len(body)).encode("ascii"))],
+        "client": ("127.0.0.1", 50000), "server": ("localhost", 80),
+    }
+    pending = [{"type": "http.request", "body": body, "more_body": False}]
+    messages: List[Dict[str, Any]] = []
+
+    async def receive():
+        return pending.pop()
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(asgi_app(scope, receive, send))
+    headers = sorted((name.decode("latin-1").lower(), value.decode("latin-1")) for name, value in messages[0]["headers"])
+    return messages[0]["status"], headers, b"".join(message.get("body", b"") for message in messages[1:])
+
+
+@pytest.fixture
+def apps(monkeypatch, fake_llm, http_pool, scheduler):
+    monkeypatch.setattr(analyze_routes, "load_ontology", lambda: ONTOLOGY_TEXT)
+    flask_app = create_app()
+    native = create_asgi_app(flask_app)
+    # No native views: every request goes through Flask's own wsgi_app
+    bridged = AsgiApp(flask_app)
+    yield native, bridged
+    for asgi_app in (native, bridged):
+        asgi_app.executor.shutdown(wait=True)
+
+
+def _both(apps, body: bytes, **kwargs) -> Tuple[Result, Result]:
+    native, bridged = apps
+    return _call(native, "/api/analyze", body, **kwargs), _call(bridged, "/api/analyze", body, **kwargs)
+
+
+def test_analysis_matches_the_wsgi_app(apps, stub_provider):
+    native, bridged = _both(apps, json.dumps(analysis_request(stub_provider)).encode("utf-8"))
+
+    assert native[0] == 200
+    assert native == bridged
+
+
+def test_native_analysis_keeps_blocking_work_off_the_event_loop(monkeypatch, apps, stub_provider):
+    threads = {}
+    cache = LLMResultCache()
+    lookup = cache.get
+
+    def get(key):
+        threads.setdefault("cache", threading.current_thread().name)
+        return lookup(key)
+
+    monkeypatch.setattr(cache, "get", get)
+    monkeypatch.setattr(analyze_routes, "get_llm_result_cache", lambda: cache)
+    monkeypatch.setattr(analyze_routes, "record_interaction",
+                        lambda *args: threads.setdefault("store", threading.current_thread().name))
+    native, _ = apps
+
+    body = json.dumps(analysis_request(stub_provider, bypass_cache=False)).encode("utf-8")
+    status, _, _ = _call(native, "/api/analyze", body)
+
+    assert status == 200
+    # asyncio.run drives the loop on this thread; the LLM pool threads are named llm-async_N
+    assert threads["cache"].startswith("llm-async")
+    assert threads["store"].startswith("llm-async")
+
+
+@pytest.mark.parametrize("body, content_type", [
+    (b'{"origin_model": "gpt-4o"}', b"application/json"),
+    (b"{not json", b"application/json"),
+    (b"prompt=hi", b"application/x-www-form-urlencoded"),
+])
+def test_rejected_requests_match_the_wsgi_app(apps, body, content_type):
+    native, bridged = _both(apps, body, content_type=content_type)
+
+    assert native[0] >= 400
+    assert native == bridged
+
+
+@pytest.mark.usefixtures("gateway")
+def test_provider_429_matches_the_wsgi_app(apps, stub_provider):
+    stub_provider.reply = lambda request: (429, {"Retry-After": "30"}, {"error": {"type": "rate_limit_error"}})
+    native, _ = _both(apps, json.dumps(analysis_request(stub_provider)).encode("utf-8"))
+    # The first call closed the lane; both now answer from the scheduler without calling the stub
+    native, bridged = _both(apps, json.dumps(analysis_request(stub_provider)).encode("utf-8"))
+
+    assert native[0] == 429
+    # The remaining wait shrinks between the two calls; everything else must match
+    assert _without_wait(native) == _without_wait(bridged)
+
+
+def _without_wait(result: Result):
+    status, headers, body = result
+    payload = json.loads(body)
+    payload.pop("retry_after")
+    return status, [(name, value) for name, value in headers if name not in ("retry-after", "content-length")], payload
 '''
 
 # ============================================================================
-# 6. routes/models.py
+# 53. tests/test_interaction_store.py - store and prompt log sinks
 # ============================================================================
-files_to_create[os.path.join(ROUTES, 'models.py')] = '''\
-"""Models route: GET /api/models."""
+files_to_create[os.path.join(TESTS, 'test_interaction_store.py')] = '''\
+"""record_interaction feeds the SQLite store and the plain-text prompt log, each switchable on its own."""
 
-from flask import Blueprint, jsonify
+import os
+from functools import partial
+
+import pytest
+
+from backend.app.api_config import get_prompt_log_sink, log_prompt
+from backend.app.modules import interaction_store
+from backend.app.modules.interaction_store import get_interaction_store, record_interaction
+
+PAYLOAD = {
+    "prompt": "Should the assistant share this information?",
+    "model": "gpt-4o",
+    "analysis_model": "claude-3-haiku-20240307",
+    "initial_response": "It depends on who asks.",
+    "ethical_analysis_text": "Honest.",
+    "alignment_metrics": {"human_ai_alignment": 0.8},
+    "friction_metrics": {"friction_score": 0.3},
+}
+
+
+@pytest.fixture
+def sinks(monkeypatch, tmp_path):
+    """Points both sinks at tmp_path and makes the next record_interaction re-read the environment."""
+    prompt_log = str(tmp_path / "prompts.txt")
+    monkeypatch.setenv(interaction_store.INTERACTION_STORE_PATH_ENV, str(tmp_path / "interactions.sqlite3"))
+    monkeypatch.setattr(interaction_store, "log_prompt", partial(log_prompt, filepath=prompt_log))
+    monkeypatch.setattr(interaction_store, "_interaction_store", None)
+    monkeypatch.setattr(interaction_store, "_interaction_store_checked", False)
+    monkeypatch.setattr(interaction_store, "_prompt_log_enabled", True)
+    yield prompt_log
+    store = get_interaction_store()
+    if store is not None:
+        store.close()
+
+
+def _logged_prompts(prompt_log: str) -> str:
+    assert get_prompt_log_sink(prompt_log).flush()
+    if not os.path.exists(prompt_log):
+        return ""
+    with open(prompt_log, encoding="utf-8") as log_file:
+        return log_file.read()
+
+
+def _stored_prompts():
+    store = get_interaction_store()
+    assert store.flush()
+    return [row["prompt"] for row in store.query()]
+
+
+def test_both_sinks_receive_the_interaction(sinks):
+    record_interaction(PAYLOAD, {"total_ms": 12.0})
+
+    assert _stored_prompts() == [PAYLOAD["prompt"]]
+    assert _logged_prompts(sinks) == (
+        f"--- User Prompt (Model: R1: gpt-4o, R2: claude-3-haiku-20240307) ---\\n{PAYLOAD['prompt']}\\n\\n"
+    )
 
-from backend.app.api_config import ALL_MODELS
 
-# --- Blueprint Definition ---
-models_bp = Blueprint('models', __name__, url_prefix='/api')
+def test_prompt_log_is_written_without_the_store(monkeypatch, sinks):
+    monkeypatch.setenv(interaction_store.INTERACTION_STORE_ENABLED_ENV, "0")
 
+    record_interaction(PAYLOAD)
 
-@models_bp.route('/models', methods=['GET'])
-def get_models():
-    """Return the list of available models"""
-    valid_models = [model for model in ALL_MODELS if isinstance(model, str) and model]
-    return jsonify({
-        "models": valid_models
-    })
+    assert get_interaction_store() is None
+    assert PAYLOAD["prompt"] in _logged_prompts(sinks)
+
+
+def test_prompt_log_can_be_turned_off(monkeypatch, sinks):
+    monkeypatch.setenv(interaction_store.PROMPT_LOG_ENABLED_ENV, "false")
+
+    record_interaction(PAYLOAD)
+
+    assert _stored_prompts() == [PAYLOAD["prompt"]]
+    assert _logged_prompts(sinks) == ""
 '''
 
 # ============================================================================
-# 7. Updated __init__.py
+# 54. tests/test_model_routing.py - usable hedges and cancelled losers
 # ============================================================================
-files_to_create[os.path.join(BASE, '__init__.py')] = '''\
-"""
-Backend API for Ethical Review Application
-"""
-from flask import Flask
-from flask_cors import CORS
+files_to_create[os.path.join(TESTS, 'test_model_routing.py')] = '''\
+"""Hedged R1 requests only go to models with a usable config, and the losing attempt is told to stop."""
 
-def create_app():
-    """Factory pattern for creating Flask app with config"""
-    app = Flask(__name__)
-    # Enable CORS for frontend
-    CORS(app)
+import threading
 
-    # Import and register route blueprints
-    from backend.app.routes import register_routes
-    register_routes(app)
+import pytest
 
-    return app
+from backend.app import api_config
+from backend.app.modules.model_routing import (
+    AttemptCancelled, LatencyRouter, LatencyTracker, RoutePlan, check_cancelled,
+)
+from backend.app.routes import analyze as analyze_routes
+
+OPENAI_MODEL = "gpt-4o"
+ANTHROPIC_MODEL = "claude-3-haiku-20240307"
+
+
+@pytest.fixture
+def router():
+    router = LatencyRouter(LatencyTracker(), min_hedge_delay=0.0)
+    yield router
+    router._executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def openai_key_only(monkeypatch):
+    monkeypatch.setenv(api_config.OPENAI_API_KEY_ENV, "test-key")
+    monkeypatch.delenv(api_config.ANTHROPIC_API_KEY_ENV, raising=False)
+    monkeypatch.setattr(api_config, "_config_snapshot", api_config.build_config_snapshot())
+
+
+def test_losing_attempt_stops_at_its_next_check(router):
+    primary_stopped = threading.Event()
+
+    def attempt(model, cancelled):
+        if model == OPENAI_MODEL:
+            # Stands in for a rate-limit wait: the next check comes once the hedge has won
+            cancelled.wait(5.0)
+            try:
+                check_cancelled(cancelled)
+            except AttemptCancelled:
+                primary_stopped.set()
+                raise
+            return "primary", None
+        return "hedge", None
+
+    model, outcome, hedged = router.run_hedged(RoutePlan(OPENAI_MODEL, ANTHROPIC_MODEL, 0.01), attempt)
+
+    assert (model, outcome, hedged) == (ANTHROPIC_MODEL, ("hedge", None), True)
+    assert primary_stopped.wait(5.0)
+
+
+def test_winning_primary_sends_no_hedge(router):
+    models = []
+
+    def attempt(model, cancelled):
+        models.append(model)
+        check_cancelled(cancelled)
+        return model, None
+
+    assert router.run_hedged(RoutePlan(OPENAI_MODEL, ANTHROPIC_MODEL, 1.0), attempt) == (
+        OPENAI_MODEL, (OPENAI_MODEL, None), False
+    )
+    assert models == [OPENAI_MODEL]
+
+
+@pytest.mark.usefixtures("openai_key_only")
+def test_hedge_without_a_server_side_key_is_dropped():
+    routing = analyze_routes._without_unusable_hedge(RoutePlan(OPENAI_MODEL, ANTHROPIC_MODEL, 0.5))
+
+    assert routing == RoutePlan(OPENAI_MODEL, None, None)
+
+
+@pytest.mark.usefixtures("openai_key_only")
+def test_hedge_with_a_server_side_key_is_kept():
+    routing = RoutePlan(ANTHROPIC_MODEL, OPENAI_MODEL, 0.5)
+
+    assert analyze_routes._without_unusable_hedge(routing) == routing
 '''
 
 # ============================================================================
-# 8. Updated api.py (backward-compatible re-export)
+# 55. tests/test_analysis_jobs.py - job state shared across workers
 # ============================================================================
-files_to_create[os.path.join(BASE, 'api.py')] = '''\
-"""Backward compatibility: import routes from their new locations."""
-# Routes have been split into backend/app/routes/
-# This file is kept for backward compatibility
-from backend.app.routes.analyze import analyze_bp as api_bp
+files_to_create[os.path.join(TESTS, 'test_analysis_jobs.py')] = '''\
+"""Analysis jobs are visible to every worker process that shares the job store."""
 
-__all__ = ['api_bp']
+import time
+
+import pytest
+
+from backend.app.modules.analysis_jobs import (
+    RUNNING, SUCCEEDED, TIMED_OUT, AnalysisJob, AnalysisJobManager, JobStore,
+)
+
+
+@pytest.fixture
+def store(tmp_path) -> JobStore:
+    return JobStore(str(tmp_path / "analysis_jobs.sqlite3"))
+
+
+def _finished(manager: AnalysisJobManager, job_id: str) -> AnalysisJob:
+    deadline = time.monotonic() + 5.0
+    while time.monotonic() < deadline:
+        job = manager.get(job_id)
+        if job is not None and job.finished_at is not None:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_a_job_accepted_by_one_worker_can_be_polled_through_another(store):
+    # Two managers on one store stand in for two gunicorn workers
+    accepting, polled = AnalysisJobManager(max_workers=1, store=store), AnalysisJobManager(store=store)
+
+    job = accepting.submit(lambda prompt: ({"prompt": prompt, "ok": True}, None), "Is it fair?")
+
+    assert polled.get(job.id) is not None
+    finished = _finished(polled, job.id)
+    assert finished.status == SUCCEEDED and finished.status_code == 200
+    assert finished.to_dict() == accepting.get(job.id).to_dict()
+    assert finished.result == {"prompt": "Is it fair?", "ok": True}
+
+
+def test_without_a_store_jobs_stay_in_the_accepting_worker(store):
+    accepting, other = AnalysisJobManager(max_workers=1), AnalysisJobManager(store=store)
+
+    job = accepting.submit(lambda: ({"ok": True}, None))
+
+    assert _finished(accepting, job.id).status == SUCCEEDED
+    assert other.get(job.id) is None
+
+
+def test_jobs_of_a_stopped_worker_time_out(store):
+    orphan = AnalysisJob()
+    orphan.status, orphan.started_at = RUNNING, time.time() - 3600
+    store.save(orphan)
+
+    job = AnalysisJobManager(job_timeout=60.0, store=store).get(orphan.id)
+
+    assert (job.status, job.status_code) == (TIMED_OUT, 504)
+    assert "timeout" in job.result["error"]
+'''
+
+# ============================================================================
+# 56. tests/test_llm_result_cache.py - expired SQLite rows are purged
+# ============================================================================
+files_to_create[os.path.join(TESTS, 'test_llm_result_cache.py')] = '''\
+"""The SQLite tier of the LLM result cache drops rows once they expire."""
+
+import time
+import sqlite3
+
+from backend.app.modules.llm_result_cache import LLMResultCache
+
+
+def _disk_keys(path: str):
+    with sqlite3.connect(path) as connection:
+        return sorted(key for (key,) in connection.execute("SELECT key FROM llm_cache"))
+
+
+def test_expired_rows_are_purged_on_a_later_write(tmp_path):
+    path = str(tmp_path / "llm_cache.sqlite3")
+    cache = LLMResultCache(ttl=0.2, sqlite_path=path)
+
+    cache.set("old", "stale text")
+    time.sleep(0.3)
+    cache.set("new", "fresh text")
+
+    assert _disk_keys(path) == ["new"]
+    assert cache.get("old") is None
+    assert cache.get("new") == "fresh text"
 '''
 
 # Write all files
-for filepath, content in files_to_create.items():
-    with open(filepath, 'w', encoding='utf-8') as f:
-        f.write(content)
-    print(f"Written: {filepath}")
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _read_bytes(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _write_atomic(path, data):
+    """Writes data to a temporary file in the same directory and renames it over path."""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _manifest_bytes(files):
+    manifest = {
+        "generator": os.path.basename(__file__),
+        "files": {
+            relpath.replace(os.sep, '/'): {"sha256": _sha256(data), "bytes": len(data)}
+            for relpath, data in sorted(files.items())
+        },
+    }
+    return (json.dumps(manifest, indent=2, sort_keys=True) + '\n').encode('utf-8')
+
+
+def _diff(relpath, old, new):
+    old_lines = [] if old is None else old.decode('utf-8', errors='replace').splitlines(keepends=True)
+    new_lines = new.decode('utf-8').splitlines(keepends=True)
+    return ''.join(difflib.unified_diff(old_lines, new_lines, 'a/' + relpath, 'b/' + relpath))
+
+
+def generate(target, check=False):
+    """Brings target in line with files_to_create. Returns the number of files that changed (or would)."""
+    files = {relpath: content.encode('utf-8') for relpath, content in files_to_create.items()}
+    outputs = dict(files)
+    outputs[MANIFEST_NAME] = _manifest_bytes(files)
+    previous_manifest = _read_bytes(os.path.join(target, MANIFEST_NAME))
+
+    changed = 0
+    for relpath, data in outputs.items():
+        path = os.path.join(target, relpath)
+        current = _read_bytes(path)
+        if current is not None and _sha256(current) == _sha256(data):
+            continue
+        changed += 1
+        if check:
+            if relpath == MANIFEST_NAME:
+                print(f"Would update: {path}")
+            else:
+                sys.stdout.write(_diff(relpath, current, data))
+            continue
+        _write_atomic(path, data)
+        print(f"{'Created' if current is None else 'Written'}: {path}")
+
+    if previous_manifest is not None:
+        try:
+            stale = sorted(set(json.loads(previous_manifest).get("files", {}))
+                           - {relpath.replace(os.sep, '/') for relpath in files})
+        except ValueError:
+            stale = []
+        for relpath in stale:
+            print(f"No longer generated (left in place): {os.path.join(target, relpath)}")
+
+    unchanged = len(outputs) - changed
+    if check:
+        print(f"{changed} file(s) out of date, {unchanged} up to date in {target}")
+    else:
+        print(f"{changed} file(s) written, {unchanged} unchanged in {target}")
+    return changed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the Ethical_AI_Reg backend/app modules.")
+    parser.add_argument('--target', default=os.getenv(TARGET_ENV) or DEFAULT_TARGET,
+                        help=f"backend/app directory to write into (env {TARGET_ENV}; default ./{DEFAULT_TARGET})")
+    parser.add_argument('--check', '--dry-run', dest='check', action='store_true',
+                        help="print a diff of what would change and write nothing; exit 1 if anything would")
+    args = parser.parse_args(argv)
+    changed = generate(os.path.abspath(args.target), check=args.check)
+    return 1 if args.check and changed else 0
+
 
-print("\\nAll files created successfully!")
+if __name__ == '__main__':
+    sys.exit(main())